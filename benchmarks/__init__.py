@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Throughput benchmarks for squeal, run from the top of the source tree with:
+
+    python -m benchmarks.run [--lines N] [--baseline FILE] [--save-baseline FILE]
+
+See benchmarks.run for the stages timed, and benchmarks.generators for the
+synthetic inputs.  The time the squeal command takes to start up is
+benchmarked separately, with:
+
+    python -m benchmarks.startup [--runs N] [--baseline FILE] [--save-baseline FILE]
+"""
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Deterministic generators of synthetic input for the benchmarks, one per kind
+of input squeal parses.  Each writes a given number of lines (or packets) to
+a file, the same ones every time for a given seed.
+"""
+
+import os
+import random
+import struct
+
+from squeal.tcpdump import TcpDump
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+HOSTS = ['brick', 'mail', 'www1', 'www2', 'db']
+PROGRAMS = ['kernel', 'sshd', 'crond', 'avahi-daemon', 'NetworkManager',
+            'dhclient', 'ntpd']
+WORDS = ['starting', 'stopped', 'connection', 'from', 'to', 'interface',
+         'eth0', 'failed', 'accepted', 'session', 'opened', 'closed', 'user',
+         'root', 'for', 'address', '192.168.122.1', 'timeout', 'link', 'up']
+
+def _syslog_time(rng, i):
+    # (roughly in order, as in a real log)
+    return '%s %2i %02i:%02i:%02i' % (MONTHS[(i // 100000) % 12],
+                                     (i // 10000) % 28 + 1,
+                                     (i // 600) % 24, (i // 10) % 60,
+                                     rng.randrange(60))
+
+def _words(rng, lo, hi):
+    return ' '.join([rng.choice(WORDS) for i in range(rng.randint(lo, hi))])
+
+def generate_httpd(f, num_lines, seed=0):
+    rng = random.Random(seed)
+    paths = ['/', '/index.html', '/favicon.ico', '/css/site.css',
+             '/js/app.js', '/images/logo.png', '/search', '/login']
+    agents = ['Mozilla/5.0 (X11; Linux x86_64)', 'curl/7.19.0',
+              'Wget/1.11.4', 'Googlebot/2.1']
+    for i in range(num_lines):
+        path = rng.choice(paths)
+        if path == '/search':
+            path += '?q=%s' % rng.choice(WORDS)
+        status = rng.choice([200, 200, 200, 200, 304, 304, 404, 500])
+        if status == 304:
+            size = '-'
+        else:
+            size = str(rng.randrange(20, 200000))
+        f.write('10.%i.%i.%i - %s [%02i/%s/2009:%02i:%02i:%02i -0500] '
+                '"%s %s HTTP/1.1" %i %s "-" "%s"\n'
+                % (rng.randrange(4), rng.randrange(256), rng.randrange(256),
+                   rng.choice(['-', '-', '-', 'jdoe']),
+                   (i // 10000) % 28 + 1, MONTHS[(i // 300000) % 12],
+                   (i // 600) % 24, (i // 10) % 60, rng.randrange(60),
+                   rng.choice(['GET', 'GET', 'GET', 'POST', 'HEAD']), path,
+                   status, size, rng.choice(agents)))
+
+def generate_syslog(f, num_lines, seed=0):
+    rng = random.Random(seed)
+    for i in range(num_lines):
+        program = rng.choice(PROGRAMS)
+        if program == 'kernel':
+            source = program
+        else:
+            source = '%s[%i]' % (program, rng.randrange(1, 32768))
+        f.write('%s %s %s: %s\n' % (_syslog_time(rng, i), rng.choice(HOSTS),
+                                    source, _words(rng, 3, 12)))
+
+def generate_maillog(f, num_lines, seed=0):
+    rng = random.Random(seed)
+    for i in range(num_lines):
+        pid = rng.randrange(1, 32768)
+        msgid = 'n2F8%05iZV%06i' % (rng.randrange(100000), pid)
+        kind = rng.randrange(4)
+        if kind == 0:
+            message = ('%s: from=<%s@example.com>, size=%i, class=0, '
+                       'nrcpts=%i, msgid=<%s@%s.example.com>, proto=ESMTP, '
+                       'daemon=MTA, relay=localhost.localdomain [127.0.0.1]'
+                       % (msgid, rng.choice(['root', 'jdoe', 'nobody']),
+                          rng.randrange(200, 50000), rng.randint(1, 3),
+                          msgid, rng.choice(HOSTS)))
+            program = 'sendmail'
+        elif kind == 1:
+            message = ('%s: to=%s, ctladdr=root (0/0), delay=00:00:%02i, '
+                       'xdelay=00:00:00, mailer=relay, pri=%i, '
+                       'relay=[127.0.0.1] [127.0.0.1], dsn=2.0.0, '
+                       'stat=Sent (%s Message accepted for delivery)'
+                       % (msgid, rng.choice(['root', 'jdoe']),
+                          rng.randrange(60), rng.randrange(30000, 40000),
+                          msgid))
+            program = 'sendmail'
+        elif kind == 2:
+            message = ('spamd: result: . %i - BAYES_00 scantime=0.%i,'
+                       'size=%i,user=david,uid=4044,required_score=5.0'
+                       % (rng.randrange(-5, 10), rng.randrange(10),
+                          rng.randrange(200, 50000)))
+            program = 'spamd'
+        else:
+            message = _words(rng, 3, 8)
+            program = rng.choice(['dovecot', 'postfix/smtpd'])
+        f.write('%s %s %s[%i]: %s\n' % (_syslog_time(rng, i),
+                                        rng.choice(HOSTS), program, pid,
+                                        message))
+
+def generate_yum(f, num_lines, seed=0):
+    rng = random.Random(seed)
+    names = ['bash', 'kernel-devel', 'net-snmp-libs', 'rpm-build',
+             'NetworkManager-glib', 'SDL_mixer', 'python-libs', 'glibc']
+    arches = ['i386', 'i686', 'x86_64', 'noarch']
+    for i in range(num_lines):
+        time = '%s %02i %02i:%02i:%02i' % (MONTHS[(i // 10000) % 12],
+                                           (i // 300) % 28 + 1,
+                                           (i // 60) % 24, i % 60,
+                                           rng.randrange(60))
+        event = rng.choice(['Installed', 'Updated', 'Updated', 'Erased'])
+        name = rng.choice(names)
+        version = '%i.%i.%i' % (rng.randrange(5), rng.randrange(20),
+                                rng.randrange(10))
+        release = '%i.fc%i' % (rng.randrange(1, 9), rng.randrange(8, 12))
+        arch = rng.choice(arches)
+        epoch = rng.randrange(3)
+        if event == 'Erased':
+            package = name
+        else:
+            package = rng.choice(['%(name)s-%(version)s-%(release)s.%(arch)s',
+                                  '%(epoch)i:%(name)s-%(version)s-%(release)s.%(arch)s',
+                                  '%(name)s.%(arch)s %(epoch)i:%(version)s-%(release)s',
+                                  '%(name)s.%(arch)s %(version)s-%(release)s',
+                                  '%(name)s - %(version)s-%(release)s.%(arch)s']) \
+                      % locals()
+        f.write('%s %s: %s\n' % (time, event, package))
+
+def _iter_packets(num_packets, seed):
+    # Generate (timestamp, src_mac, dst_mac, src_ip, dst_ip, sport, dport,
+    # payload length) for UDP packets between a few hosts
+    rng = random.Random(seed)
+    macs = ['00:16:3e:%02x:%02x:%02x' % (i, i * 7 % 256, i * 13 % 256)
+            for i in range(1, 6)]
+    for i in range(num_packets):
+        src, dst = rng.sample(range(len(macs)), 2)
+        yield (1234567890 + i // 100, (i % 100) * 10000 + rng.randrange(10000),
+               macs[src], macs[dst], '192.168.122.%i' % (src + 1),
+               '192.168.122.%i' % (dst + 1), rng.randrange(1024, 65536),
+               rng.choice([53, 123, 5353]), rng.randrange(8, 512))
+
+def _mac_bytes(mac):
+    return bytes([int(octet, 16) for octet in mac.split(':')])
+
+def _ip_bytes(ip):
+    return bytes([int(octet) for octet in ip.split('.')])
+
+def generate_pcap(f, num_packets, seed=0):
+    """
+    Write a pcap capture file of UDP-over-IPv4-over-Ethernet packets (so f
+    must be opened in binary mode)
+    """
+    # Global header: magic, version 2.4, GMT offset, accuracy, snaplen,
+    # Ethernet link type
+    f.write(struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+    for (secs, usecs, src_mac, dst_mac, src_ip, dst_ip,
+         sport, dport, length) in _iter_packets(num_packets, seed):
+        udp = struct.pack('!HHHH', sport, dport, 8 + length, 0) \
+              + b'\0' * length
+        ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(udp), 0, 0, 64,
+                         17, 0, _ip_bytes(src_ip), _ip_bytes(dst_ip)) + udp
+        frame = _mac_bytes(dst_mac) + _mac_bytes(src_mac) + b'\x08\x00' + ip
+        f.write(struct.pack('<IIII', secs, usecs, len(frame), len(frame)))
+        f.write(frame)
+
+def generate_tcpdump_text(f, num_packets, seed=0):
+    """
+    Write what "tcpdump -tt -e -r" prints for the packets generate_pcap
+    writes for the same seed
+    """
+    for (secs, usecs, src_mac, dst_mac, src_ip, dst_ip,
+         sport, dport, length) in _iter_packets(num_packets, seed):
+        f.write('%i.%06i %s (oui Unknown) > %s (oui Unknown), '
+                'ethertype IPv4 (0x0800), length %i: %s.%i > %s.%i: '
+                'UDP, length %i\n'
+                % (secs, usecs, src_mac, dst_mac, 14 + 20 + 8 + length,
+                   src_ip, sport, dst_ip, dport, length))
+
+class InputKind(object):
+    """
+    A kind of input to benchmark: how to generate it (into a file with the
+    given name, opened in binary mode if the generator writes bytes), the
+    squeal source class that parses it, and some typical queries, as
+    (select list, rest of query) pairs
+    """
+    def __init__(self, name, filename, generate, source_class, queries,
+                 binary=False, detect_as=None):
+        self.name = name
+        self.filename = filename
+        self.generate = generate
+        self.source_class = source_class
+        self.queries = queries
+        self.binary = binary
+        # (the InputKind to generate for timing file-type detection instead,
+        # if the file parsed isn't what squeal would be given)
+        self.detect_as = detect_as
+
+    def __repr__(self):
+        return 'InputKind(%r)' % self.name
+
+    def get_source_class(self):
+        from squeal.inputs import load_class
+        return load_class(self.source_class)
+
+    def write(self, directory, num_lines, seed=0):
+        """
+        Generate the input in directory, returning its path
+        """
+        path = os.path.join(directory, self.filename)
+        if self.binary:
+            f = open(path, 'wb')
+        else:
+            f = open(path, 'w')
+        try:
+            self.generate(f, num_lines, seed)
+        finally:
+            f.close()
+        return path
+
+KINDS = [
+    InputKind('httpd', 'access_log', generate_httpd, 'squeal.httpdlog.HttpdLog',
+              [('count(*) from', ''),
+               ('status, count(*), total(size) from', 'group by status'),
+               ('host, request from', "where status = 404"),
+               ('request, count(*) from',
+                "where request like '%search%' group by request "
+                "order by count(*) desc, request limit 5")]),
+    InputKind('syslog', 'messages', generate_syslog, 'squeal.syslog.SysLog',
+              [('source, count(*) from', 'group by source'),
+               ('time, message from', "where hostname = 'db' limit 100"),
+               ('hostname, count(*) from',
+                "where message like '%failed%' group by hostname")]),
+    InputKind('maillog', 'maillog', generate_maillog, 'squeal.maillog.MailLog',
+              [('program, count(*) from', 'group by program'),
+               ('from_, count(*), total(size) from',
+                'where from_ is not null group by from_'),
+               ('msgid, relay from', 'where nrcpts > 1')]),
+    InputKind('yum', 'yum.log', generate_yum, 'squeal.yumlog.YumLog',
+              [('event, count(*) from', 'group by event'),
+               ('name, max(version) from', "where arch = 'noarch' group by name")]),
+    InputKind('pcap', 'capture.txt', generate_tcpdump_text,
+              'benchmarks.generators.TcpDumpText',
+              [('src_host, dst_host, count(*) from',
+                'group by src_host, dst_host'),
+               ('timestamp, length from', "where dst_host like '%.53'")],
+              detect_as=InputKind('pcap', 'capture.pcap', generate_pcap,
+                                  'squeal.tcpdump.TcpDump', [], binary=True)),
+]
+
+def get_kind(name):
+    for kind in KINDS:
+        if kind.name == name:
+            return kind
+    raise KeyError(name)
+
+class TcpDumpText(TcpDump):
+    """
+    Parses the text that tcpdump would print for a capture, as
+    generate_tcpdump_text writes, so that TcpDump's parsing can be
+    benchmarked without tcpdump itself
+    """
+    def _run_tcpdump(self, filename):
+        f = open(filename)
+        try:
+            for line in f:
+                yield line.rstrip('\n')
+        finally:
+            f.close()
+
+import unittest
+class GeneratorTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.testing import make_tmpdir
+        self.tmpdir = make_tmpdir(self)
+
+    def test_parseable(self):
+        # Every line must parse, the same way each time:
+        for kind in KINDS:
+            path = kind.write(self.tmpdir, 200)
+            src = kind.get_source_class()(path)
+            for line in open(path):
+                self.assert_(src.parse_as_dict(line.rstrip('\n')) is not None,
+                             '%s: %r' % (kind.name, line))
+            rows = list(src.iter_dicts())
+            self.assertEquals(len(rows), 200)
+            kind.write(self.tmpdir, 200)
+            self.assertEquals(list(src.iter_dicts()), rows)
+
+    def test_pcap(self):
+        path = os.path.join(self.tmpdir, 'capture.pcap')
+        f = open(path, 'wb')
+        generate_pcap(f, 10)
+        f.close()
+        data = open(path, 'rb').read()
+        self.assert_(data.startswith(b'\xd4\xc3\xb2\xa1'))
+        # (global header, then a record header and 14 + 28 + payload bytes
+        # per packet)
+        sizes = [16 + 42 + p[-1] for p in _iter_packets(10, 0)]
+        self.assertEquals(len(data), 24 + sum(sizes))
+
+if __name__=='__main__':
+    unittest.main()
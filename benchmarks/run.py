@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Times squeal's stages separately on synthetic input of each kind (see
+benchmarks.generators):
+
+   detect   recognising the type of the file (10 times over, uncached)
+   parse    parsing it into row tuples
+   load     inserting those rows into sqlite
+   query    running the kind's queries on the loaded table
+   render   writing all of the rows out as a text table
+   execute  running the kind's queries from scratch, as the squeal command
+            would (with whatever engine it picks)
+
+Each kind runs in a process of its own, so that the peak memory reported
+for it is its own.  Rates are in rows (of input) per second.
+
+The results of "execute" are checked against those of the plain sqlite path
+(without pushing anything down), and of parsing in worker processes.  Any
+difference, or a rate more than --tolerance below that in a --baseline file
+(as written by --save-baseline), gives an exit code of 1.
+"""
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+
+STAGES = ['detect', 'parse', 'load', 'query', 'render', 'execute']
+
+def get_peak_rss():
+    # (in MB; ru_maxrss is in kB on Linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+class StageTimer(object):
+    """
+    Collects the wall and CPU time taken by each stage, and the number of
+    rows it handled
+    """
+    def __init__(self):
+        self.results = {}
+
+    def time(self, stage, num_rows, fn, *args):
+        start_cpu = time.process_time()
+        start = time.time()
+        result = fn(*args)
+        seconds = time.time() - start
+        self.results[stage] = dict(rows=num_rows, seconds=seconds,
+                                   cpu=time.process_time() - start_cpu,
+                                   rows_per_sec=num_rows / max(seconds, 1e-9),
+                                   peak_rss_mb=get_peak_rss())
+        return result
+
+def run_query(options, select, src, rest):
+    from squeal.query import QueryParser
+    args = [select, src]
+    if rest:
+        args.append(rest)
+    q = QueryParser().parse_args(options, args)
+    return list(q.execute())
+
+def _normalize(rows, rest):
+    # Without an ORDER BY, the rows may come in any order, and with a LIMIT
+    # too, any of them will do:
+    if 'order by' in rest:
+        return rows
+    if 'limit' in rest:
+        return len(rows)
+    return sorted(rows, key=repr)
+
+def check_results(kind, path):
+    """
+    Get a list of descriptions of any queries giving different results from
+    the plain sqlite path with any of the other ways of executing them
+    """
+    from squeal.query import Options
+    source_class = kind.get_source_class()
+    variants = [('default', Options()),
+                ('sqlite', Options(engine='sqlite')),
+                ('jobs=2', Options(jobs=2, chunk_size=0.25)),
+                ('unordered', Options(jobs=2, chunk_size=0.25, ordered=False))]
+    problems = []
+    for select, rest in kind.queries:
+        expected = run_query(Options(engine='sqlite', pushdown=False), select,
+                             source_class(path), rest)
+        for name, options in variants:
+            actual = run_query(options, select, source_class(path), rest)
+            if _normalize(actual, rest) != _normalize(expected, rest):
+                problems.append('%s: "%s %s %s" differs with %s'
+                                % (kind.name, select, kind.filename, rest,
+                                   name))
+    return problems
+
+def benchmark_kind(kind, directory, num_lines, check=True):
+    """
+    Generate input of the given kind, and time each stage on it, returning
+    a dict of results
+    """
+    import io
+    from squeal.inputs import get_input_from_file
+    from squeal.query import Options, Database
+    from squeal.table import TextTableWriter
+
+    path = kind.write(directory, num_lines)
+    timer = StageTimer()
+
+    detect_path = path
+    if kind.detect_as:
+        detect_path = kind.detect_as.write(directory, 100)
+    def detect():
+        from squeal.detect import clear_cache
+        for i in range(10):
+            # (as if each were a different file)
+            clear_cache()
+            result = get_input_from_file(detect_path, Options())
+        return result
+    detected = timer.time('detect', 10, detect)
+
+    src = kind.get_source_class()(path)
+    rows = timer.time('parse', num_lines, lambda: list(src.iter_tuples()))
+
+    columns = src.get_columns()
+    db = Database(Options(), columns)
+    timer.time('load', len(rows), db.load_tuples, iter(rows))
+
+    from squeal.query import QueryParser
+    queries = [QueryParser().parse_args(Options(),
+                                        [select, src] + [rest][:bool(rest)])
+               for (select, rest) in kind.queries]
+    timer.time('query', len(rows) * len(queries),
+               lambda: [list(db.query(q.distinct, q.expr_names, q.stuff))
+                        for q in queries])
+    db.clear()
+
+    def render():
+        w = TextTableWriter([col.name for col in columns],
+                            Options.width_sample)
+        out = io.StringIO()
+        w.write(rows, out)
+        return out.tell()
+    timer.time('render', len(rows), render)
+    del rows
+
+    timer.time('execute', num_lines * len(kind.queries),
+               lambda: [run_query(Options(), select,
+                                  kind.get_source_class()(path), rest)
+                        for (select, rest) in kind.queries])
+
+    problems = []
+    if check:
+        problems = check_results(kind, path)
+    return dict(stages=timer.results,
+                detected=detected.__class__.__name__ if detected else None,
+                problems=problems)
+
+def run_child(kind_name, directory, num_lines, check):
+    # (the body of the process benchmarking one kind of input)
+    from benchmarks.generators import get_kind
+    result = benchmark_kind(get_kind(kind_name), directory, num_lines, check)
+    json.dump(result, sys.stdout)
+
+def run_in_child(kind, directory, num_lines, check):
+    """
+    Benchmark a kind of input in a fresh process, returning its results
+    """
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    args = [sys.executable, '-m', 'benchmarks.run', '--child', kind.name,
+            '--dir', directory, '--lines', str(num_lines)]
+    if not check:
+        args.append('--no-check')
+    p = subprocess.Popen(args, cwd=top, stdout=subprocess.PIPE)
+    output = p.communicate()[0]
+    if p.returncode:
+        raise RuntimeError('benchmarking %s failed (exit code %i)'
+                           % (kind.name, p.returncode))
+    return json.loads(output)
+
+def compare(results, baseline, tolerance):
+    """
+    Get a list of descriptions of the stages whose rates fell more than
+    tolerance (a fraction) below the baseline's
+    """
+    regressions = []
+    for kind_name, result in sorted(results.items()):
+        for stage in STAGES:
+            before = baseline.get(kind_name, {}).get(stage)
+            if before is None or stage not in result['stages']:
+                continue
+            now = result['stages'][stage]['rows_per_sec']
+            if now < before * (1 - tolerance):
+                regressions.append('%s %s: %.0f rows/s, down from %.0f'
+                                   % (kind_name, stage, now, before))
+    return regressions
+
+def get_rates(results):
+    """
+    Get the rates of each stage for each kind, as saved by --save-baseline
+    """
+    return dict([(kind_name,
+                  dict([(stage, stats['rows_per_sec'])
+                        for (stage, stats) in result['stages'].items()]))
+                 for (kind_name, result) in results.items()])
+
+def write_report(results, baseline, out):
+    from squeal.table import Table
+    t = Table(columnHeadings=['input', 'stage', 'rows', 'wall (s)', 'cpu (s)',
+                              'rows/s', 'vs baseline', 'peak MB'])
+    for kind_name, result in sorted(results.items()):
+        for stage in STAGES:
+            stats = result['stages'][stage]
+            before = baseline.get(kind_name, {}).get(stage)
+            if before:
+                change = '%+.0f%%' % (100.0 * stats['rows_per_sec'] / before
+                                      - 100)
+            else:
+                change = '-'
+            t.add_row([kind_name, stage, stats['rows'],
+                       '%.3f' % stats['seconds'], '%.3f' % stats['cpu'],
+                       '%.0f' % stats['rows_per_sec'], change,
+                       '%.1f' % stats['peak_rss_mb']])
+    t.write_as_text(out)
+    for kind_name, result in sorted(results.items()):
+        out.write('%s detected as: %s\n' % (kind_name, result['detected']))
+
+def main(args):
+    from optparse import OptionParser
+    from benchmarks.generators import KINDS
+    parser = OptionParser(usage='python -m benchmarks.run [options]')
+    parser.add_option('--lines', dest='lines', type='int', default=100000,
+                      help='lines (or packets) of input to generate for each kind (default: %default)')
+    parser.add_option('--kinds', dest='kinds',
+                      default=','.join([kind.name for kind in KINDS]),
+                      help='comma-separated kinds of input to benchmark (default: %default)')
+    parser.add_option('--dir', dest='dir',
+                      help='generate the input in DIR (default: a temporary directory)')
+    parser.add_option('--baseline', dest='baseline', metavar='FILE',
+                      help='compare the rates with those saved in FILE')
+    parser.add_option('--save-baseline', dest='save_baseline', metavar='FILE',
+                      help='save the rates in FILE, as a baseline for later runs')
+    parser.add_option('--tolerance', dest='tolerance', type='float',
+                      default=0.2,
+                      help='fraction by which a rate may fall below the baseline (default: %default)')
+    parser.add_option('--json', dest='json', action='store_true',
+                      help='write the full results as JSON, rather than a table')
+    parser.add_option('--no-check', dest='check', action='store_false',
+                      default=True,
+                      help="don't check that the results are the same whichever way queries are executed")
+    parser.add_option('--child', dest='child', help='(internal)')
+    options, args = parser.parse_args(args)
+
+    if options.child:
+        run_child(options.child, options.dir, options.lines, options.check)
+        return 0
+
+    directory = options.dir
+    if not directory:
+        import shutil
+        import tempfile
+        directory = tempfile.mkdtemp()
+    try:
+        from benchmarks.generators import get_kind
+        results = {}
+        for name in options.kinds.split(','):
+            kind = get_kind(name)
+            results[name] = run_in_child(kind, directory, options.lines,
+                                         options.check)
+    finally:
+        if not options.dir:
+            shutil.rmtree(directory)
+
+    baseline = {}
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+    if options.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        write_report(results, baseline, sys.stdout)
+    if options.save_baseline:
+        f = open(options.save_baseline, 'w')
+        json.dump(get_rates(results), f, indent=2, sort_keys=True)
+        f.close()
+
+    failures = compare(results, baseline, options.tolerance)
+    for result in results.values():
+        failures += result['problems']
+    for failure in failures:
+        sys.stderr.write('%s\n' % failure)
+    if failures:
+        return 1
+    return 0
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Times the squeal command on tiny input, as monitoring scripts run it, where
+most of the time goes on starting up:
+
+   wall     running the command, best of --runs
+   imports  the time "python -X importtime" says importing took, best of
+            --runs
+   squeal   how much of that was importing squeal's own modules
+
+and checks that nothing is imported that the query doesn't need (such as
+curses or the archive modules).  Any such import, or a time more than
+--tolerance above that in a --baseline file (as written by --save-baseline),
+gives an exit code of 1.
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+TOP = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that only some inputs, output formats or options need:
+UNWANTED = ['curses', 'squeal.tui', 'zipfile', 'tarfile', 'squeal.archive',
+            'squeal.augeasfile', 'sqlite3', 'squeal.cache', 'multiprocessing',
+            'squeal.parallel', 'squeal.follow', 'subprocess', 'getopt']
+
+# (name, arguments, modules that may be imported after all) for each command
+# timed, with the arguments formatted with the path of a small access log:
+CASES = [('text', ['-f', 'text', 'host, request from', '%(path)s',
+                   'where status = 404'], []),
+         ('table', ['-f', 'table', 'count(*) from', '%(path)s'], []),
+         ('sqlite', ['-f', 'table', '-e', 'sqlite',
+                     'status, count(*) from', '%(path)s', 'group by status'],
+          ['sqlite3'])]
+
+def parse_importtime(output):
+    """
+    Get the names of the modules imported, the total time importing took
+    and the time importing squeal's modules took (in ms), from the output
+    of "python -X importtime"
+    """
+    modules = set()
+    total = squeal = 0.0
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            cumulative = int(fields[1]) / 1000.0
+        except ValueError:
+            # (the heading)
+            continue
+        name = fields[2].strip()
+        modules.add(name)
+        if fields[2][1:2] != ' ':
+            # (a module imported at the top level)
+            total += cumulative
+            if name.split('.')[0] == 'squeal':
+                squeal += cumulative
+    return modules, total, squeal
+
+def run_squeal(args, importtime=False):
+    """
+    Run the squeal command, getting its wall time (in ms) and its stderr
+    """
+    command = [sys.executable]
+    if importtime:
+        command += ['-X', 'importtime']
+    command += [os.path.join(TOP, 'squeal.py')] + args
+    # (with .pyc files, as an installed copy would have)
+    env = dict(os.environ)
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    start = time.time()
+    p = subprocess.Popen(command, cwd=TOP, env=env, stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, universal_newlines=True)
+    err = p.communicate()[1]
+    wall = (time.time() - start) * 1000.0
+    if p.returncode:
+        raise RuntimeError('%s failed (exit code %i):\n%s'
+                           % (' '.join(command), p.returncode, err))
+    return wall, err
+
+def time_case(args, allowed, runs):
+    """
+    Time a command, returning a dict of results
+    """
+    # (once to write any .pyc files first)
+    run_squeal(args)
+    wall = min([run_squeal(args)[0] for i in range(runs)])
+    imports = squeal = None
+    for i in range(runs):
+        modules, total, squeal_total = parse_importtime(run_squeal(args, True)[1])
+        if imports is None or total < imports:
+            imports, squeal = total, squeal_total
+    return dict(wall_ms=wall, import_ms=imports, squeal_import_ms=squeal,
+                modules=len(modules),
+                unwanted=sorted([name for name in UNWANTED
+                                 if name in modules and name not in allowed]))
+
+def write_input(directory):
+    from benchmarks.generators import get_kind
+    return get_kind('httpd').write(directory, 100)
+
+def compare(results, baseline, tolerance):
+    """
+    Get a list of descriptions of the times that rose more than tolerance
+    (a fraction) above the baseline's
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        for key in ['wall_ms', 'import_ms']:
+            before = baseline.get(name, {}).get(key)
+            if before and result[key] > before * (1 + tolerance):
+                regressions.append('%s %s: %.1f, up from %.1f'
+                                   % (name, key, result[key], before))
+    return regressions
+
+def write_report(results, baseline, out):
+    from squeal.table import Table
+    t = Table(columnHeadings=['command', 'wall (ms)', 'imports (ms)',
+                              'squeal (ms)', 'modules', 'vs baseline',
+                              'unwanted'])
+    for name, args, allowed in CASES:
+        if name not in results:
+            continue
+        result = results[name]
+        before = baseline.get(name, {}).get('wall_ms')
+        if before:
+            change = '%+.0f%%' % (100.0 * result['wall_ms'] / before - 100)
+        else:
+            change = '-'
+        t.add_row([name, '%.1f' % result['wall_ms'],
+                   '%.1f' % result['import_ms'],
+                   '%.1f' % result['squeal_import_ms'], result['modules'],
+                   change, ', '.join(result['unwanted']) or '-'])
+    t.write_as_text(out)
+
+def main(args):
+    import json
+    from optparse import OptionParser
+    parser = OptionParser(usage='python -m benchmarks.startup [options]')
+    parser.add_option('--runs', dest='runs', type='int', default=10,
+                      help='times to run each command, taking the best (default: %default)')
+    parser.add_option('--cases', dest='cases',
+                      default=','.join([case[0] for case in CASES]),
+                      help='comma-separated commands to time (default: %default)')
+    parser.add_option('--baseline', dest='baseline', metavar='FILE',
+                      help='compare the times with those saved in FILE')
+    parser.add_option('--save-baseline', dest='save_baseline', metavar='FILE',
+                      help='save the times in FILE, as a baseline for later runs')
+    parser.add_option('--tolerance', dest='tolerance', type='float',
+                      default=0.2,
+                      help='fraction by which a time may rise above the baseline (default: %default)')
+    parser.add_option('--json', dest='json', action='store_true',
+                      help='write the results as JSON, rather than a table')
+    options, args = parser.parse_args(args)
+
+    import shutil
+    import tempfile
+    directory = tempfile.mkdtemp()
+    try:
+        path = write_input(directory)
+        results = {}
+        names = options.cases.split(',')
+        for name, case_args, allowed in CASES:
+            if name in names:
+                results[name] = time_case([arg % dict(path=path)
+                                           for arg in case_args],
+                                          allowed, options.runs)
+    finally:
+        shutil.rmtree(directory)
+
+    baseline = {}
+    if options.baseline:
+        baseline = json.load(open(options.baseline))
+    if options.json:
+        json.dump(results, sys.stdout, indent=2, sort_keys=True)
+        sys.stdout.write('\n')
+    else:
+        write_report(results, baseline, sys.stdout)
+    if options.save_baseline:
+        f = open(options.save_baseline, 'w')
+        json.dump(dict([(name, dict(wall_ms=result['wall_ms'],
+                                    import_ms=result['import_ms']))
+                        for (name, result) in results.items()]),
+                  f, indent=2, sort_keys=True)
+        f.close()
+
+    failures = compare(results, baseline, options.tolerance)
+    for name, result in sorted(results.items()):
+        if result['unwanted']:
+            failures.append('%s imports %s'
+                            % (name, ', '.join(result['unwanted'])))
+    for failure in failures:
+        sys.stderr.write('%s\n' % failure)
+    if failures:
+        return 1
+    return 0
+
+import unittest
+class StartupTests(unittest.TestCase):
+    def test_parse_importtime(self):
+        output = ('import time: self [us] | cumulative | imported package\n'
+                  'import time:       300 |        300 |   _io\n'
+                  'import time:      1000 |       1500 | re\n'
+                  'import time:       200 |        200 |     squeal.sql\n'
+                  'import time:      2000 |       2500 | squeal.query\n')
+        modules, total, squeal = parse_importtime(output)
+        self.assertEquals(modules, set(['_io', 're', 'squeal.sql',
+                                        'squeal.query']))
+        self.assertEquals((total, squeal), (4.0, 2.5))
+
+    def test_unwanted(self):
+        from squeal.testing import make_tmpdir
+        path = write_input(make_tmpdir(self))
+        for name, args, allowed in CASES:
+            err = run_squeal([arg % dict(path=path) for arg in args],
+                             importtime=True)[1]
+            modules = parse_importtime(err)[0]
+            self.assert_('squeal.httpdlog' in modules, name)
+            self.assertEquals([module for module in UNWANTED
+                               if module in modules and module not in allowed],
+                              [], name)
+
+if __name__=='__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -8,7 +8,7 @@ setup(name="squeal",
       url="https://fedorahosted.org/squeal/",
       author="David Malcolm",
       author_email="dmalcolm@redhat.com",
-      packages=find_packages(exclude='tests'),
+      packages=find_packages(exclude=['tests', 'benchmarks']),
       scripts=['squeal.py']
       )
 
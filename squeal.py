@@ -95,31 +95,77 @@ Or even an TUI (ncurses?)
 import sys
 
 def as_table(query, out):
-    t = query.make_table()
-    t.write_as_text(out)
+    # (writing the rows out as they come, rather than holding them all)
+    from squeal.table import TextTableWriter
+    w = TextTableWriter(query.expr_names, query.options.width_sample)
+    w.write(query.execute(), out)
 
 def as_html(query, out):
-    t = query.make_table()
-    t.write_as_html(out)
+    from squeal.table import HtmlTableWriter
+    HtmlTableWriter(query.expr_names).write(query.execute(), out)
 
 def as_text(query, out):
-    iter = query.execute()
-    for row in iter:
+    write_rows(query, query.execute(), out)
+
+def write_rows(query, rows, out):
+    for row in rows:
         for i, col_name in enumerate(query.expr_names):
             out.write('"%s" ' % row[i]) # FIXME: should we do any escaping?
         out.write('\n')
 
+def follow(query, out, format):
+    # Write out each update to the result as the input grows, until
+    # interrupted:
+    from squeal.follow import iter_updates
+    from squeal.table import TextTableWriter, HtmlTableWriter
+    try:
+        for i, (replace, rows) in enumerate(iter_updates(query)):
+            if i and replace:
+                out.write('\n')
+            if format == 'text':
+                write_rows(query, rows, out)
+            elif format == 'html':
+                HtmlTableWriter(query.expr_names).write(rows, out)
+            else:
+                TextTableWriter(query.expr_names,
+                                query.options.width_sample).write(rows, out)
+            out.flush()
+    except KeyboardInterrupt:
+        pass
+
+def write_output(q, options, formatters):
+    if options.format:
+        try:
+            formatter = formatters[options.format]
+        except KeyError:
+            sys.stderr.write("Unknown formatter: %s\n" % options.format)
+            sys.exit(2)
+        if options.follow:
+            follow(q, sys.stdout, options.format)
+        else:
+            formatter(q, sys.stdout)
+    else:
+        if sys.stdout.isatty():
+            # We're connected to a TTY, go into text UI mode:
+            from squeal.tui import Tui
+            ui = Tui(q, options)
+            ui.main()
+        elif options.follow:
+            follow(q, sys.stdout, 'table')
+        else:
+            as_table(q, sys.stdout)
+
 def usage():
     pass
 
 def run_query(args):
-    import getopt
     from optparse import OptionParser
     usage = "usage: %prog [options] [[COL1 COL2 ... | * ] from] (FILE | DATASRC) ..."
     formatters = {'html':as_html,
                   'table':as_table,
                   'text':as_text,
                   }
+    from squeal.query import Options
     parser = OptionParser(usage=usage)
     parser.add_option("-d", "--debug", dest="debug_level",
                       help='set debug level from 0 (none) to 9 (verbose)',
@@ -134,8 +180,68 @@ def run_query(args):
     parser.add_option("-r", "--input-regex", dest="input_regex",
                       help='Supply a regular expression (with groups) for carving up text input files',
                       metavar="REGULAR-EXPRESSION")
+    parser.add_option("-b", "--batch-size", dest="batch_size", type="int",
+                      help='number of rows to insert into sqlite per batch when loading input (default: %i)' \
+                            % Options.batch_size,
+                      metavar="ROWS")
+    parser.add_option("--no-pushdown", dest="pushdown", action="store_false",
+                      help='load every input row and column into sqlite, rather than only those that the query could use')
+    parser.add_option("-e", "--engine", dest="engine",
+                      type="choice", choices=['auto', 'sqlite'],
+                      help='"auto" (the default) runs simple queries directly on the input as it is read; "sqlite" always loads the input into sqlite first',
+                      metavar="ENGINE")
+    parser.add_option("--cache-dir", dest="cache_dir",
+                      help='cache parsed input files in DIR, reusing them whilst the files are unchanged',
+                      metavar="DIR")
+    parser.add_option("--cache-max-size", dest="cache_max_size", type="int",
+                      help='evict the least-recently-used cache entries when the cache exceeds MB megabytes (default: %i)' \
+                            % Options.cache_max_size,
+                      metavar="MB")
+    parser.add_option("--no-cache", dest="use_cache", action="store_false",
+                      help='neither read nor update the cache for this query')
+    parser.add_option("--clear-cache", dest="clear_cache", action="store_true",
+                      help='delete everything from the cache before running the query (if any)')
+    parser.add_option("--indexes", dest="indexes",
+                      type="choice", choices=['auto', 'always', 'never'],
+                      help='when to index the columns used by WHERE, GROUP BY and ORDER BY: "auto" (the default) does so for cached input and data queried more than once, if there are at least --index-min-rows rows',
+                      metavar="WHEN")
+    parser.add_option("--index-min-rows", dest="index_min_rows", type="int",
+                      help='don\'t index fewer than N rows in "auto" mode (default: %i)' \
+                            % Options.index_min_rows,
+                      metavar="N")
+    parser.add_option("--analyze", dest="analyze", action="store_true",
+                      help='gather statistics with ANALYZE after creating indexes')
+    parser.add_option("-j", "--jobs", dest="jobs", type="int",
+                      help='parse input files in N worker processes (0: one per CPU; default: 1)',
+                      metavar="N")
+    parser.add_option("--unordered", dest="ordered", action="store_false",
+                      help='with --jobs, take rows from whichever file or chunk is ready first, rather than keeping them in the order of the input')
+    parser.add_option("--chunk-size", dest="chunk_size", type="int",
+                      help='with --jobs, split input files bigger than MB megabytes into chunks to parse in parallel (default: %i)' \
+                            % Options.chunk_size,
+                      metavar="MB")
+    parser.add_option("--follow", dest="follow", action="store_true",
+                      help='keep reading the input as it grows, like "tail -F", writing out new result rows as they arrive (or the whole result every --refresh seconds for aggregates)')
+    parser.add_option("--refresh", dest="refresh", type="float",
+                      help='with --follow, update aggregate results every SECONDS (default: %g)' \
+                            % Options.refresh,
+                      metavar="SECONDS")
+    parser.add_option("--mmap", dest="mmap", action="store_true",
+                      help='read input files through a memory map, rather than a buffer (not safe if they may be truncated whilst being read)')
+    parser.add_option("--width-sample", dest="width_sample", type="int",
+                      help='size the columns of text tables on the first ROWS rows of the result, rather than all of them, so that the rows can be written out as they come (0: all of them; default: %i)' \
+                            % Options.width_sample,
+                      metavar="ROWS")
+    parser.add_option("--stats", dest="stats", action="store_true",
+                      help='print where the time went (per stage), row counts and peak memory use to stderr afterwards')
+    parser.add_option("--stats-format", dest="stats_format",
+                      help='print --stats as "text" (the default) or "json"',
+                      metavar="FORMAT")
+    parser.add_option("--profile", dest="profile",
+                      help='profile running the query with cProfile, saving the results in FILE (for pstats)',
+                      metavar="FILE")
     
-    (options, args) = parser.parse_args()
+    (options, args) = parser.parse_args(values=Options())
 
     # Handle debug_level:
     if options.debug_level:
@@ -152,26 +258,50 @@ def run_query(args):
         print('Options: %s' % options)
         print('Args: %s' % repr(args))
     
+    if options.clear_cache:
+        if not options.cache_dir:
+            sys.stderr.write("--clear-cache needs --cache-dir\n")
+            sys.exit(2)
+        from squeal.cache import ParseCache
+        ParseCache(options.cache_dir, options.cache_max_size, options).clear()
+        if not args:
+            sys.exit(0)
+
+    from squeal import stats
+    if options.stats:
+        if options.stats_format not in ('text', 'json'):
+            sys.stderr.write("Unknown stats format: %s\n" % options.stats_format)
+            sys.exit(2)
+        stats.enable()
+
     from squeal.query import QueryParser
     p = QueryParser()
     q = p.parse_args(options, args)
     if options.debug_level > 0:
         print('Query: %s' % q)
-    if options.format:
-        try:
-            formatter = formatters[options.format]
-        except KeyError:
-            sys.stderr.write("Unknown formatter: %s\n" % options.format)
-            sys.exit(2)
-        formatter(q, sys.stdout)
-    else:
-        if sys.stdout.isatty():
-            # We're connected to a TTY, go into text UI mode:
-            from squeal.tui import Tui
-            ui = Tui(q, options)
-            ui.main()
-        else:
-            as_table(q, sys.stdout)
+
+    profiler = None
+    if options.profile:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        # (fetching the rows is charged to stages of its own)
+        with stats.stage('render'):
+            write_output(q, options, formatters)
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(options.profile)
+        if stats.current:
+            if options.stats_format == 'json':
+                stats.current.write_json(sys.stderr)
+            else:
+                stats.current.write_text(sys.stderr)
+
+    if options.debug_level >= 5:
+        for description, hits in q.input.get_pattern_stats():
+            print('%i lines matched: %s' % (hits, description))
 
 # Exit code:
 # 0: rows found
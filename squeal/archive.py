@@ -41,14 +41,18 @@ class ZipFileSrc(DictSource):
     def iter_dicts(self):
         zf = zipfile.ZipFile(self.filename, 'r')
 
+        attrs = dict(filename='filename',
+                     datetime='date_time',
+                     flagbits='flag_bits',
+                     compress_size='compress_size',
+                     file_size='file_size',
+                     attr='external_attr')
+        names = self.get_wanted_names()
         for zi in zf.infolist():
-            yield dict(filename=zi.filename,
-                       datetime=str(zi.date_time),
-                       flagbits=zi.flag_bits,
-                       compress_size=zi.compress_size,
-                       file_size=zi.file_size,
-                       attr=zi.external_attr
-                       )
+            d = dict([(name, getattr(zi, attrs[name])) for name in names])
+            if 'datetime' in d:
+                d['datetime'] = str(d['datetime'])
+            yield d
 
 class TarFileSrc(DictSource):
     """
@@ -73,18 +77,10 @@ class TarFileSrc(DictSource):
     def iter_dicts(self):
         tf = tarfile.TarFile.open(self.filename, 'r|*')
 
+        # The columns are all attributes of TarInfo:
+        names = self.get_wanted_names()
         for ti in tf.getmembers():
-            yield dict(name=ti.name,
-                       size=ti.size,
-                       mtime=ti.mtime,
-                       mode=ti.mode,
-                       type=ti.type,
-                       linkname=ti.linkname,
-                       uid=ti.uid,
-                       gid=ti.gid,
-                       uname=ti.uname,
-                       gname=ti.gname,
-                       )
+            yield dict([(name, getattr(ti, name)) for name in names])
 
 class RpmFile(DictSource):
     """
@@ -123,23 +119,14 @@ class RpmFile(DictSource):
     def iter_dicts(self):
         h = self.get_header()
         fi = h.fiFromHeader() 
+        # The columns are in the same order as the fields of the tuples:
+        fields = [(i, col.name) for (i, col) in enumerate(self.get_columns())
+                  if self.is_wanted(col.name)]
         for f in fi:
             # these are tuples, e.g.:
             #('/usr/lib/python2.5/site-packages/show/yumlog.pyc', 3631L, 33188, 1238371283, 0, 0, 170245, 2, 0, -1, 'root', 'root', '6b4bab026d94f5fe1ce0f3a4a8367bb2')
             # See implementation of rpmfi_iternext at http://rpm.org/gitweb?p=rpm.git;a=blob;f=python/rpmfi-py.c;h=59c2e4c474f99fd1b4b111829ed518ee6bd69580;hb=HEAD
-            yield dict(name=f[0],
-                       size=f[1],
-                       mode=f[2],
-                       mtime=f[3],
-                       flags=f[4],
-                       rdev=f[5],
-                       inode=f[6],
-                       nlink=f[7],
-                       state=f[8],
-                       vflags=f[9],
-                       user=f[10],
-                       group_=f[11],
-                       digest=f[12])
+            yield dict([(name, f[i]) for (i, name) in fields])
 
 
 def get_input_from_file(filename):
@@ -41,6 +41,9 @@ class AugeasFile(FileDictSource):
     along with a synthesized "node" column corresponding to "ITEM_0" in the
     path
     """
+    # The columns depend on the content, and it's cheap to read anyway:
+    cacheable = False
+
     def __init__(self, filename):
         # We do all the work upfront here, so that we know what the columns
         # will be
@@ -89,3 +92,7 @@ class AugeasFile(FileDictSource):
     def iter_dicts(self):
         for row in self.rows:
             yield row
+
+    def get_follower(self):
+        # (everything was read upfront)
+        return None
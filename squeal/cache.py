@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+An on-disk cache of parsed input files (enabled with --cache-dir).
+
+Each entry is a sqlite database holding a "lines" table with every row and
+column parsed from one input file, together with a "meta" table recording
+the identity of the file it came from (path, inode, size, mtime and the
+source class that parsed it).  An entry is used as-is if all of these still
+match.
+
+Log files only ever grow (until they're rotated), so for sources that can
+resume reading part-way through a file (DictSource.appendable) the meta also
+records the byte offset just after the last complete line parsed, and a
+checksum of the bytes leading up to it.  If the file has grown and those
+bytes are unchanged, only what follows the offset is parsed and appended to
+the entry.  A new inode, a file shorter than the offset, or a different tail
+checksum means the file was rotated, truncated or rewritten, and the entry
+is rebuilt from scratch.
+
+Entries are evicted least-recently-used first once their total size exceeds
+the configured maximum; using an entry updates its mtime.
+"""
+
+import os
+import sqlite3
+import tempfile
+from hashlib import sha1
+from itertools import islice
+
+from squeal.query import DictSource, get_projection
+
+# Bump this whenever the layout of entries changes:
+CACHE_FORMAT = 2
+
+# How many bytes before the offset to checksum, to check that a file has
+# only been appended to:
+TAIL_SIZE = 4096
+
+# Meta entries which must match for an entry to be usable at all:
+IDENTITY_KEYS = ('path', 'inode', 'format', 'class', 'columns')
+
+class ParseCache(object):
+    def __init__(self, directory, max_size, options):
+        self.directory = directory
+        self.max_size = max_size
+        self.options = options
+
+    def get_entry_path(self, source):
+        key = '%s\0%s.%s' % (os.path.abspath(source.filename),
+                             source.__class__.__module__,
+                             source.__class__.__name__)
+        return os.path.join(self.directory,
+                            sha1(key.encode('utf-8')).hexdigest() + '.db')
+
+    def wrap(self, source):
+        """
+        Wrap a DictSource so that it goes through the cache, if it's something
+        that can be cached
+        """
+        if not source.cacheable or not os.path.isfile(source.filename):
+            return source
+        return CachedSource(self, source)
+
+    def get_entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name)
+                for name in os.listdir(self.directory)
+                if name.endswith('.db')]
+
+    def evict(self):
+        """
+        Delete the least-recently-used entries until the total size is within
+        bounds
+        """
+        entries = []
+        for path in self.get_entries():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue # deleted by a concurrent run
+            entries.append((st.st_mtime, st.st_size, path))
+        entries.sort()
+        total = sum([size for (mtime, size, path) in entries])
+        for (mtime, size, path) in entries:
+            if total <= self.max_size:
+                break
+            if self.options.debug_level >= 5:
+                print('evicting cache entry: %s' % path)
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for path in self.get_entries():
+            os.unlink(path)
+
+def get_identity(filename):
+    """
+    The properties of a file that must be unchanged for a cache entry made
+    from it to be usable as-is
+    """
+    st = os.stat(filename)
+    return dict(path=os.path.abspath(filename),
+                inode=st.st_ino,
+                size=st.st_size,
+                mtime=st.st_mtime_ns)
+
+def get_tail_checksum(filename, offset):
+    """
+    Checksum the TAIL_SIZE bytes of a file leading up to offset
+    """
+    start = max(0, offset - TAIL_SIZE)
+    f = open(filename, 'rb')
+    try:
+        f.seek(start)
+        return sha1(f.read(offset - start)).hexdigest()
+    finally:
+        f.close()
+
+class CachedSource(DictSource):
+    """
+    Wraps a DictSource reading a file, taking its rows from the cache when
+    the file hasn't changed (or has only been appended to), and otherwise
+    saving them into the cache as they are parsed
+    """
+    def __init__(self, cache, source):
+        self.cache = cache
+        self.source = source
+        self.filename = source.filename
+        self.entry_path = cache.get_entry_path(source)
+
+    def __repr__(self):
+        return 'CachedSource(%r)' % self.source
+
+    def get_columns(self):
+        return self.source.get_columns()
+
+    @property
+    def rereadable(self):
+        return self.source.rereadable
+
+    def get_pattern_stats(self):
+        return self.source.get_pattern_stats()
+
+    def cancel(self):
+        DictSource.cancel(self)
+        self.source.cancel()
+
+    def get_progress(self):
+        return self.source.get_progress()
+
+    def get_expected_meta(self):
+        meta = get_identity(self.filename)
+        meta['format'] = CACHE_FORMAT
+        meta['class'] = '%s.%s' % (self.source.__class__.__module__,
+                                   self.source.__class__.__name__)
+        meta['columns'] = ','.join(['%s %s' % (col.name, col.sql_type())
+                                    for col in self.get_columns()])
+        return meta
+
+    def read_meta(self):
+        if not os.path.exists(self.entry_path):
+            return None
+        try:
+            conn = sqlite3.connect(self.entry_path)
+            try:
+                return dict(conn.execute('SELECT key, value FROM meta'))
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+
+    def get_cache_file(self):
+        """
+        Get the path of a valid cache entry for the file, or None, first
+        appending anything added to the file since the entry was made
+        """
+        meta = self.read_meta()
+        if meta is None:
+            return None
+        expected = self.get_expected_meta()
+        for key in IDENTITY_KEYS:
+            if meta.get(key) != expected[key]:
+                return None
+        if (meta['size'], meta['mtime']) != (expected['size'], expected['mtime']):
+            if not self.can_append(meta, expected):
+                return None
+            self.append(meta, expected)
+        # Record the use, for the LRU eviction:
+        try:
+            os.utime(self.entry_path, None)
+        except OSError:
+            return None
+        return self.entry_path
+
+    def can_append(self, meta, expected):
+        """
+        Has the file only been appended to since the entry was made?
+        """
+        if not self.source.appendable or 'offset' not in meta:
+            return False
+        if expected['size'] < meta['offset']:
+            return False # truncated
+        return get_tail_checksum(self.filename, meta['offset']) == meta['tail']
+
+    def append(self, meta, expected):
+        """
+        Parse the file from the entry's offset onwards into the entry, in
+        place of any rows from a trailing incomplete line
+        """
+        if self.cache.options.debug_level >= 5:
+            print('appending %s from offset %i to cache entry %s'
+                  % (self.filename, meta['offset'], self.entry_path))
+        self.source.set_wanted_columns(None)
+        self.source.start_offset = meta['offset']
+        conn = sqlite3.connect(self.entry_path)
+        try:
+            conn.execute('DELETE FROM lines WHERE rowid > ?', (meta['rows'], ))
+            self.complete_rows = meta['rows']
+            for t in self._store(conn, self.source.iter_tuples()):
+                pass
+            self._write_meta(conn, expected)
+            conn.commit()
+        except:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def iter_tuples(self):
+        path = self.get_cache_file()
+        if path:
+            if self.cache.options.debug_level >= 5:
+                print('reading %s from cache entry %s' % (self.filename, path))
+            return self._iter_cached_tuples(path)
+        return self._iter_and_store()
+
+    def _iter_cached_tuples(self, path):
+        names = self.get_wanted_names()
+        # (something has to be selected, even if no columns are wanted)
+        exprs = ['"%s"' % name for name in names] or ['NULL']
+        conn = sqlite3.connect(path)
+        try:
+            cursor = conn.execute('SELECT %s FROM lines' % ', '.join(exprs))
+            if names:
+                for row in cursor:
+                    yield row
+            else:
+                for row in cursor:
+                    yield ()
+        finally:
+            conn.close()
+
+    def _store(self, conn, tuples):
+        """
+        Insert row tuples (of every column) into the entry's "lines" table in
+        batches, passing them on, and keeping count in complete_rows of those
+        that don't come from a trailing incomplete line
+        """
+        source = self.source
+        columns = self.get_columns()
+        insert_sql = 'INSERT INTO lines VALUES (%s)' \
+                     % ','.join(['?' for col in columns])
+        batch_size = self.cache.options.batch_size
+        while True:
+            batch = list(islice(tuples, batch_size))
+            if not batch:
+                break
+            conn.executemany(insert_sql, batch)
+            self.complete_rows += len(batch)
+            for t in batch:
+                yield t
+        if source.appendable:
+            self.complete_rows -= source.partial_rows
+
+    def _write_meta(self, conn, meta):
+        meta = dict(meta)
+        if self.source.appendable:
+            meta['offset'] = self.source.end_offset
+            meta['tail'] = get_tail_checksum(self.filename,
+                                             self.source.end_offset)
+            meta['rows'] = self.complete_rows
+        conn.execute('DELETE FROM meta')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)',
+                         sorted(meta.items()))
+
+    def _iter_and_store(self):
+        # Parse every column, whatever the query wants, so that the entry is
+        # usable by later queries:
+        self.source.set_wanted_columns(None)
+        meta = self.get_expected_meta()
+        columns = self.get_columns()
+        projection = get_projection([col.name for col in columns],
+                                    self.get_wanted_names())
+
+        if not os.path.isdir(self.cache.directory):
+            os.makedirs(self.cache.directory)
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.cache.directory)
+        os.close(fd)
+        complete = False
+        try:
+            conn = sqlite3.connect(tmp_path)
+            try:
+                conn.execute('PRAGMA journal_mode = OFF')
+                conn.execute('PRAGMA synchronous = OFF')
+                conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value)')
+                conn.execute('CREATE TABLE lines (%s)'
+                             % ', '.join(['"%s" %s' % (col.name, col.sql_type())
+                                          for col in columns]))
+                self.complete_rows = 0
+                for t in self._store(conn, self.source.iter_tuples()):
+                    if projection:
+                        t = projection(t)
+                    yield t
+                self._write_meta(conn, meta)
+                conn.commit()
+            finally:
+                conn.close()
+            # The offset recorded for an appendable source is what was
+            # actually read, so any growth whilst reading is picked up next
+            # time; otherwise, only publish the entry if the file didn't
+            # change whilst we were reading it:
+            if self.source.appendable or self.get_expected_meta() == meta:
+                os.rename(tmp_path, self.entry_path)
+                complete = True
+        finally:
+            if not complete:
+                os.unlink(tmp_path)
+        self.cache.evict()
+
+def wrap_input(source, options):
+    """
+    Route a newly-created input through the cache, if caching is enabled
+    """
+    if not options.cache_dir or not options.use_cache:
+        return source
+    cache = ParseCache(options.cache_dir, options.cache_max_size * 1024 * 1024,
+                       options)
+    return cache.wrap(source)
+
+import unittest
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.query import Options
+        from squeal.testing import make_tmpdir
+        self.tmpdir = make_tmpdir(self)
+        self.cache_dir = os.path.join(self.tmpdir, 'cache')
+        self.options = Options(cache_dir=self.cache_dir)
+        self.log = os.path.join(self.tmpdir, 'access_log')
+        self.write_log(['127.0.0.1 - - [16/Feb/2009:15:08:29 -0500] "GET /foo.css HTTP/1.1" 200 2261',
+                        '127.0.0.2 - - [16/Feb/2009:15:08:30 -0500] "GET /bar HTTP/1.1" 404 -'])
+
+    def write_log(self, lines):
+        f = open(self.log, 'w')
+        for line in lines:
+            f.write(line + '\n')
+        f.close()
+
+    def make_source(self):
+        from squeal.httpdlog import HttpdLog
+        return wrap_input(HttpdLog(self.log), self.options)
+
+    def query(self, *args):
+        from squeal.query import QueryParser
+        args = [self.make_source() if arg == 'log' else arg for arg in args]
+        q = QueryParser().parse_args(self.options, args)
+        return list(q.execute())
+
+    def test_hit(self):
+        src = self.make_source()
+        self.assert_(isinstance(src, CachedSource))
+        self.assertEquals(src.get_cache_file(), None)
+        first = list(src.iter_dicts())
+        self.assertEquals(len(first), 2)
+        self.assertEquals(self.make_source().get_cache_file(), src.entry_path)
+        self.assertEquals(list(self.make_source().iter_dicts()), first)
+
+    def test_queries(self):
+        for engine in ['auto', 'sqlite']:
+            self.options.engine = engine
+            for i in range(2):
+                self.assertEquals(self.query('host, size from', 'log',
+                                             'where status=404'),
+                                  [('127.0.0.2', None)])
+                self.assertEquals(self.query('count(*), total(size) from', 'log'),
+                                  [(2, 2261.0)])
+
+    def test_changed_file(self):
+        list(self.make_source().iter_dicts())
+        self.write_log(['127.0.0.3 - - [16/Feb/2009:15:08:29 -0500] "GET /foo.css HTTP/1.1" 200 1'])
+        src = self.make_source()
+        self.assertEquals(src.get_cache_file(), None)
+        self.assertEquals([d['host'] for d in src.iter_dicts()], ['127.0.0.3'])
+
+    def append_log(self, text):
+        f = open(self.log, 'a')
+        f.write(text)
+        f.close()
+
+    def mark_cached_rows(self, src):
+        # Tag the rows in the entry, so that we can tell them apart from any
+        # that get parsed afresh:
+        conn = sqlite3.connect(src.entry_path)
+        conn.execute("UPDATE lines SET host = 'cached'")
+        conn.commit()
+        conn.close()
+
+    def get_hosts(self):
+        return [d['host'] for d in self.make_source().iter_dicts()]
+
+    def test_append(self):
+        src = self.make_source()
+        list(src.iter_dicts())
+        self.mark_cached_rows(src)
+        self.append_log('127.0.0.3 - - [16/Feb/2009:15:08:31 -0500] "GET / HTTP/1.1" 200 5\n')
+        self.assertEquals(self.get_hosts(), ['cached', 'cached', '127.0.0.3'])
+        self.assertEquals(self.query('count(*), total(size) from', 'log'),
+                          [(3, 2266.0)])
+        meta = self.make_source().read_meta()
+        self.assertEquals(meta['offset'], os.path.getsize(self.log))
+        self.assertEquals(meta['rows'], 3)
+
+    def test_partial_line(self):
+        self.append_log('127.0.0.3 - - [16/Feb/2009:15:08:31 -0500] "GET / HTTP/1.1" 200 2')
+        src = self.make_source()
+        self.assertEquals([d['size'] for d in src.iter_dicts()], [2261, None, 2])
+        self.assertEquals(src.read_meta()['rows'], 2)
+        # The rest of the line turns up:
+        self.append_log('5\n')
+        self.assertEquals([d['size'] for d in self.make_source().iter_dicts()],
+                          [2261, None, 25])
+        self.assertEquals(self.make_source().read_meta()['rows'], 3)
+
+    def test_rotation(self):
+        src = self.make_source()
+        list(src.iter_dicts())
+        self.mark_cached_rows(src)
+        # Replace the file with a new one that happens to start with the same
+        # content, then grows:
+        os.rename(self.log, self.log + '.1')
+        f = open(self.log + '.1')
+        content = f.read()
+        f.close()
+        self.write_log(content.splitlines()
+                       + ['127.0.0.3 - - [16/Feb/2009:15:08:31 -0500] "GET / HTTP/1.1" 200 5'])
+        self.assertEquals(self.get_hosts(), ['127.0.0.1', '127.0.0.2', '127.0.0.3'])
+
+    def test_truncation(self):
+        src = self.make_source()
+        list(src.iter_dicts())
+        self.mark_cached_rows(src)
+        # Truncate in place, and regrow past the old offset:
+        self.write_log(['127.0.0.4 - - [16/Feb/2009:15:08:31 -0500] "GET /a/much/longer/path/than/before HTTP/1.1" 200 5',
+                        '127.0.0.5 - - [16/Feb/2009:15:08:31 -0500] "GET / HTTP/1.1" 200 5'])
+        self.assertEquals(self.get_hosts(), ['127.0.0.4', '127.0.0.5'])
+        self.write_log(['127.0.0.6 - - [16/Feb/2009:15:08:31 -0500] "GET / HTTP/1.1" 200 5'])
+        self.assertEquals(self.get_hosts(), ['127.0.0.6'])
+
+    def test_index(self):
+        self.options.index_min_rows = 0
+        self.options.engine = 'sqlite'
+        # (the first run creates the entry, the second loads from it)
+        for i in range(2):
+            self.assertEquals(self.query('host from', 'log', 'where status=404'),
+                              [('127.0.0.2', )])
+        conn = sqlite3.connect(self.make_source().entry_path)
+        self.assertEquals(list(conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'lines'")),
+                          [('lines_by_status', )])
+        conn.close()
+        # The index is kept up to date as the file grows:
+        self.append_log('127.0.0.3 - - [16/Feb/2009:15:08:31 -0500] "GET / HTTP/1.1" 404 5\n')
+        self.assertEquals(self.query('host from', 'log', 'where status=404'),
+                          [('127.0.0.2', ), ('127.0.0.3', )])
+
+    def test_bypass(self):
+        list(self.make_source().iter_dicts())
+        self.options.use_cache = False
+        self.assert_(not isinstance(self.make_source(), CachedSource))
+
+    def test_eviction(self):
+        src = self.make_source()
+        list(src.iter_dicts())
+        cache = ParseCache(self.cache_dir, 0, self.options)
+        cache.evict()
+        self.assertEquals(cache.get_entries(), [])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Reading compressed input files, such as the rotated logs that logrotate
+leaves behind, as a stream of their decompressed content.
+
+Files are recognised by their first few bytes, rather than their names.
+Where the gzip, bzip2 or xz command is installed, it does the decompressing
+in a process of its own, so that it runs on another CPU whilst we parse
+(and, with --jobs, each worker has its own); otherwise Python's own modules
+are used.
+"""
+
+import os
+
+# (leading bytes, compression) pairs:
+MAGIC = [(b'\x1f\x8b', 'gzip'),
+         (b'BZh', 'bzip2'),
+         (b'\xfd7zXZ\x00', 'xz')]
+
+SUFFIXES = {'gzip': '.gz',
+            'bzip2': '.bz2',
+            'xz': '.xz'}
+
+def get_compression(filename):
+    """
+    Get the name of the compression used by a file ("gzip", "bzip2" or
+    "xz"), or None if it isn't compressed (or can't be read)
+    """
+    try:
+        f = open(filename, 'rb')
+    except (IOError, OSError):
+        return None
+    try:
+        try:
+            start = f.read(6)
+        except (IOError, OSError):
+            return None
+    finally:
+        f.close()
+    for magic, compression in MAGIC:
+        if start.startswith(magic):
+            return compression
+    return None
+
+def strip_suffix(filename, compression):
+    """
+    Get the name a compressed file would have had uncompressed, e.g.
+    "access_log.2" for "access_log.2.gz"
+    """
+    suffix = SUFFIXES[compression]
+    if filename.endswith(suffix):
+        return filename[:-len(suffix)]
+    return filename
+
+def open_decompressed(filename, compression, use_command=True):
+    """
+    Open a compressed file, returning a binary file object giving its
+    decompressed content
+    """
+    if use_command:
+        import shutil
+        command = shutil.which(compression)
+        if command:
+            return DecompressorPipe(command, filename)
+    if compression == 'gzip':
+        import gzip
+        return gzip.open(filename, 'rb')
+    if compression == 'bzip2':
+        import bz2
+        return bz2.open(filename, 'rb')
+    if compression == 'xz':
+        import lzma
+        return lzma.open(filename, 'rb')
+    raise ValueError('unknown compression: %r' % compression)
+
+class DecompressorPipe(object):
+    """
+    The output of a "gzip -dc" (or similar) process, as a file object
+    """
+    def __init__(self, command, filename):
+        import subprocess
+        self.filename = filename
+        self.proc = subprocess.Popen([command, '-dc', filename],
+                                     stdout=subprocess.PIPE)
+        self.stdout = self.proc.stdout
+        self.finished = False
+
+    def __iter__(self):
+        for line in self.stdout:
+            yield line
+        self.finished = True
+
+    def read(self, size=-1):
+        data = self.stdout.read(size)
+        if not data:
+            self.finished = True
+        return data
+
+    def close(self):
+        if not self.finished and self.proc.poll() is None:
+            # (closed early)
+            self.proc.terminate()
+        self.stdout.close()
+        returncode = self.proc.wait()
+        if self.finished and returncode:
+            raise IOError('error decompressing %s (exit code %i)'
+                          % (self.filename, returncode))
+
+import unittest
+class CompressedTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.testing import make_tmpdir, write_httpd_log
+        self.tmpdir = make_tmpdir(self)
+        self.path = os.path.join(self.tmpdir, 'access_log')
+        write_httpd_log(self.path, range(500))
+
+    def compress(self, compression):
+        import bz2, gzip, lzma
+        module = {'gzip': gzip, 'bzip2': bz2, 'xz': lzma}[compression]
+        path = self.path + '.1' + SUFFIXES[compression]
+        data = open(self.path, 'rb').read()
+        f = module.open(path, 'wb')
+        f.write(data)
+        f.close()
+        return path
+
+    def test_detection(self):
+        self.assertEquals(get_compression(self.path), None)
+        self.assertEquals(get_compression(self.tmpdir), None)
+        for compression in SUFFIXES:
+            path = self.compress(compression)
+            self.assertEquals(get_compression(path), compression)
+            self.assertEquals(strip_suffix(path, compression), self.path + '.1')
+
+    def test_same_rows(self):
+        from squeal.httpdlog import HttpdLog
+        expected = list(HttpdLog(self.path).iter_tuples())
+        for compression in SUFFIXES:
+            path = self.compress(compression)
+            src = HttpdLog(path)
+            self.assertEquals(src.get_compression(), compression)
+            self.assertFalse(src.appendable)
+            self.assertEquals(src.get_chunks(100), [src])
+            self.assertEquals(list(src.iter_tuples()), expected)
+            f = open_decompressed(path, compression, use_command=False)
+            self.assertEquals(f.read(), open(self.path, 'rb').read())
+            f.close()
+
+    def test_closed_early(self):
+        from itertools import islice
+        from squeal.httpdlog import HttpdLog
+        path = self.compress('gzip')
+        rows = HttpdLog(path).iter_tuples()
+        self.assertEquals(len(list(islice(rows, 3))), 3)
+        rows.close()
+
+    def test_corrupt(self):
+        from squeal.httpdlog import HttpdLog
+        path = self.compress('gzip')
+        data = open(path, 'rb').read()
+        f = open(path, 'wb')
+        f.write(data[:len(data) // 2])
+        f.close()
+        self.assertRaises((IOError, EOFError), list,
+                          HttpdLog(path).iter_tuples())
+
+if __name__=='__main__':
+    unittest.main()
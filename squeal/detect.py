@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Recognising what kind of input a file is, in-process, from its path and
+its first few KB (looking inside it, if it's compressed), rather than by
+running "file" on it.
+
+The kinds are:
+   "httpd", "yum", "syslog", "maillog": the logs squeal has parsers for
+   "pcap": a tcpdump capture
+   "zip", "tar", "rpm": archives
+   "text": any other text
+or None, for anything else.
+
+Logs in their usual places under /var/log are recognised from their paths
+alone; elsewhere, from what their first few lines look like.  Results are
+remembered for as long as the file's inode and mtime stay the same.
+"""
+
+import os
+import re
+
+# How much of the start of a file to look at:
+SNIFF_SIZE = 8192
+
+# The usual places of logs, as a single regex with a group per kind:
+PATHS = re.compile('^/var/log/(?:'
+                   '(?P<httpd>httpd/(?:ssl_)?access_log.*)'
+                   '|(?P<yum>yum\\.log.*)'
+                   '|(?P<syslog>(?:messages|secure).*)'
+                   '|(?P<maillog>maillog.*)'
+                   ')$')
+
+# (leading bytes, kind) pairs for binary files:
+MAGIC = [(b'\xd4\xc3\xb2\xa1', 'pcap'), # (little-endian)
+         (b'\xa1\xb2\xc3\xd4', 'pcap'), # (big-endian)
+         (b'\x4d\x3c\xb2\xa1', 'pcap'), # (nanosecond timestamps)
+         (b'\xa1\xb2\x3c\x4d', 'pcap'),
+         (b'\x0a\x0d\x0d\x0a', 'pcap'), # (pcapng)
+         (b'PK\x03\x04', 'zip'),
+         (b'PK\x05\x06', 'zip'), # (empty)
+         (b'\xed\xab\xee\xdb', 'rpm')]
+
+_TIMESTAMP = '[A-Z][a-z][a-z] [ 0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]'
+
+# The line formats of the logs, as a single regex with a group per kind,
+# in order of precedence (a yum or mail log line is also a syslog line):
+LINES = re.compile('(?P<httpd>[0-9]+\\.[0-9]+\\.[0-9]+\\.[0-9]+ \\S+ \\S+ \\[[^]]+\\] ")'
+                   '|(?P<yum>%s (?:Installed|Updated|Erased|Obsoleted'
+                   '|Dep-Installed|Reinstalled|Downgraded): \\S)'
+                   '|(?P<maillog>%s \\S+ (?:sendmail|postfix/\\S+|spamd'
+                   '|dovecot|sm-mta|exim|amavis)\\[[0-9]+\\]: )'
+                   '|(?P<syslog>%s \\S+ \\S+: )'
+                   % (_TIMESTAMP, _TIMESTAMP, _TIMESTAMP))
+
+# How many complete lines to sample:
+SAMPLE_LINES = 10
+
+# Kinds by (device, inode, mtime, size):
+_cache = {}
+
+def detect(filename):
+    """
+    Get the kind of input a file is (see above), or None
+    """
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    key = (st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size)
+    if key in _cache:
+        return _cache[key]
+    kind = _detect(filename)
+    _cache[key] = kind
+    return kind
+
+def _detect(filename):
+    from squeal.compressed import get_compression, strip_suffix, \
+         open_decompressed
+    abspath = os.path.abspath(filename)
+    # Compressed files (e.g. rotated logs) are whatever they'd be
+    # uncompressed:
+    compression = get_compression(filename)
+    if compression:
+        abspath = strip_suffix(abspath, compression)
+
+    m = PATHS.match(abspath)
+    if m:
+        return m.lastgroup
+
+    try:
+        if compression:
+            f = open_decompressed(filename, compression, use_command=False)
+        else:
+            f = open(filename, 'rb')
+        try:
+            head = f.read(SNIFF_SIZE)
+        finally:
+            f.close()
+    except (IOError, OSError, EOFError):
+        return None
+    return sniff(head, compressed=bool(compression))
+
+def sniff(head, compressed=False):
+    """
+    Get the kind of input a file starting with the given bytes is
+    """
+    for magic, kind in MAGIC:
+        if head.startswith(magic):
+            # (tcpdump can't read compressed captures)
+            if kind == 'pcap' and compressed:
+                return None
+            return kind
+    if is_tar_header(head):
+        return 'tar'
+
+    text = get_text(head)
+    if text is None:
+        return None
+    return sniff_log(text) or 'text'
+
+def is_tar_header(head):
+    """
+    Does a tar header block (of any flavour) start these bytes?  (its
+    checksum is the sum of its bytes, counting the checksum field as spaces)
+    """
+    if len(head) < 512:
+        return False
+    field = head[148:156].replace(b'\0', b' ').strip()
+    if not field or field.strip(b'01234567'):
+        return False
+    return int(field, 8) == sum(head[:148]) + 32 * 8 + sum(head[156:512])
+
+def get_text(head):
+    """
+    Decode the start of a file as UTF-8 text, or get None if it isn't text
+    """
+    if b'\0' in head:
+        return None
+    try:
+        return head.decode('utf-8')
+    except UnicodeDecodeError as e:
+        # (the read may have cut a character short)
+        if e.start < len(head) - 3:
+            return None
+        return head[:e.start].decode('utf-8')
+
+def sniff_log(text):
+    """
+    Get the kind of log whose format most of the first few complete lines
+    of some text match, or None
+    """
+    lines = text.splitlines()
+    if len(text) >= SNIFF_SIZE - 4 and len(lines) > 1:
+        # (the last line may have been cut short)
+        lines = lines[:-1]
+    lines = [line for line in lines if line.strip()][:SAMPLE_LINES]
+    votes = {}
+    for line in lines:
+        m = LINES.match(line)
+        if m:
+            votes[m.lastgroup] = votes.get(m.lastgroup, 0) + 1
+    if not votes:
+        return None
+    kind = max(votes, key=votes.get)
+    if votes[kind] * 2 < len(lines):
+        return None
+    if kind == 'syslog' and 'maillog' in votes:
+        # (a mail log has other daemons' lines mixed in)
+        return 'maillog'
+    return kind
+
+def clear_cache():
+    _cache.clear()
+
+import unittest
+class DetectTests(unittest.TestCase):
+    samples = {
+        'httpd': '127.0.0.1 - - [16/Feb/2009:15:08:29 -0500] "GET /foo.css HTTP/1.1" 200 2261\n'
+                 '127.0.0.1 - jdoe@EXAMPLE.COM [15/Apr/2009:04:26:15 +0800] "GET /favicon.ico HTTP/1.1" 404 1346\n',
+        'yum': 'Dec 18 14:21:26 Erased: Django-docs\n'
+               'Jan 06 18:47:31 Installed: imlib-devel - 1:1.9.15-6.el5.i386\n'
+               'Feb 14 19:04:59 Updated: 1:net-snmp-libs-5.4.2.1-2.fc10.i386\n',
+        'syslog': 'Mar 23 19:54:16 brick kernel: virbr0: starting userspace STP failed\n'
+                  'Mar  3 12:39:24 brick avahi-daemon[3322]: Invalid legacy unicast query packet.\n',
+        'maillog': 'Mar 15 04:05:14 brick sendmail[30148]: n2F826ZV030148: from=root, size=808\n'
+                   'Mar 15 04:05:14 brick dovecot: pop3-login: Login: user=<jdoe>\n'
+                   'Mar  8 06:28:37 hmsspeedy spamd[15521]: spamd: result: . -2 - BAYES_00\n',
+        'text': 'just some text\nin a file\n',
+    }
+
+    def setUp(self):
+        from squeal.testing import make_tmpdir
+        self.tmpdir = make_tmpdir(self)
+        clear_cache()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmpdir, name)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        f = open(path, 'wb')
+        f.write(data)
+        f.close()
+        return path
+
+    def test_logs(self):
+        for kind, text in self.samples.items():
+            self.assertEquals(detect(self.write(kind, text)), kind)
+            # A truncated last line and blank lines don't matter:
+            self.assertEquals(detect(self.write(kind + '.2', '\n' + text * 2000)),
+                              kind)
+
+    def test_compressed(self):
+        import gzip
+        data = gzip.compress(self.samples['yum'].encode('utf-8'))
+        self.assertEquals(detect(self.write('log.gz', data)), 'yum')
+
+    def test_binary(self):
+        import io, tarfile, zipfile
+        self.assertEquals(detect(self.write('x', b'\xd4\xc3\xb2\xa1' + b'\0' * 20)),
+                          'pcap')
+        self.assertEquals(detect(self.write('y', b'\xed\xab\xee\xdb\0\0')),
+                          'rpm')
+        self.assertEquals(detect(self.write('z', b'\x7fELF\0\0\0')), None)
+        self.assertEquals(detect(self.write('empty', b'')), 'text')
+        buf = io.BytesIO()
+        zf = zipfile.ZipFile(buf, 'w')
+        zf.writestr('a.txt', 'hello')
+        zf.close()
+        self.assertEquals(detect(self.write('a.zip', buf.getvalue())), 'zip')
+        for mode in ['w', 'w:gz']:
+            buf = io.BytesIO()
+            tf = tarfile.open(fileobj=buf, mode=mode)
+            info = tarfile.TarInfo('a.txt')
+            info.size = 5
+            tf.addfile(info, io.BytesIO(b'hello'))
+            tf.close()
+            self.assertEquals(detect(self.write('a.tar', buf.getvalue())), 'tar')
+
+    def test_paths(self):
+        self.assertEquals(PATHS.match('/var/log/httpd/ssl_access_log.1').lastgroup,
+                          'httpd')
+        self.assertEquals(PATHS.match('/var/log/secure').lastgroup, 'syslog')
+        self.assertEquals(PATHS.match('/var/log/maillog-20090301').lastgroup,
+                          'maillog')
+        self.assertEquals(PATHS.match('/var/log/boot.log'), None)
+
+    def test_cache(self):
+        path = self.write('log', self.samples['httpd'])
+        self.assertEquals(detect(path), 'httpd')
+        self.assertEquals(len(_cache), 1)
+        self.assertEquals(detect(path), 'httpd')
+        self.assertEquals(len(_cache), 1)
+        # A rewritten file is looked at afresh:
+        st = os.stat(path)
+        self.write('log', self.samples['syslog'])
+        os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertEquals(detect(path), 'syslog')
+
+if __name__=='__main__':
+    unittest.main()
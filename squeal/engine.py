@@ -0,0 +1,816 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Executing simple queries directly on the rows coming from a DictSource,
+without loading them all into sqlite first.
+
+plan_query() looks at a Query, and returns an object with an execute()
+method generating the same result tuples that sqlite would, or None if the
+query needs the whole of its input loaded into sqlite.
+"""
+
+import re
+from itertools import islice
+
+from squeal.query import get_projection
+from squeal.sql import parse_clauses, split_list, apply_affinity, tokenize, \
+    compare, sort_key
+
+class StreamingPlan(object):
+    """
+    A filter/project/limit pipeline over the input's rows: the result rows
+    are generated as the input is read, in constant memory.
+    """
+    # Does the result depend on the order of the input's rows?
+    ordered_input = True
+
+    def __init__(self, input, columns, filter, offset, limit):
+        self.input = input
+        # The columns to output, in order:
+        self.columns = columns
+        self.filter = filter
+        self.offset = offset
+        self.limit = limit
+
+    def __repr__(self):
+        return 'StreamingPlan(%s, filter=%r, offset=%r, limit=%r)' \
+               % ([col.name for col in self.columns], self.filter,
+                  self.offset, self.limit)
+
+    def execute(self):
+        source_rows = self.input.iter_tuples()
+        rows = self.get_results(source_rows)
+        if self.offset or self.limit is not None:
+            if self.limit is None:
+                stop = None
+            else:
+                stop = self.offset + self.limit
+            rows = islice(rows, self.offset, stop)
+        try:
+            for row in rows:
+                yield row
+        finally:
+            # Stop reading now, rather than when garbage-collected:
+            close_rows(source_rows)
+
+    def get_results(self, rows):
+        """
+        Generate the result rows for some of the input's row tuples
+        (ignoring the offset and limit)
+        """
+        names = self.input.get_wanted_names()
+        if self.filter:
+            rows = filter(self.filter.for_tuples(names), rows)
+        outputs = [(names.index(col.name), col.sql_type())
+                   for col in self.columns]
+        for t in rows:
+            # Give back what sqlite would have stored for each value:
+            yield tuple([apply_affinity(affinity, t[index])
+                         for (index, affinity) in outputs])
+
+def close_rows(rows):
+    """
+    Release whatever is behind an iterator from DictSource.iter_tuples() or
+    iter_dicts() (open files, child processes...) that we've finished with
+    early
+    """
+    close = getattr(rows, 'close', None)
+    if close:
+        close()
+
+class ChunkedSqlitePlan(object):
+    """
+    A query with a LIMIT but no ordering, grouping or DISTINCT, whose WHERE
+    clause needs sqlite: the rows are loaded into sqlite and queried a batch
+    at a time, stopping reading the input as soon as enough result rows have
+    been produced.  (When following the input, the limit may be None.)
+    """
+    ordered_input = True
+
+    def __init__(self, query, columns, filter, where, offset, limit):
+        self.query = query
+        # The columns to load:
+        self.columns = columns
+        self.filter = filter
+        # SQL of the WHERE clause (or None):
+        self.where = where
+        self.offset = offset
+        self.limit = limit
+
+    def __repr__(self):
+        return 'ChunkedSqlitePlan(filter=%r, where=%r, offset=%r, limit=%r)' \
+               % (self.filter, self.where, self.offset, self.limit)
+
+    def execute(self):
+        query = self.query
+        db = self.create_db()
+        batch_size = query.options.batch_size
+        to_skip = self.offset
+        to_yield = self.limit
+        source_rows = query.input.iter_tuples()
+        tuples = self.prepare(db, source_rows)
+        try:
+            while to_yield > 0:
+                batch = list(islice(tuples, batch_size))
+                if not batch:
+                    break
+                rows = self.query_batch(db, batch)
+                if to_skip:
+                    skipped = rows[:to_skip]
+                    rows = rows[to_skip:]
+                    to_skip -= len(skipped)
+                for row in rows[:to_yield]:
+                    yield row
+                to_yield -= len(rows[:to_yield])
+        finally:
+            close_rows(source_rows)
+
+    def create_db(self):
+        return self.query.create_db(self.columns)
+
+    def prepare(self, db, tuples):
+        """
+        Filter some of the input's row tuples, rearranging them to suit db
+        """
+        names = self.query.input.get_wanted_names()
+        if self.filter:
+            tuples = filter(self.filter.for_tuples(names), tuples)
+        projection = get_projection(names, db.col_names)
+        if projection:
+            tuples = map(projection, tuples)
+        return tuples
+
+    def query_batch(self, db, batch):
+        """
+        Get the result rows for a batch of prepared tuples (ignoring the
+        offset and limit), leaving db empty again
+        """
+        stuff = []
+        if self.where:
+            stuff = ['WHERE', self.where]
+        query = self.query
+        db.load_tuples(batch)
+        rows = list(db.query(query.distinct, query.expr_names, stuff))
+        db.clear()
+        return rows
+
+#
+# Aggregate functions, following sqlite's semantics (see func.c in sqlite)
+#
+_numeric_prefix_pat = re.compile(r'\s*[+-]?(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?')
+
+def as_real(value):
+    """
+    Convert a stored value to a float as sqlite's sqlite3_value_double() does
+    (text is converted using its longest numeric prefix)
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        m = _numeric_prefix_pat.match(value)
+        if m:
+            return float(m.group())
+    return 0.0
+
+class Aggregate(object):
+    def step(self, value):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+class CountStar(Aggregate):
+    # (step() takes no value)
+    def __init__(self):
+        self.count = 0
+
+    def step(self):
+        self.count += 1
+
+    def result(self):
+        return self.count
+
+class Count(Aggregate):
+    def __init__(self):
+        self.count = 0
+
+    def step(self, value):
+        if value is not None:
+            self.count += 1
+
+    def result(self):
+        return self.count
+
+class Sum(Aggregate):
+    def __init__(self):
+        self.count = 0
+        self.int_sum = 0
+        self.real_sum = 0.0
+        self.approx = False # seen anything other than integers?
+
+    def step(self, value):
+        if value is None:
+            return
+        self.count += 1
+        if isinstance(value, int):
+            self.int_sum += value
+        else:
+            self.approx = True
+            self.real_sum += as_real(value)
+
+    def result(self):
+        if self.count == 0:
+            return None
+        if self.approx:
+            return self.int_sum + self.real_sum
+        return self.int_sum
+
+class Total(Sum):
+    def result(self):
+        return float(self.int_sum) + self.real_sum
+
+class Avg(Sum):
+    def result(self):
+        if self.count == 0:
+            return None
+        return (float(self.int_sum) + self.real_sum) / self.count
+
+class Min(Aggregate):
+    # The comparison result for which a new value replaces the current one:
+    replace_if = -1
+
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is None:
+            return
+        if self.value is None or compare(value, self.value) == self.replace_if:
+            self.value = value
+
+    def result(self):
+        return self.value
+
+class Max(Min):
+    replace_if = 1
+
+# Aggregate functions we can compute, with whether they need their argument
+# to have numeric affinity to be computed here:
+aggregates = {'count': (Count, False),
+              'sum': (Sum, True),
+              'total': (Total, True),
+              'avg': (Avg, True),
+              'min': (Min, False),
+              'max': (Max, False)}
+
+class HashAggregatePlan(object):
+    """
+    A GROUP BY done by keeping one set of accumulators per group in a dict,
+    as the input is read, so that memory use is proportional to the number
+    of groups rather than the number of rows.
+
+    items describes the select list: each entry is either
+      ('key', index into the group key), or
+      ('agg', index into the accumulators)
+    aggregates is a list of (Aggregate subclass, column or None) pairs.
+    order_by is a list of (index into the select list, descending) pairs.
+    """
+    def __init__(self, input, group_columns, aggregates, items, filter,
+                 order_by, offset, limit):
+        self.input = input
+        self.group_columns = group_columns
+        self.aggregates = aggregates
+        self.items = items
+        self.filter = filter
+        self.order_by = order_by
+        self.offset = offset
+        self.limit = limit
+        # The groups are sorted, so only the order in which floating point
+        # values are added up can make a difference:
+        self.ordered_input = False
+        for (cls, col) in aggregates:
+            if cls in (Sum, Total, Avg) and col.sql_type() != 'INTEGER':
+                self.ordered_input = True
+
+    def __repr__(self):
+        return 'HashAggregatePlan(group by %s, %s, filter=%r, order_by=%r, ' \
+               'offset=%r, limit=%r)' \
+               % ([col.name for col in self.group_columns],
+                  ['%s(%s)' % (cls.__name__, col.name if col else '*')
+                   for (cls, col) in self.aggregates],
+                  self.filter, self.order_by, self.offset, self.limit)
+
+    def execute(self):
+        groups = {}
+        self.add_rows(groups, self.input.iter_tuples())
+        return self.get_results(groups)
+
+    def add_rows(self, groups, rows):
+        """
+        Accumulate some of the input's row tuples into a dict of groups
+        (which can be added to again later, as more rows arrive)
+        """
+        names = self.input.get_wanted_names()
+        if self.filter:
+            rows = filter(self.filter.for_tuples(names), rows)
+        keys = [(names.index(col.name), col.sql_type())
+                for col in self.group_columns]
+        args = [(names.index(col.name), col.sql_type()) if col else None
+                for (cls, col) in self.aggregates]
+        for t in rows:
+            key = tuple([apply_affinity(affinity, t[index])
+                         for (index, affinity) in keys])
+            accumulators = groups.get(key)
+            if accumulators is None:
+                accumulators = [cls() for (cls, col) in self.aggregates]
+                groups[key] = accumulators
+            for acc, arg in zip(accumulators, args):
+                if arg:
+                    acc.step(apply_affinity(arg[1], t[arg[0]]))
+                else:
+                    acc.step()
+
+    def get_results(self, groups):
+        """
+        Generate the result rows for the groups accumulated so far
+        """
+        if not groups and not self.group_columns:
+            # Aggregating over no rows at all still gives one row:
+            groups = {(): [cls() for (cls, col) in self.aggregates]}
+
+        # Give the groups in order of their keys, unless told otherwise;
+        # rows that tie under ORDER BY stay in that order (SQL leaves the
+        # order of ties undefined, and sqlite's depends on how it plans the
+        # query):
+        rows = []
+        for key in sorted(groups, key=lambda k: [sort_key(v) for v in k]):
+            accumulators = groups[key]
+            rows.append(tuple([key[idx] if kind == 'key'
+                               else accumulators[idx].result()
+                               for (kind, idx) in self.items]))
+        for idx, descending in reversed(self.order_by):
+            rows.sort(key=lambda row: sort_key(row[idx]), reverse=descending)
+
+        if self.limit is None:
+            stop = None
+        else:
+            stop = self.offset + self.limit
+        for row in islice(rows, self.offset, stop):
+            yield row
+
+def parse_limit(tokens):
+    """
+    Parse the contents of a LIMIT clause, returning an (offset, limit) pair,
+    with limit None for "no limit"; raises ValueError for anything other
+    than integer literals
+    """
+    values = [tok.value for tok in tokens]
+    for i in range(0, len(values), 2):
+        if not values[i].isdigit():
+            raise ValueError('unsupported LIMIT: %s' % ' '.join(values))
+    if len(values) == 1:
+        return (0, int(values[0]))
+    if len(values) == 3 and values[1].lower() == 'offset':
+        return (int(values[2]), int(values[0]))
+    if len(values) == 3 and values[1] == ',':
+        return (int(values[0]), int(values[2]))
+    raise ValueError('unsupported LIMIT: %s' % ' '.join(values))
+
+def get_output_columns(expr_names, columns):
+    """
+    Map the query's select list to a list of input columns, or return None
+    if it contains anything other than plain column names
+    """
+    by_name = dict((col.name.lower(), col) for col in columns)
+    result = []
+    for name in expr_names:
+        key = name.lower()
+        if len(name) > 2 and name[0] == name[-1] == '"':
+            key = name[1:-1].lower()
+        if key not in by_name:
+            return None
+        result.append(by_name[key])
+    return result
+
+def _normalize(tokens):
+    # Canonical text of an expression, for spotting the same one twice
+    return ''.join([tok.value.lower() for tok in tokens])
+
+def _parse_column_ref(tokens, by_name):
+    if len(tokens) == 1 and tokens[0].kind in ('name', 'quoted'):
+        return by_name.get(tokens[0].value.lower())
+    return None
+
+def plan_aggregate(query, clauses, filter, offset, limit):
+    """
+    Try to build a HashAggregatePlan for a query with a GROUP BY, or whose
+    select list consists entirely of aggregates
+    """
+    by_name = dict((col.name.lower(), col) for col in query.input.get_columns())
+
+    group_columns = []
+    if clauses.group_by is not None:
+        for tokens in split_list(clauses.group_by):
+            col = _parse_column_ref(tokens, by_name)
+            if col is None:
+                return None
+            group_columns.append(col)
+    group_names = [col.name for col in group_columns]
+
+    items = []
+    aggs = []
+    item_texts = []
+    for name in query.expr_names:
+        try:
+            tokens = tokenize(name)
+        except ValueError:
+            return None
+        item_texts.append(_normalize(tokens))
+        col = _parse_column_ref(tokens, by_name)
+        if col is not None:
+            if col.name not in group_names:
+                # sqlite gives the value from an arbitrary row of the group
+                return None
+            items.append(('key', group_names.index(col.name)))
+            continue
+        if len(tokens) != 4 or tokens[0].kind != 'name' \
+                or tokens[1].value != '(' or tokens[3].value != ')':
+            return None
+        func = tokens[0].value.lower()
+        if func == 'count' and tokens[2].value == '*':
+            aggs.append((CountStar, None))
+        else:
+            col = _parse_column_ref(tokens[2:3], by_name)
+            if func not in aggregates or col is None:
+                return None
+            cls, numeric_only = aggregates[func]
+            if numeric_only and col.sql_type() not in ('INTEGER', 'REAL', 'NUMERIC'):
+                return None
+            aggs.append((cls, col))
+        items.append(('agg', len(aggs) - 1))
+
+    if not aggs and not group_columns:
+        return None
+
+    order_by = []
+    if clauses.order_by is not None:
+        for tokens in split_list(clauses.order_by):
+            descending = False
+            if tokens and tokens[-1].kind == 'name' \
+                    and tokens[-1].value.lower() in ('asc', 'desc'):
+                descending = tokens[-1].value.lower() == 'desc'
+                tokens = tokens[:-1]
+            if len(tokens) == 1 and tokens[0].kind == 'number':
+                # A position in the select list:
+                if not tokens[0].value.isdigit():
+                    return None
+                idx = int(tokens[0].value) - 1
+                if not 0 <= idx < len(items):
+                    return None
+            else:
+                if len(tokens) == 1 and tokens[0].kind in ('quoted', 'string') \
+                        and tokens[0].value.lower() not in by_name:
+                    # A string constant, e.g. order by "total(size)", which
+                    # sqlite doesn't match against the select list; sorting
+                    # by it has no effect:
+                    continue
+                text = _normalize(tokens)
+                if text not in item_texts:
+                    return None
+                idx = item_texts.index(text)
+            order_by.append((idx, descending))
+
+    if order_by and (offset or limit is not None):
+        # Which rows a LIMIT keeps would depend on the order of any that
+        # tie, unless the ORDER BY takes in all of the group key:
+        sorted_keys = set([items[idx][1] for (idx, descending) in order_by
+                           if items[idx][0] == 'key'])
+        if len(sorted_keys) < len(group_columns):
+            return None
+
+    return HashAggregatePlan(query.input, group_columns, aggs, items, filter,
+                             order_by, offset, limit)
+
+# sqlite's core scalar functions (min() and max() being aggregates with a
+# single argument, as they are in a select list, whose commas split it):
+SCALAR_FUNCTIONS = set([
+    'abs', 'cast', 'char', 'coalesce', 'date', 'datetime', 'format', 'glob',
+    'hex', 'ifnull', 'iif', 'instr', 'julianday', 'length', 'like',
+    'likelihood', 'likely', 'lower', 'ltrim', 'nullif', 'printf', 'quote',
+    'random', 'randomblob', 'replace', 'round', 'rtrim', 'sign', 'soundex',
+    'strftime', 'substr', 'substring', 'time', 'trim', 'typeof', 'unhex',
+    'unicode', 'unixepoch', 'unlikely', 'upper', 'zeroblob',
+    'json', 'json_array', 'json_array_length', 'json_extract', 'json_insert',
+    'json_object', 'json_patch', 'json_quote', 'json_remove', 'json_replace',
+    'json_set', 'json_type', 'json_valid'])
+
+def has_aggregates(expr_names):
+    """
+    Could the select list contain an aggregate (or window) function?  Any
+    function other than the known scalar ones might be one.
+    """
+    for name in expr_names:
+        try:
+            tokens = tokenize(name)
+        except ValueError:
+            return True
+        for i, tok in enumerate(tokens):
+            if tok.kind != 'name':
+                continue
+            word = tok.value.lower()
+            if word == 'over':
+                return True
+            following = tokens[i+1:i+2]
+            if following and following[0].value == '(' \
+                    and word not in SCALAR_FUNCTIONS:
+                return True
+    return False
+
+def plan_query(query, follow=False):
+    """
+    Choose a way of executing the query without sqlite, if there is one.
+
+    With follow, queries that sqlite could answer a batch of rows at a time
+    are planned as a ChunkedSqlitePlan even without a LIMIT (see
+    squeal.follow)
+    """
+    if query.distinct:
+        return None
+    clauses = parse_clauses(query.stuff)
+    if clauses is None or clauses.having is not None:
+        return None
+
+    filter = None
+    if clauses.where is not None:
+        filter = query.get_filter()
+
+    offset, limit = 0, None
+    if clauses.limit is not None:
+        try:
+            offset, limit = parse_limit(clauses.limit)
+        except ValueError:
+            return None
+
+    if clauses.where is None or (filter is not None and filter.complete):
+        if clauses.group_by is None and clauses.order_by is None:
+            output_columns = get_output_columns(query.expr_names,
+                                                query.input.get_columns())
+            if output_columns is not None:
+                return StreamingPlan(query.input, output_columns, filter,
+                                     offset, limit)
+
+        plan = plan_aggregate(query, clauses, filter, offset, limit)
+        if plan:
+            return plan
+
+    if (limit is not None or follow) and clauses.group_by is None \
+            and clauses.order_by is None \
+            and not has_aggregates(query.expr_names):
+        where = None
+        if clauses.where is not None:
+            where = ' '.join([tok.as_sql() for tok in clauses.where])
+        return ChunkedSqlitePlan(query, query.get_needed_columns(), filter,
+                                 where, offset, limit)
+    return None
+
+import unittest
+class StreamingTests(unittest.TestCase):
+    def assertSameAsSqlite(self, *args):
+        # The streaming engine must be chosen, and give the same results as
+        # sqlite:
+        from squeal.query import QueryParser, Options, dummy
+        args = [dummy if arg == 'dummy' else arg for arg in args]
+        q = QueryParser().parse_args(Options(), args)
+        plan = plan_query(q)
+        self.assert_(isinstance(plan, StreamingPlan))
+        expected = list(QueryParser().parse_args(Options(engine='sqlite'),
+                                                 args).execute())
+        self.assertEquals(list(plan.execute()), expected)
+        self.assertEquals(list(q.execute()), expected)
+        return expected
+
+    def test_projection(self):
+        self.assertSameAsSqlite('type, SIZE from', 'dummy')
+        self.assertSameAsSqlite('*', 'from', 'dummy')
+
+    def test_filter_and_limit(self):
+        result = self.assertSameAsSqlite('size from', 'dummy',
+                                         'where type="cat" limit 2')
+        self.assertEquals(result, [(1, ), (2, )])
+        self.assertSameAsSqlite('size from', 'dummy', 'limit 2 offset 2')
+        self.assertSameAsSqlite('size from', 'dummy', 'limit 1, 3')
+        self.assertSameAsSqlite('size from', 'dummy', 'limit 0')
+
+    def test_affinity(self):
+        # A TEXT column given an int comes back as a string, as from sqlite:
+        from squeal.query import FromMemory, StringColumn, Options, QueryParser
+        src = FromMemory([StringColumn('pid')], [dict(pid=42), dict()])
+        q = QueryParser().parse_args(Options(), ['pid', 'from', src])
+        self.assertEquals(list(q.execute()), [('42', ), (None, )])
+
+    def test_needs_sqlite(self):
+        from squeal.query import QueryParser, Options, dummy
+        for args in [('distinct type from', dummy),
+                     ('type from', dummy, 'order by size'),
+                     ('size*2 from', dummy),
+                     ('size from', dummy, 'where type="cat" or size > 3'),
+                     ('size from', dummy, 'limit 1+1')]:
+            q = QueryParser().parse_args(Options(), args)
+            self.assertEquals(plan_query(q), None)
+
+class ChunkedTests(unittest.TestCase):
+    def make_query(self, options, src, *args):
+        from squeal.query import QueryParser
+        return QueryParser().parse_args(options, list(args[:1]) + [src]
+                                        + list(args[1:]))
+
+    def assertSameAsSqlite(self, *args):
+        from squeal.query import Options, dummy
+        for batch_size in [1, 2, 1000]:
+            options = Options(batch_size=batch_size)
+            q = self.make_query(options, dummy, *args)
+            self.assert_(isinstance(plan_query(q), ChunkedSqlitePlan))
+            expected = list(self.make_query(Options(engine='sqlite'), dummy,
+                                            *args).execute())
+            self.assertEquals(list(q.execute()), expected)
+
+    def test_limit(self):
+        for limit in ['limit 0', 'limit 1', 'limit 3', 'limit 10',
+                      'limit 2 offset 1', 'limit 1, 3', 'limit 2 offset 10']:
+            self.assertSameAsSqlite('size*2 from', "where length(type) = 3 "
+                                    + limit)
+            self.assertSameAsSqlite('type, size from',
+                                    "where type like 'c%' and size + 1 > 2 "
+                                    + limit)
+            self.assertSameAsSqlite('upper(type), abs(size) from',
+                                    "where length(type) = 3 " + limit)
+
+    def test_stops_reading(self):
+        from squeal.query import DictSource, IntColumn, Options
+        class Counter(DictSource):
+            def __init__(self):
+                self.read = 0
+                self.closed = False
+            def get_columns(self):
+                return [IntColumn('n')]
+            def iter_dicts(self):
+                try:
+                    while True:
+                        self.read += 1
+                        yield dict(n=self.read)
+                finally:
+                    self.closed = True
+        for args in [('n from', 'limit 5'), # streaming
+                     ('n*2 from', 'where n % 3 = 0 limit 5')]: # chunked
+            src = Counter()
+            q = self.make_query(Options(batch_size=10), src, *args)
+            self.assertEquals(len(list(q.execute())), 5)
+            self.assert_(src.read <= 20)
+            self.assert_(src.closed)
+
+    def test_needs_sqlite(self):
+        from squeal.query import Options, dummy
+        for args in [('count(*) from', 'where length(type) = 3 limit 1'),
+                     # (an aggregate that isn't one of the usual ones)
+                     ('json_group_array(size) from',
+                      'where length(type) = 3 limit 10'),
+                     ('row_number() over () from',
+                      'where length(type) = 3 limit 1'),
+                     ('type from', 'where length(type) = 3 order by size limit 1'),
+                     ('size*2 from', 'where length(type) = 3')]:
+            self.assertEquals(plan_query(self.make_query(Options(), dummy,
+                                                         *args)),
+                              None)
+
+class AggregateTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.query import FromMemory, StringColumn, IntColumn
+        self.src = FromMemory([StringColumn('host'), StringColumn('type'),
+                               IntColumn('size')],
+                              [dict(host='a', type='cat', size=1),
+                               dict(host='b', type='cat', size=None),
+                               dict(host='a', type='dog', size=5),
+                               dict(host=None, type='dog', size='big'),
+                               dict(host='b', type='cat', size=2.5),
+                               dict(host='a', type=7, size=-3)])
+
+    def plan(self, *args):
+        from squeal.query import QueryParser, Options
+        args = [self.src if arg == 'src' else arg for arg in args]
+        q = QueryParser().parse_args(Options(), args)
+        # (as execute() would)
+        q.prepare_input()
+        return plan_query(q)
+
+    def get_sqlite_results(self, *args):
+        from squeal.query import QueryParser, Options
+        args = [self.src if arg == 'src' else arg for arg in args]
+        return list(QueryParser().parse_args(Options(engine='sqlite'),
+                                             args).execute())
+
+    def assertSameAsSqlite(self, *args):
+        plan = self.plan(*args)
+        self.assert_(isinstance(plan, HashAggregatePlan))
+        expected = self.get_sqlite_results(*args)
+        self.assertEquals(list(plan.execute()), expected)
+        return expected
+
+    def assertSameRowsAsSqlite(self, *args):
+        # (in whatever order)
+        plan = self.plan(*args)
+        self.assert_(isinstance(plan, HashAggregatePlan))
+        result = list(plan.execute())
+        self.assertEquals(sorted(result, key=repr),
+                          sorted(self.get_sqlite_results(*args), key=repr))
+        return result
+
+    def test_group_by(self):
+        self.assertSameAsSqlite('host, count(*), count(size), min(size), '
+                                'max(size), sum(size), total(size), avg(size) '
+                                'from', 'src', 'group by host')
+        self.assertSameAsSqlite('count(*), type, host from', 'src',
+                                'group by host, type')
+
+    def test_no_group_by(self):
+        self.assertSameAsSqlite('count(*), max(size), sum(size) from', 'src')
+        self.assertSameAsSqlite('count(*), max(size), sum(size), total(size) from',
+                                'src', 'where size > 100')
+
+    def test_order_by(self):
+        self.assertSameAsSqlite('host, count(*) from', 'src',
+                                'group by host order by count(*) desc')
+        self.assertSameAsSqlite('host, total(size) from', 'src',
+                                'group by host order by "total(size)" desc, host')
+        self.assertSameAsSqlite('host, type, count(*) from', 'src',
+                                'group by host, type order by 3, 2 desc, 1 limit 3')
+
+    def test_ties(self):
+        # SQL leaves the order of rows that tie under ORDER BY undefined; ours
+        # stay in order of their group keys:
+        result = self.assertSameRowsAsSqlite('host, count(size) from', 'src',
+                                             'group by host order by count(size) desc')
+        self.assertEquals(result, [('a', 3), (None, 1), ('b', 1)])
+        result = self.assertSameRowsAsSqlite('host, count(size) from', 'src',
+                                             'group by host order by count(size)')
+        self.assertEquals(result, [(None, 1), ('b', 1), ('a', 3)])
+        result = self.assertSameRowsAsSqlite('host, type, count(*) from', 'src',
+                                             'group by host, type order by 3 desc')
+        self.assertEquals(result, [('b', 'cat', 2), (None, 'dog', 1),
+                                   ('a', '7', 1), ('a', 'cat', 1),
+                                   ('a', 'dog', 1)])
+        self.assertSameAsSqlite('host, count(size), count(*) from', 'src',
+                                'group by host order by 2 desc, 3 desc')
+        # With a LIMIT, ties would decide which rows are kept, so sqlite is
+        # left to it unless the ORDER BY takes in all of the group key:
+        for rest in ['group by host, type order by 3 desc limit 3',
+                     'group by host, type order by count(*) desc, 1 desc limit 2',
+                     'group by host order by count(size) limit 1 offset 1']:
+            self.assertEquals(self.plan('host, type, count(*), count(size) from',
+                                        'src', rest), None)
+        self.assertSameAsSqlite('host, type, count(*) from', 'src',
+                                'group by host, type order by 3 desc, 2, 1 desc limit 3')
+        self.assertSameAsSqlite('host, count(size) from', 'src',
+                                'group by host order by 2, host limit 1 offset 1')
+
+    def test_readme_queries(self):
+        # The examples from test_aggregates, against the same data:
+        from squeal.query import dummy
+        self.src = dummy
+        result = self.assertSameAsSqlite('type', 'count(*)', 'max(size)',
+                                         'min(size)', 'total(size)',
+                                         'avg(size)', 'from', 'src',
+                                         'group', 'by', 'type',
+                                         'order', 'by', 'max(size)', 'desc')
+        self.assertEquals(result, [('dog', 2, 8, 4, 12.0, 6.0),
+                                   ('cat', 3, 3, 1,  6.0, 2.0)])
+
+    def test_needs_sqlite(self):
+        from squeal.query import QueryParser, Options
+        for args in [('host, size from', self.src, 'group by host'),
+                     ('host, count(*) from', self.src,
+                      'group by host having count(*) > 1'),
+                     ('count(distinct host) from', self.src),
+                     ('total(host) from', self.src),
+                     ('host, count(*) from', self.src,
+                      'group by host order by max(size)'),
+                     ('upper(host), count(*) from', self.src, 'group by host')]:
+            q = QueryParser().parse_args(Options(), args)
+            self.assertEquals(plan_query(q), None)
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,412 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Running a query continuously over input that keeps growing, like a query
+on the output of "tail -F" (enabled with --follow).
+
+The input is read from the start, and then polled for new lines.  Queries
+whose result rows each come from a single input row (filtering, projecting,
+and possibly a LIMIT) give the result rows for each batch of new input rows
+as they arrive.  Aggregates that squeal.engine can compute itself keep their
+accumulators from one batch to the next, and give their whole result again
+every Options.refresh seconds whilst it's changing.  Anything else (such as
+an ORDER BY over the rows themselves) would mean requerying the whole
+history every time, and is refused.
+
+Files are followed by name: when one is rotated (renamed, and replaced by a
+new file), whatever was still being appended to the old one is read, and
+then the new one from the start; if one is truncated, it's read from the
+start again.  Standard input is read by a background thread, until it ends.
+"""
+
+import locale
+import os
+import time
+from itertools import islice
+from queue import Queue, Empty
+from threading import Thread
+
+# Seconds to wait between looking for new input, when there wasn't any:
+POLL_INTERVAL = 0.25
+
+# Roughly how much input to read at a time:
+READ_SIZE = 1024 * 1024
+
+class FileFollower(object):
+    """
+    Gives the lines appended to a file, following it by name
+    """
+    # (files never end)
+    finished = False
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.encoding = locale.getpreferredencoding(False)
+        self.f = None
+        # Bytes of an incomplete final line:
+        self.partial = b''
+        self._reopen()
+
+    def _reopen(self):
+        try:
+            f = open(self.filename, 'rb')
+        except (IOError, OSError):
+            return False # (e.g. rotated, but not recreated yet)
+        if self.f:
+            self.f.close()
+        self.f = f
+        return True
+
+    def _split(self, data):
+        lines = (self.partial + data).split(b'\n')
+        self.partial = lines.pop()
+        return [self._decode(line + b'\n') for line in lines]
+
+    def _decode(self, line):
+        if line.endswith(b'\r\n'):
+            line = line[:-2] + b'\n'
+        return line.decode(self.encoding)
+
+    def _is_replaced(self):
+        # Has the file been rotated (or truncated)?
+        try:
+            st = os.stat(self.filename)
+        except OSError:
+            return False
+        return st.st_ino != os.fstat(self.f.fileno()).st_ino \
+               or st.st_size < self.f.tell()
+
+    def read_lines(self):
+        """
+        Get a list of the complete lines added since the last call (up to
+        about READ_SIZE bytes of them)
+        """
+        if self.f is None and not self._reopen():
+            return []
+        data = self.f.read(READ_SIZE)
+        if data:
+            return self._split(data)
+        if not self._is_replaced():
+            return []
+        # Take anything written to the old file just before it was replaced;
+        # its final line will never be finished now:
+        lines = self._split(self.f.read())
+        if self.partial:
+            lines.append(self._decode(self.partial))
+            self.partial = b''
+        if self._reopen():
+            lines += self._split(self.f.read(READ_SIZE))
+        return lines
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+class StreamFollower(object):
+    """
+    Gives the lines from an iterator (e.g. over stdin), which may block
+    waiting for them, by reading it in a background thread
+    """
+    def __init__(self, lines):
+        # (bounded, so that the thread can't read far ahead of us)
+        self.queue = Queue(10000)
+        self.finished = False
+        thread = Thread(target=self._read, args=(lines, ))
+        thread.daemon = True
+        thread.start()
+
+    def _read(self, lines):
+        try:
+            for line in lines:
+                self.queue.put(line)
+        finally:
+            self.queue.put(None)
+
+    def read_lines(self):
+        lines = []
+        size = 0
+        while size < READ_SIZE and not self.finished:
+            try:
+                line = self.queue.get_nowait()
+            except Empty:
+                break
+            if line is None:
+                self.finished = True
+            else:
+                lines.append(line)
+                size += len(line)
+        return lines
+
+    def close(self):
+        pass
+
+class QueryFollower(object):
+    """
+    Keeps a query's result up to date as its input grows.
+
+    Each poll() reads some of whatever new input there is, returning None,
+    or an update to the result as a (replace, rows) pair, where the rows
+    either follow on from those already given, or (if replace is true)
+    replace all of them.
+    """
+    def __init__(self, query):
+        from squeal.engine import plan_query, StreamingPlan, HashAggregatePlan
+        self.query = query
+        self.options = query.options
+        query.prepare_input()
+        self.plan = plan_query(query, follow=True)
+        if self.plan is None:
+            raise ValueError("Can't follow a query that needs all of its "
+                             "input at once: %s" % query)
+        self.aggregating = isinstance(self.plan, HashAggregatePlan)
+        self.groups = {}
+        self.db = None
+        if not self.aggregating and \
+                not isinstance(self.plan, StreamingPlan):
+            self.db = self.plan.create_db()
+        self.to_skip = self.plan.offset
+        self.to_yield = self.plan.limit
+
+        self.feeds = []
+        for source, extra_values in query.input.get_parts():
+            follower = source.get_follower()
+            if follower is None:
+                raise ValueError("Can't follow %r" % source)
+            self.feeds.append((follower, source.get_tuple_parser(),
+                               tuple(extra_values.values())))
+
+        # Was there no new input last time?
+        self.idle = False
+        # Have all of the inputs ended, or the LIMIT been reached?
+        self.finished = False
+        # Aggregates: has the result changed since it was last given, and
+        # when was that?
+        self.changed = True
+        self.last_update = None
+
+    def __repr__(self):
+        return 'QueryFollower(%r)' % self.plan
+
+    def read_rows(self):
+        rows = []
+        for follower, parse, suffix in self.feeds:
+            for line in follower.read_lines():
+                t = parse(line)
+                if t is not None:
+                    rows.append(t + suffix)
+        return rows
+
+    def poll(self):
+        """
+        Read some new input, returning an update to the result, or None
+        """
+        rows = self.read_rows()
+        self.idle = not rows
+        if not [follower for (follower, parse, suffix) in self.feeds
+                if not follower.finished]:
+            self.finished = True
+        if self.aggregating:
+            return self._poll_aggregate(rows)
+        return self._poll_rows(rows)
+
+    def _poll_aggregate(self, rows):
+        if rows:
+            self.plan.add_rows(self.groups, rows)
+            self.changed = True
+        now = time.time()
+        if not self.changed:
+            return None
+        if self.last_update is None:
+            # Give the first result once we've caught up with the input:
+            due = self.idle or self.finished
+        else:
+            due = self.finished \
+                  or now - self.last_update >= self.options.refresh
+        if not due:
+            return None
+        self.last_update = now
+        self.changed = False
+        return (True, list(self.plan.get_results(self.groups)))
+
+    def _poll_rows(self, rows):
+        results = []
+        batch_size = self.options.batch_size
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            if self.db:
+                tuples = list(self.plan.prepare(self.db, batch))
+                new_results = self.plan.query_batch(self.db, tuples)
+            else:
+                new_results = list(self.plan.get_results(batch))
+            if self.to_skip:
+                skipped = new_results[:self.to_skip]
+                new_results = new_results[self.to_skip:]
+                self.to_skip -= len(skipped)
+            if self.to_yield is not None:
+                new_results = new_results[:self.to_yield]
+                self.to_yield -= len(new_results)
+                if self.to_yield == 0:
+                    self.finished = True
+            results += new_results
+            if self.finished:
+                break
+        if results:
+            return (False, results)
+        return None
+
+    def close(self):
+        for follower, parse, suffix in self.feeds:
+            follower.close()
+
+def iter_updates(query):
+    """
+    Generate the updates to a query's result as its input grows (see
+    QueryFollower.poll), until it can't change any more
+    """
+    follower = QueryFollower(query)
+    try:
+        while True:
+            update = follower.poll()
+            if update:
+                yield update
+            if follower.finished:
+                return
+            if follower.idle:
+                time.sleep(POLL_INTERVAL)
+    finally:
+        follower.close()
+
+import unittest
+class FollowTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.testing import make_tmpdir
+        self.tmpdir = make_tmpdir(self)
+        self.path = os.path.join(self.tmpdir, 'access_log')
+        self.num_lines = 0
+
+    def write(self, num_lines, path=None, mode='a'):
+        from squeal.testing import write_httpd_log
+        write_httpd_log(path or self.path,
+                        range(self.num_lines, self.num_lines + num_lines),
+                        host=lambda n: n % 2,
+                        status=lambda n: 200 + (n % 3 == 0) * 204, mode=mode)
+        self.num_lines += num_lines
+
+    def test_file_follower(self):
+        open(self.path, 'w').close()
+        follower = FileFollower(self.path)
+        self.assertEquals(follower.read_lines(), [])
+        f = open(self.path, 'a')
+        f.write('one\ntwo\r\nthr')
+        f.close()
+        self.assertEquals(follower.read_lines(), ['one\n', 'two\n'])
+        f = open(self.path, 'a')
+        f.write('ee\n')
+        f.close()
+        self.assertEquals(follower.read_lines(), ['three\n'])
+        # Rotation, with a final line still being written to the old file:
+        f = open(self.path, 'a')
+        f.write('four\nfi')
+        f.close()
+        os.rename(self.path, self.path + '.1')
+        self.assertEquals(follower.read_lines(), ['four\n'])
+        self.assertEquals(follower.read_lines(), [])
+        f = open(self.path, 'w')
+        f.write('six\n')
+        f.close()
+        self.assertEquals(follower.read_lines(), ['fi', 'six\n'])
+        # Truncation:
+        open(self.path, 'w').close()
+        self.assertEquals(follower.read_lines(), [])
+        f = open(self.path, 'w')
+        f.write('seven\n')
+        f.close()
+        self.assertEquals(follower.read_lines(), ['seven\n'])
+        follower.close()
+
+    def test_stream_follower(self):
+        from io import StringIO
+        follower = StreamFollower(iter(StringIO('a\nb\n')))
+        lines = []
+        while not follower.finished:
+            lines += follower.read_lines()
+            time.sleep(0.01)
+        self.assertEquals(lines, ['a\n', 'b\n'])
+
+    def make_follower(self, *args):
+        from squeal.httpdlog import HttpdLog
+        from squeal.query import Options, QueryParser
+        q = QueryParser().parse_args(Options(refresh=0, batch_size=2),
+                                     [args[0], HttpdLog(self.path)]
+                                     + list(args[1:]))
+        return QueryFollower(q)
+
+    def test_rows(self):
+        for args in [('request from', ),
+                     ('request from', "where length(request) > 1 + 13")]:
+            self.num_lines = 0
+            self.write(3, mode='w')
+            follower = self.make_follower(*args)
+            self.assertEquals(follower.poll(),
+                              (False, [('GET /0 HTTP/1.1', ), ('GET /1 HTTP/1.1', ),
+                                       ('GET /2 HTTP/1.1', )]))
+            self.assertEquals(follower.poll(), None)
+            self.assert_(follower.idle)
+            self.write(1)
+            self.assertEquals(follower.poll(), (False, [('GET /3 HTTP/1.1', )]))
+            self.assertFalse(follower.finished)
+            follower.close()
+
+    def test_limit(self):
+        self.write(1)
+        follower = self.make_follower('size from', 'where status = 404 limit 2 offset 1')
+        self.assertEquals(follower.poll(), None)
+        self.write(3)
+        self.assertEquals(follower.poll(), (False, [(3, )]))
+        self.assertFalse(follower.finished)
+        self.write(3)
+        self.assertEquals(follower.poll(), (False, [(6, )]))
+        self.assert_(follower.finished)
+        follower.close()
+
+    def test_aggregate(self):
+        self.write(4)
+        follower = self.make_follower('host, count(*), total(size) from',
+                                      'group by host')
+        # (the first result waits until we've caught up with the input)
+        self.assertEquals(follower.poll(), None)
+        self.assertEquals(follower.poll(),
+                          (True, [('127.0.0.0', 2, 2.0), ('127.0.0.1', 2, 4.0)]))
+        self.assertEquals(follower.poll(), None)
+        self.write(1)
+        self.assertEquals(follower.poll(),
+                          (True, [('127.0.0.0', 3, 6.0), ('127.0.0.1', 2, 4.0)]))
+        follower.close()
+
+    def test_needs_sqlite(self):
+        self.write(1)
+        self.assertRaises(ValueError, self.make_follower, 'request from',
+                          'order by size')
+        self.assertRaises(ValueError, self.make_follower, 'count(*) from',
+                          'where length(request) > 3')
+
+if __name__=='__main__':
+    unittest.main()
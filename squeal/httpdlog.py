@@ -42,6 +42,12 @@ class HttpdLog(RegexFileDictSource):
         # \"%{Referer}i\"
         # \"%{User-Agent}i\"
 
+    def get_literal_columns(self):
+        result = RegexFileDictSource.get_literal_columns(self)
+        # (these are plain decimal digits, or "-" for a NULL size)
+        result.update(status='int', size='int')
+        return result
+
 import unittest
 class Tests(unittest.TestCase):
     def test_parser(self):
@@ -61,6 +67,46 @@ class Tests(unittest.TestCase):
         self.assertEquals(d['user'], 'jdoe@EXAMPLE.COM')
         self.assertEquals(d['status'], 404)
 
+    def test_prefilter(self):
+        # Skipping lines before parsing them mustn't change any results:
+        import os
+        from squeal.query import QueryParser, Options
+        from squeal.testing import make_tmpdir, write_httpd_log
+        path = os.path.join(make_tmpdir(self), 'access_log')
+        write_httpd_log(path, range(200),
+                        url=lambda i: '/%s%i' % (['foo', 'Foo', 'b\xe4r'][i % 3],
+                                                 i),
+                        status=lambda i: [200, 404, 304][i % 3],
+                        size=lambda i: [i, '-'][i % 2])
+        for where in ["status = 404", "status in (304, 404)",
+                      "size = 12", "size = -12", "status = '404'",
+                      "request like '%foo1%'", "request like '%B\xe4r%'",
+                      "request like '%b\xc4r%'", "host = '127.0.0.3'",
+                      "host in ('127.0.0.3', '127.0.0.5') and status = 200",
+                      "request = 'GET /foo3 HTTP/1.1'", "status = 999",
+                      "request like '%' and size = 66"]:
+            results = []
+            for pushdown in [True, False]:
+                q = QueryParser().parse_args(Options(pushdown=pushdown),
+                                             ['host, request, size from',
+                                              HttpdLog(path), 'where', where])
+                results.append(list(q.execute()))
+            self.assertEquals(results[0], results[1])
+
+    def test_line_filter(self):
+        from squeal.sql import make_filter
+        src = HttpdLog('')
+        f = make_filter(['where', "status = 404 and request like '%/fOO%'"],
+                        src.get_columns())
+        line_filter = f.get_line_filter(src.get_literal_columns(), 'utf-8')
+        self.assert_(line_filter(b'127.0.0.1 - - [16/Feb/2009:15:08:29 -0500] "GET /foo HTTP/1.1" 404 1'))
+        self.assertFalse(line_filter(b'127.0.0.1 - - [16/Feb/2009:15:08:29 -0500] "GET /foo HTTP/1.1" 200 1'))
+        self.assertFalse(line_filter(b'127.0.0.1 - - [16/Feb/2009:15:08:29 -0500] "GET /bar HTTP/1.1" 404 1'))
+        # Conditions on other columns can't be tested on the line:
+        f = make_filter(['where', "remote_logname = 'x'"],
+                        [StringColumn('remote_logname')])
+        self.assertEquals(f.get_line_filter({}), None)
+
 
 
 if __name__=='__main__':
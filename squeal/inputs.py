@@ -16,7 +16,6 @@
 # Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
 
 import os
-import re
 
 class UnknownFile(Exception):
     def __init__(self, filename):
@@ -28,53 +27,57 @@ class UnknownFile(Exception):
     def __str__(self):
         return 'UnknownFile(%s)' % repr(self.filename)
 
-def is_type_textual(magic_type):
-    if magic_type == 'ASCII text':
-        return True
-    if magic_type == 'ASCII English text':
-        return True
-    return False
+# The source class for each kind of file that squeal.detect recognises,
+# and for each name that can be given in place of a file, by dotted name, so
+# that only the module for the input actually being queried gets imported
+# (e.g. reading a log doesn't import zipfile and tarfile):
+FILE_SOURCES = {'httpd': 'squeal.httpdlog.HttpdLog',
+                'yum': 'squeal.yumlog.YumLog',
+                'syslog': 'squeal.syslog.SysLog',
+                'maillog': 'squeal.maillog.MailLog',
+                'pcap': 'squeal.tcpdump.TcpDump',
+                'zip': 'squeal.archive.ZipFileSrc',
+                'tar': 'squeal.archive.TarFileSrc',
+                'rpm': 'squeal.archive.RpmFile',
+                'augeas': 'squeal.augeasfile.AugeasFile'}
+
+NAMED_SOURCES = {'proc': 'squeal.proc.Proc',
+                 'rpm': 'squeal.rpmdb.RpmDb'}
+
+def load_class(class_name):
+    """
+    Import the class with the given dotted name, e.g. "squeal.yumlog.YumLog"
+    """
+    module_name, name = class_name.rsplit('.', 1)
+    module = __import__(module_name, fromlist=[name])
+    return getattr(module, name)
 
 def get_input_from_file(filename, options):
-    abspath = os.path.abspath(filename)
-
-    # Special-case certain absolute paths:
-    if re.match('^/var/log/httpd/(ssl_)?access_log.*$', abspath):
-        from squeal.httpdlog import HttpdLog
-        return HttpdLog(filename)
-    if re.match('^/var/log/yum.log.*$', abspath):
-        from squeal.yumlog import YumLog
-        return YumLog(filename)
-    if re.match('^/var/log/messages.*$', abspath):
-        from squeal.syslog import SysLog
-        return SysLog(filename)
-    if re.match('^/var/log/secure.*$', abspath):
-        from squeal.syslog import SysLog
-        return SysLog(filename)
-    if re.match('^/var/log/maillog.*$', abspath):
-        from squeal.maillog import MailLog
-        return MailLog(filename)
-
-    # Try to use "file" to get libmagic to detect the file type
-    from subprocess import Popen, PIPE
-    magic_type = Popen(["file", '-b', filename], stdout=PIPE).communicate()[0].strip()
-    if re.match(b'^tcpdump capture file.*', magic_type):
-        from squeal.tcpdump import TcpDump
-        return TcpDump(filename)
-
-    from squeal.archive import get_input_from_file
-    archive = get_input_from_file(filename)
-    if archive:
-        return archive
-
-    # Try to use Augeas:
-    if abspath.startswith('/etc/'):
-        from squeal.augeasfile import AugeasFile
-        return AugeasFile(filename)
-
-    if is_type_textual(magic_type):
+    from squeal.detect import detect
+    kind = detect(filename)
+
+    # Try to use Augeas for anything under /etc that isn't recognised
+    # otherwise:
+    if kind not in FILE_SOURCES \
+            and os.path.abspath(filename).startswith('/etc/'):
+        kind = 'augeas'
+
+    if kind in FILE_SOURCES:
+        return load_class(FILE_SOURCES[kind])(filename)
+
+    if kind == 'text':
         from squeal.query import StreamDictSource
-        return StreamDictSource(open(filename), options)
+        from squeal.compressed import get_compression
+        compression = get_compression(filename)
+        if compression:
+            import io
+            from squeal.compressed import open_decompressed
+            # (Python's own decompressors give proper binary streams)
+            stream = io.TextIOWrapper(open_decompressed(filename, compression,
+                                                        use_command=False))
+        else:
+            stream = open(filename)
+        return StreamDictSource(stream, options)
 
     # Unknown:
     return None
@@ -85,15 +88,21 @@ def get_input(string, options):
     if isinstance(string, DictSource):
         return string
 
-    if string == 'proc':
-        from squeal.proc import Proc        
-        return Proc()
-    if string == 'rpm':
-        from squeal.rpmdb import RpmDb
-        return RpmDb()
+    if string in NAMED_SOURCES:
+        return load_class(NAMED_SOURCES[string])()
 
     if os.path.isfile(string):
-        return get_input_from_file(string, options)
+        from squeal import stats
+        with stats.stage('detect'):
+            input = get_input_from_file(string, options)
+        from squeal.query import FileDictSource
+        if isinstance(input, FileDictSource):
+            input.use_mmap = options.mmap
+        # (there's no point caching input that's being followed)
+        if input and options.cache_dir and not options.follow:
+            from squeal.cache import wrap_input
+            input = wrap_input(input, options)
+        return input
 
     if string == '-':
         from squeal.query import StreamDictSource
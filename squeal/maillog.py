@@ -36,37 +36,108 @@ class MailLog(FileDictSource):
 
                 ]
 
+    # The columns filled in from sendmail's key=value pairs:
+    sendmail_columns = set(['from_', 'size', 'class', 'nrcpts', 'msgid', 'relay'])
+    # The columns filled in from pat's groups, in order:
+    line_columns = ['time', 'hostname', 'program', 'pid', 'message']
+    want_sendmail = True
+
+    def set_wanted_columns(self, names):
+        FileDictSource.set_wanted_columns(self, names)
+        if names is None:
+            self.want_sendmail = True
+        else:
+            self.want_sendmail = bool(self.sendmail_columns & set(names))
+        wanted = self.get_wanted_names()
+        # (the indexes of the wanted columns among pat's groups, then where
+        # the wanted sendmail columns go in the tuples after them)
+        self.wanted_groups = [i for (i, name) in enumerate(self.line_columns)
+                              if name in wanted]
+        if 'pid' in wanted:
+            self.pid_index = wanted.index('pid')
+        else:
+            self.pid_index = None
+        self.sendmail_indexes = dict([(name, i)
+                                      for (i, name) in enumerate(wanted)
+                                      if name in self.sendmail_columns])
+
+    pat = re.compile('(\S\S\S [ 0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]) (\S+) (\S+)\[([0-9]+)\]: (.+)')
+    sendmail_pat = re.compile('(.*): (.*)')
+    kv_pat = re.compile('(\S+)=(.+)')
+
+    def __init__(self, filename):
+        FileDictSource.__init__(self, filename)
+        # (lines matched by the pattern)
+        self.pattern_hits = 0
+        self.set_wanted_columns(None)
+
     def parse_as_dict(self, line):
-        p = LineParser()
-        timestamp_re = '(\S\S\S [ 0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9])'
-        m = re.match(timestamp_re + ' (\S+) (\S+)\[([0-9]+)\]: (.+)', line)
+        m = self.pat.match(line)
         if m:
+            self.pattern_hits += 1
             d = dict(time=m.group(1),
                      hostname=m.group(2),
                      program=m.group(3),
                      pid=int(m.group(4)),
                      message=m.group(5))            
-            if d['program'] == 'sendmail':
-                m = re.match('(.*): (.*)', d['message'])
-                if m:
-                    kvs = m.group(2).split(', ')
-                    for kv in kvs:
-                        m = re.match('(\S+)=(.+)', kv)
-                        if m:
-                            (key, value) = m.groups()
-                            # Append underscore to some attrs to avoid clash with sql
-                            # reserved words:
-                            if key in ['from', 'to']:
-                                key += '_'
-                            # Some types expect ints:
-                            if key in ['size', 'class', 'nrcpts', 'pri']:
-                                value = int(value)
-                            d[key] = value
+            if d['program'] == 'sendmail' and self.want_sendmail:
+                for (key, value) in self._iter_sendmail_values(d['message'],
+                                                               self.is_wanted):
+                    d[key] = value
             return d
 
         # unmatched
         return None
 
+    def iter_tuples(self):
+        return self._iter_parsed(self.parse_as_tuple)
+
+    def get_tuple_parser(self):
+        return self.parse_as_tuple
+
+    def parse_as_tuple(self, line):
+        m = self.pat.match(line)
+        if m is None:
+            # unmatched
+            return None
+        self.pattern_hits += 1
+        groups = m.groups()
+        row = [groups[i] for i in self.wanted_groups]
+        if self.pid_index is not None:
+            row[self.pid_index] = int(row[self.pid_index])
+        if self.sendmail_indexes:
+            row += [None] * len(self.sendmail_indexes)
+            if groups[2] == 'sendmail':
+                indexes = self.sendmail_indexes
+                for (key, value) in self._iter_sendmail_values(
+                        groups[4], indexes.__contains__):
+                    row[indexes[key]] = value
+        return tuple(row)
+
+    def _iter_sendmail_values(self, message, is_wanted):
+        # Generate the (key, value) pairs of a sendmail message, for the keys
+        # that is_wanted() accepts
+        m = self.sendmail_pat.match(message)
+        if m:
+            kvs = m.group(2).split(', ')
+            for kv in kvs:
+                m = self.kv_pat.match(kv)
+                if m:
+                    (key, value) = m.groups()
+                    # Append underscore to some attrs to avoid clash with sql
+                    # reserved words:
+                    if key in ['from', 'to']:
+                        key += '_'
+                    if not is_wanted(key):
+                        continue
+                    # Some types expect ints:
+                    if key in ['size', 'class', 'nrcpts', 'pri']:
+                        value = int(value)
+                    yield key, value
+
+    def get_pattern_stats(self):
+        return [(self.pat.pattern, self.pattern_hits)]
+
 import unittest
 class Tests(unittest.TestCase):
     def test_sendmail_parse_ex1(self):
@@ -140,6 +211,37 @@ class Tests(unittest.TestCase):
 
         self.assertEquals(d['message'], 'spamd: result: . -2 - BAYES_00,UNPARSEABLE_RELAY scantime=0.4,size=4740,user=david,uid=4044,required_score=5.0,rhost=localhost,raddr=127.0.0.1,rport=/home/david/.evolution/cache/tmp/spamd-socket-path-qPmVLA,mid=<200903081117.29945.jdoe@example.com>,bayes=0,autolearn=ham')
         
+    def test_sendmail_projection(self):
+        p = MailLog('')
+        p.set_wanted_columns(set(['program', 'size']))
+        d = p.parse_as_dict("Mar 15 04:05:14 brick sendmail[30148]: n2F826ZV030148: from=root, size=808, class=0, nrcpts=1, msgid=<200903150802.n2F826ZV030148@brick.example.com>, relay=root@localhost")
+        self.assertEquals(d['program'], 'sendmail')
+        self.assertEquals(d['size'], 808)
+        self.assert_('from_' not in d)
+        self.assert_('msgid' not in d)
+
+        # No need to look inside sendmail's messages at all:
+        p.set_wanted_columns(set(['program']))
+        d = p.parse_as_dict("Mar 15 04:05:14 brick sendmail[30148]: n2F826ZV030148: from=root, size=808, class=0, nrcpts=1, msgid=<200903150802.n2F826ZV030148@brick.example.com>, relay=root@localhost")
+        self.assert_('size' not in d)
+
+    def test_tuples(self):
+        p = MailLog('')
+        lines = ["Mar 15 04:05:14 brick sendmail[30148]: n2F826ZV030148: from=root, size=808, class=0, nrcpts=1, msgid=<200903150802.n2F826ZV030148@brick.example.com>, relay=root@localhost",
+                 'Mar 16 04:02:06 brick sendmail[19062]: n2G824dC019062: to=root, ctladdr=root (0/0), delay=00:00:02, xdelay=00:00:00, mailer=relay, pri=31436, relay=[127.0.0.1] [127.0.0.1], dsn=2.0.0, stat=Sent (n2G826YP019308 Message accepted for delivery)',
+                 'Mar  8 06:28:37 hmsspeedy spamd[15521]: spamd: result: . -2 - BAYES_00,UNPARSEABLE_RELAY scantime=0.4,size=4740,user=david',
+                 "not a mail log line"]
+        for wanted in [None, set(['pid', 'size']), set(['relay', 'program']),
+                       set()]:
+            p.set_wanted_columns(wanted)
+            names = p.get_wanted_names()
+            for line in lines:
+                d = p.parse_as_dict(line)
+                if d is None:
+                    self.assertEquals(p.parse_as_tuple(line), None)
+                else:
+                    self.assertEquals(p.parse_as_tuple(line),
+                                      tuple(map(d.get, names)))
 
 
 if __name__=='__main__':
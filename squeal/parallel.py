@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Parsing input files in a pool of worker processes (enabled with --jobs).
+
+Files bigger than --chunk-size are split into chunks of whole lines (see
+DictSource.get_chunks), and each file or chunk is parsed by one worker,
+which sends its rows back to the main process in batches of --batch-size
+rows through a shared queue, as it goes.
+
+The main process can take the rows chunk by chunk, in the order of the input
+(the default, giving the same row order as parsing serially), or take each
+batch as soon as it arrives: with --unordered, or when the query's result
+doesn't depend on the order of the rows (see DictSource.ordered).  So that
+rows for later chunks can't pile up in memory whilst waiting for an earlier
+one in ordered mode, workers only start on a chunk within a couple of chunks
+per worker of the one being consumed.
+
+The rows are pickled to send them back, as are the sources (and any row
+filter) to send them to the workers, on platforms where they can't simply be
+inherited by fork().
+"""
+
+import multiprocessing
+import os
+import traceback
+from collections import deque
+from itertools import islice
+from queue import Empty
+
+from squeal.query import DictSource, add_extra_values
+
+def _worker(parts, row_filter, batch_size, next_index, window, queue):
+    # The body of a worker process: repeatedly claims the next part that
+    # nobody has started on (once there's room in the window, if any), and
+    # parses it, sending (index, kind, payload) messages, with kind one of
+    # 'rows' (with a list of tuples), 'done' or 'error' (with a traceback)
+    while True:
+        if window:
+            window.acquire()
+        with next_index.get_lock():
+            index = next_index.value
+            next_index.value += 1
+        if index >= len(parts):
+            return
+        source, extra_values = parts[index]
+        try:
+            rows = add_extra_values(source.iter_tuples(), extra_values)
+            if row_filter:
+                rows = filter(row_filter, rows)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                queue.put((index, 'rows', batch))
+            queue.put((index, 'done', None))
+        except:
+            queue.put((index, 'error', traceback.format_exc()))
+            return
+
+class WorkerError(Exception):
+    def __init__(self, source, details):
+        Exception.__init__(self, 'error parsing %s:\n%s' % (source, details))
+
+def get_num_workers(options, num_parts):
+    jobs = options.jobs
+    if jobs < 1:
+        jobs = os.cpu_count() or 1
+    return min(jobs, num_parts)
+
+def split_parts(parts, options):
+    """
+    Split a list of (source, extra_values) pairs into chunks (see
+    DictSource.get_chunks), returning a list of (chunk, extra_values) pairs,
+    and a list giving the indexes of each part's chunks in it
+    """
+    chunk_size = max(1, int(options.chunk_size * 1024 * 1024))
+    chunks = []
+    chunk_indices = []
+    for source, extra_values in parts:
+        indices = []
+        for chunk in source.get_chunks(chunk_size):
+            indices.append(len(chunks))
+            chunks.append((chunk, extra_values))
+        chunk_indices.append(indices)
+    return chunks, chunk_indices
+
+def iter_tuples(input, row_filter, options):
+    """
+    Generate the row tuples of a DictSource's parts, parsed in worker
+    processes if there's more than one file or chunk to parse
+    """
+    chunks, chunk_indices = split_parts(input.get_parts(), options)
+    if len(chunks) == 1:
+        source, extra_values = chunks[0]
+        rows = add_extra_values(source.iter_tuples(), extra_values)
+        if row_filter:
+            rows = filter(row_filter, rows)
+        return rows
+    return ParallelParser(chunks, row_filter, options,
+                          input.ordered).iter_tuples()
+
+class ParallelParser(object):
+    """
+    Parses a list of (source, extra_values) pairs into row tuples in worker
+    processes, adding the extra_values to every row of the source, and
+    keeping only the rows that pass row_filter (a squeal.sql.TupleFilter, if
+    any).  Starts work straight away.
+
+    (multiprocessing.Pool isn't used, as terminating one whilst some of its
+    workers are idle can deadlock, and we need to be able to stop early)
+    """
+    def __init__(self, parts, row_filter, options, ordered=True):
+        self.parts = parts
+        self.ordered = ordered and options.ordered
+        num_workers = get_num_workers(options, len(parts))
+        # Bound the queue, so that the workers can't get too far ahead of
+        # the main process in unordered mode:
+        self.queue = multiprocessing.Queue(num_workers * 4)
+        next_index = multiprocessing.Value('i', 0)
+        # In ordered mode, a slot is freed as each part is consumed:
+        self.window = None
+        if self.ordered:
+            self.window = multiprocessing.Semaphore(num_workers * 2)
+        self.workers = [multiprocessing.Process(target=_worker,
+                                                args=(parts, row_filter,
+                                                      options.batch_size,
+                                                      next_index, self.window,
+                                                      self.queue))
+                        for i in range(num_workers)]
+        for worker in self.workers:
+            worker.daemon = True
+            worker.start()
+        # Batches received but not yet wanted, by part (None marks the end):
+        self.pending = [deque() for part in parts]
+
+    def _receive(self):
+        while True:
+            try:
+                index, kind, payload = self.queue.get(timeout=1)
+                break
+            except Empty:
+                # Check that nothing died without telling us:
+                for worker in self.workers:
+                    if worker.exitcode:
+                        self.close()
+                        raise WorkerError('a worker process',
+                                          'exit code %i' % worker.exitcode)
+        if kind == 'error':
+            self.close()
+            raise WorkerError(self.parts[index][0], payload)
+        return index, kind, payload
+
+    def iter_part(self, index):
+        """
+        Generate the rows of one of the parts, in order
+        """
+        pending = self.pending[index]
+        while True:
+            if not pending:
+                i, kind, payload = self._receive()
+                self.pending[i].append(payload)
+                continue
+            batch = pending.popleft()
+            if batch is None:
+                if self.window:
+                    self.window.release()
+                return
+            for t in batch:
+                yield t
+
+    def iter_all(self):
+        """
+        Generate the rows of all of the parts, in whatever order they arrive
+        """
+        remaining = len(self.parts)
+        while remaining:
+            i, kind, payload = self._receive()
+            if kind == 'done':
+                remaining -= 1
+            else:
+                for t in payload:
+                    yield t
+
+    def iter_tuples(self):
+        """
+        Generate the rows of all of the parts, either part by part or as
+        they arrive, according to options.ordered; closes the pool when
+        finished with
+        """
+        try:
+            if self.ordered:
+                for i in range(len(self.parts)):
+                    for t in self.iter_part(i):
+                        yield t
+            else:
+                for t in self.iter_all():
+                    yield t
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop the workers (if they haven't finished already)
+        """
+        # (a worker that has finished may still be waiting to flush rows
+        # that we no longer want into the queue, so terminate them all)
+        for worker in self.workers:
+            worker.terminate()
+        for worker in self.workers:
+            worker.join()
+
+class ParallelInput(DictSource):
+    """
+    Wraps a single input, so that it's parsed in chunks in worker processes,
+    if it's big enough
+    """
+    def __init__(self, source, options):
+        self.source = source
+        self.options = options
+        self.filename = getattr(source, 'filename', None)
+
+    def __repr__(self):
+        return 'ParallelInput(%r)' % self.source
+
+    def get_columns(self):
+        return self.source.get_columns()
+
+    @property
+    def rereadable(self):
+        return self.source.rereadable
+
+    def set_wanted_columns(self, names):
+        DictSource.set_wanted_columns(self, names)
+        self.source.set_wanted_columns(names)
+
+    def get_cache_file(self):
+        return self.source.get_cache_file()
+
+    def set_prefilter(self, row_filter):
+        self.source.set_prefilter(row_filter)
+
+    def get_pattern_stats(self):
+        return self.source.get_pattern_stats()
+
+    def cancel(self):
+        # (the workers don't see this, but the results stop being read)
+        DictSource.cancel(self)
+        self.source.cancel()
+
+    def get_parts(self):
+        return [(self.source, {})]
+
+    def is_parallel(self):
+        return True
+
+    def get_chunks(self, chunk_size):
+        return self.source.get_chunks(chunk_size)
+
+    def iter_tuples(self):
+        return iter_tuples(self, None, self.options)
+
+import unittest
+class ParallelTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.testing import make_tmpdir, write_httpd_log
+        self.tmpdir = make_tmpdir(self)
+        self.logs = []
+        for i in range(3):
+            path = os.path.join(self.tmpdir, 'access_log.%i' % i)
+            write_httpd_log(path, range(i * 5 + 2), host=lambda j: i,
+                            status=lambda j: 200 + (j % 2) * 204)
+            self.logs.append(path)
+
+    def query(self, options, *args):
+        from squeal.query import QueryParser
+        from squeal.httpdlog import HttpdLog
+        inputs = [HttpdLog(path) for path in self.logs]
+        q = QueryParser().parse_args(options, [args[0]] + inputs
+                                     + list(args[1:]))
+        return list(q.execute())
+
+    def test_same_as_serial(self):
+        from squeal.query import Options
+        for args in [('host, request, filename from', ),
+                     ('filename, count(*), total(size) from',
+                      'group by filename'),
+                     ('request, length(filename) from',
+                      'where status = 404 and length(request) > 14'),
+                     ('request from', 'where length(request) > 0 limit 4'),
+                     ('host, size from', 'where size > 3')]:
+            for engine in ['auto', 'sqlite']:
+                expected = self.query(Options(engine=engine), *args)
+                self.assert_(expected)
+                for batch_size in [1, 1000]:
+                    options = Options(engine=engine, jobs=2,
+                                      batch_size=batch_size)
+                    self.assertEquals(self.query(options, *args), expected)
+                    options.ordered = False
+                    result = self.query(options, *args)
+                    if 'limit' in args[-1]:
+                        # (any rows will do)
+                        self.assertEquals(len(result), len(expected))
+                    else:
+                        self.assertEquals(sorted(result), sorted(expected))
+
+    def test_chunks(self):
+        from squeal.httpdlog import HttpdLog
+        # Lose the final newline, as from a log that's being written:
+        f = open(self.logs[2], 'rb+')
+        f.truncate(os.path.getsize(self.logs[2]) - 1)
+        f.close()
+        src = HttpdLog(self.logs[2])
+        expected = list(src.iter_dicts())
+        for chunk_size in [1, 70, 100, 1000, 10000]:
+            chunks = src.get_chunks(chunk_size)
+            rows = []
+            for chunk in chunks:
+                rows += list(chunk.iter_dicts())
+                # A chunk is already small enough, so it isn't split again:
+                self.assertEquals(len(chunk.get_chunks(chunk_size)), 1)
+            self.assertEquals(rows, expected)
+            if chunk_size == 1:
+                # (one per line)
+                self.assertEquals(len(chunks), len(expected))
+
+    def test_chunked_queries(self):
+        from squeal.query import Options
+        self.logs = self.logs[2:]
+        for args in [('host, request from', ),
+                     ('count(*), total(size) from', ),
+                     ('status, count(*), max(request) from', 'group by status'),
+                     ('request from', 'where length(request) > 0 limit 4'),
+                     ('host, size from', 'where size > 3')]:
+            for engine in ['auto', 'sqlite']:
+                expected = self.query(Options(engine=engine), *args)
+                self.assert_(expected)
+                for chunk_size in [0.0001, 0.001]:
+                    options = Options(engine=engine, jobs=3, batch_size=2,
+                                      chunk_size=chunk_size)
+                    self.assertEquals(self.query(options, *args), expected)
+
+    def test_error(self):
+        from squeal.query import Options
+        # (something that can't be read, but only in the worker)
+        os.unlink(self.logs[1])
+        os.mkdir(self.logs[1])
+        self.assertRaises(WorkerError, self.query, Options(jobs=2),
+                          'host from')
+
+if __name__=='__main__':
+    unittest.main()
@@ -40,8 +40,11 @@ class Proc(DictSource):
         for d in os.listdir('/proc'):
             if re.match('[0-9]+', d):
                 pid = int(d)                
-                yield dict(pid=int(d),
-                           exe=self.get_link(pid, 'exe'),
-                           cmdline=self.get_content(pid, 'cmdline'))
+                result = dict(pid=pid)
+                if self.is_wanted('exe'):
+                    result['exe'] = self.get_link(pid, 'exe')
+                if self.is_wanted('cmdline'):
+                    result['cmdline'] = self.get_content(pid, 'cmdline')
+                yield result
 
 
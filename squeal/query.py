@@ -15,15 +15,201 @@
 # 
 # Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
 
+import codecs
+import locale
+import mmap
+import os
 import re
 import sys
+from itertools import islice
+from operator import itemgetter
+
+from squeal import stats
+
+class Options(object):
+    """
+    Default settings for a query.
+
+    squeal.py has optparse fill in an instance of this, so that anything not
+    given on the command line (and any code driving squeal programmatically,
+    such as the selftests) sees these values.
+    """
+    debug_level = 0
+    format = None
+    field_separator = None
+    input_regex = None
+    batch_size = 1000 # rows per executemany() call when bulk-loading
+    pushdown = True # test simple WHERE conditions before loading rows, and
+                    # only load the columns that the query uses
+    engine = 'auto' # "auto": run simple queries without sqlite where
+                    # possible; "sqlite": always use sqlite
+    cache_dir = None # where to cache parsed input files (None: don't)
+    use_cache = True
+    cache_max_size = 1024 # in MB
+    clear_cache = False
+    indexes = 'auto' # "auto": index the columns a query filters, groups or
+                     # sorts on when that should pay off (for input from
+                     # the cache, and for data queried more than once);
+                     # "always"; or "never"
+    index_min_rows = 10000 # don't bother indexing fewer rows than this
+                           # (in "auto" mode)
+    analyze = False # run ANALYZE after creating indexes
+    jobs = 1 # worker processes for parsing input files (0: one per CPU)
+    ordered = True # keep rows in the order of the input, even when parsing
+                   # it in parallel
+    chunk_size = 16 # in MB: split input files bigger than this into chunks
+                    # to parse in parallel
+    follow = False # keep reading as the input grows (see squeal.follow)
+    refresh = 2.0 # seconds between updates of aggregates when following
+    mmap = False # read input files through a memory map where possible
+                 # (beware that a file being truncated whilst mapped, as by
+                 # logrotate's copytruncate, kills the process with SIGBUS)
+    stats = False # print where the time went afterwards (see squeal.stats)
+    stats_format = 'text' # or "json"
+    profile = None # a file to save a cProfile profile of the query in
+    width_sample = 1000 # result rows to size the columns of text tables on
+                        # (0: all of them)
+
+    def __init__(self, **kwargs):
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __repr__(self):
+        return 'Options(%s)' % ', '.join(['%s=%r' % item
+                                          for item in sorted(vars(self).items())])
+
+class QueryCancelled(Exception):
+    """
+    Raised by a query that was cancelled (from another thread) part-way
+    through
+    """
+    pass
 
 class DictSource(object):
+    # Names of the only columns that the query needs, or None for all of
+    # them; sources can use this to avoid building values that would be
+    # thrown away (but are free to ignore it):
+    wanted_columns = None
+
+    # Can the rows be saved in squeal.cache, keyed on self.filename?
+    cacheable = False
+
+    # Can the source resume reading self.filename from a byte offset (see
+    # FileDictSource), so that the cache only has to parse what has been
+    # appended to it since the last run?
+    appendable = False
+
+    # Must the rows come in the order of the input?  Sources parsing in
+    # parallel are free to interleave them if not:
+    ordered = True
+
+    # Has the query reading the source been cancelled (see cancel())?
+    cancelled = False
+
+    # Can the rows be read again from the start, as a file's can, but a
+    # stream's can't?  (see Query.load_db)
+    rereadable = False
+
     def get_columns(self):
         raise NotImplementedError
 
+    # Sources generate their rows either as dicts mapping column names to
+    # values, or as tuples of the values of the wanted columns (in the order
+    # of get_wanted_names()), and must implement at least one of these;
+    # each is built on the other by default.  Tuples are cheaper to build,
+    # and are what the loader and squeal.engine use.
     def iter_dicts(self):
-        raise NotImplementedError
+        names = self.get_wanted_names()
+        for t in self.iter_tuples():
+            yield dict(zip(names, t))
+
+    def iter_tuples(self):
+        # (missing keys become None)
+        names = self.get_wanted_names()
+        for d in self.iter_dicts():
+            yield tuple(map(d.get, names))
+
+    def set_wanted_columns(self, names):
+        self.wanted_columns = names
+
+    def is_wanted(self, name):
+        return self.wanted_columns is None or name in self.wanted_columns
+
+    def get_wanted_names(self):
+        return [col.name for col in self.get_columns()
+                if self.is_wanted(col.name)]
+
+    def get_cache_file(self):
+        """
+        Get the path of a sqlite database holding all of this source's rows
+        in a "lines" table, if there is one (see squeal.cache)
+        """
+        return None
+
+    def set_ordered(self, ordered):
+        self.ordered = ordered
+
+    def set_prefilter(self, row_filter):
+        """
+        Tell the source about the squeal.sql.Filter that its rows will be
+        tested against (or None), so that it can skip input that can't give
+        rows passing it, if it's able to tell cheaply (but the rows it does
+        give will still be tested)
+        """
+        pass
+
+    def get_pattern_stats(self):
+        """
+        Get a list of (description, hits) pairs, saying how many lines each
+        of the patterns the source tries on its input has matched so far
+        (not counting any parsed in worker processes), for debugging
+        """
+        return []
+
+    def get_follower(self):
+        """
+        Get a squeal.follow follower giving the lines added to the input as
+        it grows, to be parsed by get_tuple_parser(), or None if it can't be
+        followed
+        """
+        return None
+
+    def cancel(self):
+        """
+        Ask the source (from another thread) to stop reading its input as
+        soon as it can, by raising QueryCancelled (though sources that can't
+        tell will carry on to the end)
+        """
+        self.cancelled = True
+
+    def get_progress(self):
+        """
+        Get a (bytes read so far, total bytes to read) pair saying how far
+        through its input the source has got, or None if it can't tell
+        """
+        return None
+
+    def get_parts(self):
+        """
+        Get a list of (source, extra_values) pairs, giving the sources that
+        the rows come from, and the values of any extra columns for each
+        (which must come after the source's own columns)
+        """
+        return [(self, {})]
+
+    def is_parallel(self):
+        """
+        Should the parts be parsed in worker processes?  (see squeal.parallel)
+        """
+        return False
+
+    def get_chunks(self, chunk_size):
+        """
+        Split the source into a list of sources which between them give the
+        same rows, in order, reading about chunk_size bytes each (or just
+        [self], if it can't be split)
+        """
+        return [self]
 
 class FromMemory(DictSource):
     """
@@ -32,6 +218,8 @@ class FromMemory(DictSource):
     Can represent the result of a query, also
     useful for constructing self-tests.
     """
+    rereadable = True
+
     def __init__(self, cols, rows):
         self.cols = cols
         self.rows = rows
@@ -43,25 +231,240 @@ class FromMemory(DictSource):
         for row in self.rows:
             yield row
 
+    def iter_tuples(self):
+        names = self.get_wanted_names()
+        for row in self.rows:
+            yield tuple(map(row.get, names))
+
 class FileDictSource(DictSource):
+    cacheable = True
+
+    # Byte offsets at which to start and stop reading the file (both at the
+    # start of a line):
+    start_offset = 0
+    stop_offset = None # (the end of the file)
+
+    # Read the lines straight out of a memory map of the file, rather than
+    # through a read buffer, where possible (see Options.mmap):
+    use_mmap = False
+
+    # A squeal.sql.LineFilter that lines must pass to be parsed (see
+    # set_prefilter), or None:
+    line_filter = None
+
     def __init__(self, filename):
         self.filename = filename
 
+    @property
+    def appendable(self):
+        # (a compressed file can't be resumed part-way through)
+        return self.get_compression() is None
+
+    @property
+    def rereadable(self):
+        # (not a pipe, as from "<(command)")
+        return os.path.isfile(self.filename)
+
+    def get_compression(self):
+        """
+        Get the name of the compression used by the file, or None (see
+        squeal.compressed)
+        """
+        from squeal.compressed import get_compression
+        return get_compression(self.filename)
+
+    def get_progress(self):
+        # (there's no telling how far through a compressed file the
+        # decompressed bytes read are)
+        if self.get_compression():
+            return None
+        stop_offset = self.stop_offset
+        if stop_offset is None:
+            stop_offset = os.path.getsize(self.filename)
+        done = getattr(self, 'end_offset', self.start_offset) - self.start_offset
+        total = stop_offset - self.start_offset
+        return min(done, total), total
+
     def iter_dicts(self):
-        for line in self.get_lines():
-            d = self.parse_as_dict(line)
-            if d:
-                yield d
+        return self._iter_parsed(self.parse_as_dict)
+
+    def get_literal_columns(self):
+        """
+        Get a dict mapping the names of the columns whose values always
+        appear verbatim in the lines they're parsed from to how they appear:
+        'text' for strings, 'int' for integers written in decimal
+        """
+        return {}
+
+    def set_prefilter(self, row_filter):
+        self.line_filter = None
+        if row_filter:
+            encoding = locale.getpreferredencoding(False)
+            if codecs.lookup(encoding).name == 'utf-8':
+                # (we can test the lines before decoding them)
+                self.line_filter = row_filter.get_line_filter(
+                    self.get_literal_columns(), encoding)
             else:
-                sys.stderr.write("Unmatched line :%s\n" % line)
+                self.line_filter = row_filter.get_line_filter(
+                    self.get_literal_columns())
+
+    def get_follower(self):
+        if self.get_compression():
+            # (a compressed log won't grow, so just read it once)
+            from squeal.follow import StreamFollower
+            return StreamFollower(self.get_lines())
+        from squeal.follow import FileFollower
+        return FileFollower(self.filename)
+
+    def get_tuple_parser(self):
+        """
+        Get a function parsing a line into a row tuple (see iter_tuples),
+        or giving None if it doesn't match
+        """
+        names = self.get_wanted_names()
+        parse_as_dict = self.parse_as_dict
+        def parse_as_tuple(line):
+            d = parse_as_dict(line)
+            if d is None:
+                return None
+            return tuple(map(d.get, names))
+        return parse_as_tuple
+
+    def _iter_parsed(self, parse):
+        # How many rows came from a final incomplete line (0 or 1):
+        self.partial_rows = 0
+        num_rows = num_unmatched = 0
+        try:
+            for line in self.get_lines():
+                row = parse(line)
+                # (may be empty, if none of our columns are wanted)
+                if row is not None:
+                    if self.in_partial_line:
+                        self.partial_rows = 1
+                    num_rows += 1
+                    yield row
+                else:
+                    num_unmatched += 1
+                    sys.stderr.write("Unmatched line :%s\n" % line)
+        finally:
+            stats.count_input(self.filename, lines=num_rows + num_unmatched,
+                              rows=num_rows, unmatched=num_unmatched)
 
     def get_lines(self):
-        f = open(self.filename)
-        for line in f.readlines():
-            yield line
-        f.close()
+        """
+        Yield the lines of the file from start_offset onwards, decompressing
+        it if need be.
+
+        As it goes, end_offset is kept as the position just after the last
+        complete (newline-terminated) line read; in_partial_line is set when
+        yielding a final line with no newline, which may still be being
+        written.
+
+        Lines failing line_filter are skipped.
+        """
+        encoding = locale.getpreferredencoding(False)
+        stop_offset = self.stop_offset
+        line_filter = self.line_filter
+        # (is it to be given the lines as bytes, or decoded?)
+        raw_filter = line_filter and line_filter.encoding
+        compression = self.get_compression()
+        if compression:
+            from squeal.compressed import open_decompressed
+            # (start_offset is always 0 here, as the file isn't appendable,
+            # and can't be split into chunks)
+            f = open_decompressed(self.filename, compression)
+        else:
+            f = open(self.filename, 'rb')
+            f.seek(self.start_offset)
+        num_skipped = 0
+        try:
+            self.end_offset = self.start_offset
+            self.in_partial_line = False
+            for line in self._iter_raw_lines(f, self.use_mmap
+                                             and not compression):
+                if stop_offset is not None and self.end_offset >= stop_offset:
+                    break
+                if self.cancelled:
+                    raise QueryCancelled()
+                if line.endswith(b'\n'):
+                    self.end_offset += len(line)
+                    if line.endswith(b'\r\n'):
+                        line = line[:-2] + b'\n'
+                else:
+                    self.in_partial_line = True
+                if raw_filter and not line_filter(line):
+                    num_skipped += 1
+                    continue
+                line = line.decode(encoding)
+                if line_filter and not raw_filter and not line_filter(line):
+                    num_skipped += 1
+                    continue
+                yield line
+        finally:
+            f.close()
+            stats.count_input(self.filename, lines=num_skipped,
+                              skipped=num_skipped,
+                              bytes=self.end_offset - self.start_offset)
+
+    def _iter_raw_lines(self, f, use_mmap):
+        # Yield the lines (as bytes) from the current position of the open
+        # file f onwards
+        m = None
+        if use_mmap:
+            try:
+                m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                pass # e.g. an empty file, or not a regular one
+        if m is None:
+            for line in f:
+                yield line
+            return
+        try:
+            if hasattr(m, 'madvise'):
+                # (let the kernel read ahead, and drop pages we're done with)
+                m.madvise(mmap.MADV_SEQUENTIAL)
+            m.seek(f.tell())
+            for line in iter(m.readline, b''):
+                yield line
+        finally:
+            m.close()
+
+    def get_chunks(self, chunk_size):
+        import copy
+        if self.get_compression():
+            return [self]
+        stop_offset = self.stop_offset
+        if stop_offset is None:
+            stop_offset = os.path.getsize(self.filename)
+        if stop_offset - self.start_offset <= chunk_size:
+            return [self]
+        # Find the start of the first line beginning at or after each
+        # multiple of chunk_size:
+        starts = [self.start_offset]
+        f = open(self.filename, 'rb')
+        try:
+            while True:
+                f.seek(starts[-1] + chunk_size - 1)
+                f.readline()
+                pos = f.tell()
+                if pos >= stop_offset:
+                    break
+                starts.append(pos)
+        finally:
+            f.close()
+        chunks = []
+        for start, stop in zip(starts, starts[1:] + [self.stop_offset]):
+            chunk = copy.copy(self)
+            chunk.start_offset = start
+            chunk.stop_offset = stop
+            chunks.append(chunk)
+        return chunks
 
     def __repr__(self):
+        if self.start_offset or self.stop_offset is not None:
+            return '%s(%s)[%i:%s]' % \
+                   (self.__class__, repr(self.filename), self.start_offset,
+                    self.stop_offset if self.stop_offset is not None else '')
         return '%s(%s)' % \
                (self.__class__, repr(self.filename))
 
@@ -70,6 +473,7 @@ class RegexFileDictSource(FileDictSource):
         self.filename = filename
         self.parser = self.get_parser()
         self.pat = re.compile(self.parser.regexp)
+        self.set_wanted_columns(None)
 
     def get_parser(self):
         raise NotImplementedError
@@ -77,28 +481,139 @@ class RegexFileDictSource(FileDictSource):
     def get_columns(self):
         return self.parser.columns
 
+    def get_literal_columns(self):
+        # (each string is the text of a group of the regex)
+        return dict([(col.name, 'text') for col in self.get_columns()
+                     if isinstance(col, StringColumn)])
+
+    def set_wanted_columns(self, names):
+        FileDictSource.set_wanted_columns(self, names)
+        # (group index, column) pairs for the columns to be converted:
+        self.wanted_groups = [(i, col)
+                              for (i, col) in enumerate(self.get_columns())
+                              if self.is_wanted(col.name)]
+
     def parse_as_dict(self, line):
         m = self.pat.match(line)            
         if m:
             # print m.groups()
-            vals = []
-            for (col, str) in zip(self.get_columns(), m.groups()):
-                vals.append( (col.name, col.to_python(str)) )
-            return dict(vals)
+            groups = m.groups()
+            return dict([(col.name, col.to_python(groups[i]))
+                         for (i, col) in self.wanted_groups])
+        return None
+
+    def iter_tuples(self):
+        return self._iter_parsed(self.parse_as_tuple)
+
+    def get_tuple_parser(self):
+        return self.parse_as_tuple
+
+    def parse_as_tuple(self, line):
+        m = self.pat.match(line)
+        if m:
+            groups = m.groups()
+            return tuple([col.to_python(groups[i])
+                          for (i, col) in self.wanted_groups])
         return None
 
 class MergedFileInputs(DictSource):
-    def __init__(self, inputs):
+    def __init__(self, inputs, options=None):
         self.inputs = inputs
+        self.options = options
 
     def get_columns(self):
         return self.inputs[0].get_columns() + [StringColumn('filename')]
 
-    def iter_dicts(self):
+    @property
+    def rereadable(self):
+        return not [i for i in self.inputs if not i.rereadable]
+
+    def set_wanted_columns(self, names):
+        DictSource.set_wanted_columns(self, names)
+        for i in self.inputs:
+            i.set_wanted_columns(names)
+
+    def set_ordered(self, ordered):
+        DictSource.set_ordered(self, ordered)
+        for i in self.inputs:
+            i.set_ordered(ordered)
+
+    def set_prefilter(self, row_filter):
+        for i in self.inputs:
+            i.set_prefilter(row_filter)
+
+    def cancel(self):
+        DictSource.cancel(self)
         for i in self.inputs:
-            for tuple in i.iter_dicts():
-                tuple['filename'] = i.filename
-                yield tuple
+            i.cancel()
+
+    def get_progress(self):
+        if self.is_parallel():
+            # (the inputs are read in worker processes, so can't tell)
+            return None
+        # (of the inputs that can tell)
+        progress = [p for p in [i.get_progress() for i in self.inputs] if p]
+        if not progress:
+            return None
+        return (sum([done for (done, total) in progress]),
+                sum([total for (done, total) in progress]))
+
+    def get_pattern_stats(self):
+        # (the inputs are all of the same type)
+        totals = {}
+        for i in self.inputs:
+            for description, hits in i.get_pattern_stats():
+                totals[description] = totals.get(description, 0) + hits
+        return [(description, totals[description])
+                for (description, hits) in self.inputs[0].get_pattern_stats()]
+
+    def get_parts(self):
+        """
+        Get a list of (input, extra_values) pairs, where extra_values is a
+        dict of the values of our own columns for that input's rows
+        """
+        if not self.is_wanted('filename'):
+            return [(i, {}) for i in self.inputs]
+        return [(i, dict(filename=i.filename)) for i in self.inputs]
+
+    def is_parallel(self):
+        return self.options is not None and self.options.jobs != 1
+
+    def iter_tuples(self):
+        if self.is_parallel():
+            from squeal.parallel import iter_tuples
+            return iter_tuples(self, None, self.options)
+        return self._iter_tuples()
+
+    def _iter_tuples(self):
+        for source, extra_values in self.get_parts():
+            for t in add_extra_values(source.iter_tuples(), extra_values):
+                yield t
+
+def add_extra_values(tuples, extra_values):
+    """
+    Append the values of the extra columns for one of a source's parts (see
+    DictSource.get_parts) to each of its tuples
+    """
+    if not extra_values:
+        return tuples
+    suffix = tuple(extra_values.values())
+    return (t + suffix for t in tuples)
+
+def get_projection(names, wanted_names):
+    """
+    Get a function picking the values of wanted_names out of a tuple of the
+    values of names, or None if the tuples are already just those values
+    """
+    if wanted_names == names:
+        return None
+    indices = [names.index(name) for name in wanted_names]
+    if len(indices) == 1:
+        index = indices[0]
+        return lambda t: (t[index], )
+    if not indices:
+        return lambda t: ()
+    return itemgetter(*indices)
 
 class StreamDictSource(DictSource):
     def __init__(self, stream, options):
@@ -115,22 +630,47 @@ class StreamDictSource(DictSource):
         self.num_cols = len(self._get_tuple(self.cached_line))
 
     def get_columns(self):
-        return [StringColumn('col%i' % i) for i in xrange(self.num_cols)]
+        return [StringColumn('col%i' % i) for i in range(self.num_cols)]
 
     def get_lines(self):
         if self.cached_line:
             line = self.cached_line
             self.cached_line = None
             yield line
-        for line in self.stream.readlines():
+        # (one at a time, rather than reading the whole stream in first)
+        for line in self.stream:
             yield line
 
     def iter_tuples(self):
+        parse = self.get_tuple_parser()
         for line in self.get_lines():
-            t = self._get_tuple(line)
-            if t:
-                yield t 
-                
+            t = parse(line)
+            if t is not None:
+                yield t
+
+    def get_follower(self):
+        from squeal.follow import StreamFollower
+        return StreamFollower(self.get_lines())
+
+    def get_tuple_parser(self):
+        """
+        Get a function splitting a line into a row tuple (see iter_tuples),
+        or giving None if it can't
+        """
+        num_cols = self.num_cols
+        indices = [i for i in range(num_cols)
+                   if self.is_wanted('col%i' % i)]
+        get_tuple = self._get_tuple
+        def parse_as_tuple(line):
+            fields = get_tuple(line)
+            if not fields:
+                return None
+            if len(fields) < num_cols:
+                # (missing fields become None)
+                fields = tuple(fields) + (None, ) * (num_cols - len(fields))
+            return tuple([fields[i] for i in indices])
+        return parse_as_tuple
+
     def _get_tuple(self, line):
         if self.matcher:
             m = self.matcher.match(line)
@@ -144,10 +684,6 @@ class StreamDictSource(DictSource):
             else:
                 return line.split()
 
-    def iter_dicts(self):
-        for tuple in self.iter_tuples():
-            yield dict([('col%i' % i, val) for (i, val) in enumerate(tuple)])
-
     
 class Column(object):
     def __init__(self, name):
@@ -191,6 +727,72 @@ class LineParser:
         self.regexp += regexp
         self.columns.append(column)
 
+class Alternatives(object):
+    """
+    A list of (regexp, names) pairs to be tried in turn against the start of
+    a line, after a common prefix regexp, with names giving the keys for the
+    values of each one's groups, and prefix_names those of the prefix's.
+
+    They're compiled into a single regex, so that each line is matched once,
+    rather than once per regexp, but the first regexp to match still wins,
+    so they must be given in order of priority.
+    """
+    def __init__(self, prefix, prefix_names, alternatives):
+        self.regexps = []
+        # (the alternative that each group belongs to, by group index)
+        self.owners = [None] * (len(prefix_names) + 1)
+        # (name, group index) pairs, for each alternative
+        self.keys = []
+        for i, (regexp, names) in enumerate(alternatives):
+            first = len(self.owners)
+            num_groups = re.compile(regexp).groups
+            assert num_groups >= len(names) > 0
+            self.regexps.append(regexp)
+            self.owners += [i] * num_groups
+            self.keys.append(list(zip(prefix_names, range(len(prefix_names))))
+                             + list(zip(names, range(first - 1,
+                                                     first - 1 + num_groups))))
+        self.pat = re.compile(prefix + '(?:'
+                              + '|'.join(['(?:%s)' % r for r in self.regexps])
+                              + ')')
+
+    def match(self, line):
+        """
+        Get the index of the first alternative matching the line, and a dict
+        of the values of its groups (and the prefix's), or (None, None)
+        """
+        m = self.pat.match(line)
+        if m is None:
+            return None, None
+        # (the last group to match is always one of the alternative's own)
+        i = self.owners[m.lastindex]
+        groups = m.groups()
+        return i, dict([(name, groups[index]) for (name, index) in self.keys[i]])
+
+    def get_tuple_indexes(self, names):
+        """
+        Get the group indexes of the values of the given names, for each
+        alternative, for match_tuple()
+        """
+        # (a name that an alternative lacks gets the index of the None that
+        # match_tuple() appends to the groups)
+        missing = self.pat.groups
+        return [[dict(keys).get(name, missing) for name in names]
+                for keys in self.keys]
+
+    def match_tuple(self, line, indexes):
+        """
+        Like match(), but giving a tuple of the values of the names that
+        indexes were got for by get_tuple_indexes(), in that order (None for
+        those that the matching alternative lacks), rather than a dict
+        """
+        m = self.pat.match(line)
+        if m is None:
+            return None, None
+        i = self.owners[m.lastindex]
+        groups = m.groups() + (None,)
+        return i, tuple([groups[index] for index in indexes[i]])
+
 
 class Database(object):
     def __init__(self, options, columns):
@@ -204,8 +806,14 @@ class Database(object):
                 from sqlite3 import dbapi2 as sqlite
             except ImportError:
                 raise e
-        self.conn = sqlite.connect(':memory:')
+        # (the Tui goes on to query the table from threads other than the one
+        # that loaded it, though never from more than one at a time)
+        self.conn = sqlite.connect(':memory:', check_same_thread=False)
         c = self.conn.cursor()
+        # The table is scratch space, rebuilt on every run, so there's no
+        # point paying for crash-safety whilst loading it:
+        c.execute('PRAGMA journal_mode = OFF')
+        c.execute('PRAGMA synchronous = OFF')
         # Create table
         sql = '  CREATE TABLE lines (\n    '
         sql += ',\n    '.join('%s %s' % (c.name, c.sql_type()) for c in columns)
@@ -217,33 +825,302 @@ class Database(object):
         self.conn.commit()
         c.close()
 
+        self.col_names = [col.name for col in columns]
+        self.insert_sql = 'INSERT INTO lines VALUES (%s)' \
+                          % ','.join(['?' for col in columns])
+        self.num_rows = 0
+        self.num_queries = 0
+        self.cancelled = False
+
+    def cancel(self):
+        """
+        Stop loading or querying (from another thread) as soon as possible:
+        loading raises QueryCancelled, and anything sqlite is doing raises
+        an OperationalError
+        """
+        self.cancelled = True
+        self.conn.interrupt()
+
+    def _as_tuple(self, arg_dict):
+        # Missing keys become NULL:
+        return tuple(map(arg_dict.get, self.col_names))
+
     def insert_row(self, cursor, arg_dict):
         #print arg_dict
-        values = []
-        for col in self.columns:
-            try:
-                val = arg_dict[col.name]
-            except KeyError:
-                val = None
-            values.append(val)
+        cursor.execute(self.insert_sql, self._as_tuple(arg_dict))
 
-        sql = 'INSERT INTO lines VALUES ('
-        sql += ','.join(['?' for v in values])
-        sql += ')'
-        cursor.execute(sql, values)
+    def load_dicts(self, dicts):
+        """
+        Bulk-load an iterable of dicts into the "lines" table (see
+        load_tuples).
 
-    def query(self, distinct, cols, stuff):
+        Returns the number of rows inserted.
+        """
+        return self.load_tuples(map(self._as_tuple, dicts))
+
+    def load_tuples(self, tuples):
+        """
+        Bulk-load an iterable of tuples of values for our columns into the
+        "lines" table, in batches of options.batch_size rows, as a single
+        transaction.
+
+        Returns the number of rows inserted.
+        """
+        batch_size = self.options.batch_size
+        if batch_size < 1:
+            raise ValueError('batch size must be at least 1 (got %r)'
+                             % batch_size)
+        tuples = iter(tuples)
+        num_rows = 0
         cursor = self.conn.cursor()
+        while True:
+            batch = list(islice(tuples, batch_size))
+            if not batch:
+                break
+            if self.cancelled:
+                cursor.close()
+                raise QueryCancelled()
+            with stats.stage('insert'):
+                cursor.executemany(self.insert_sql, batch)
+            num_rows += len(batch)
+        with stats.stage('insert'):
+            self.conn.commit()
+        cursor.close()
+        self.num_rows += num_rows
+        stats.count('rows inserted', num_rows)
+        if self.options.debug_level >= 5:
+            print('loaded %i rows into sqlite' % num_rows)
+        return num_rows
+
+    def clear(self):
+        """
+        Delete all of the rows, ready to load some more
+        """
+        self.conn.execute('DELETE FROM lines')
+        self.conn.commit()
+        self.num_rows = 0
+        self.num_queries = 0
+
+    def load_cache_file(self, path, extra_values={}, row_filter=None):
+        """
+        Copy the rows of a squeal.cache entry straight into the "lines" table,
+        supplying values for any of our columns it doesn't have from
+        extra_values.  If given a complete squeal.sql.Filter, only copy the
+        rows that pass it.
+
+        Returns the number of rows inserted.
+        """
+        params = []
+        exprs = []
+        for name in self.col_names:
+            if name in extra_values:
+                exprs.append('?')
+                params.append(extra_values[name])
+            else:
+                exprs.append('"%s"' % name)
+        sql = 'INSERT INTO lines SELECT %s FROM cached.lines' % ', '.join(exprs)
+        if row_filter and row_filter.complete \
+                and not [p for p in row_filter.predicates
+                         if p.column.name in extra_values]:
+            sql += ' WHERE ' + ' AND '.join([p.text
+                                             for p in row_filter.predicates])
+        if self.options.debug_level >= 5:
+            print('loading from cache: %s' % sql)
+        self.conn.execute('ATTACH DATABASE ? AS cached', (path, ))
+        try:
+            if ' WHERE ' in sql:
+                self.index_cache_file(row_filter)
+            with stats.stage('cache'):
+                cursor = self.conn.execute(sql, params)
+                num_rows = cursor.rowcount
+                self.conn.commit()
+            self.num_rows += num_rows
+        finally:
+            self.conn.execute('DETACH DATABASE cached')
+        stats.count('rows from cache', num_rows)
+        return num_rows
+
+    def index_cache_file(self, row_filter):
+        """
+        Index the attached cache entry on the column that the filter looks
+        likeliest to narrow down, so that this and later runs can pick out
+        the matching rows without reading the rest.  (The index persists in
+        the cache, and is kept up to date as rows are appended.)
+        """
+        from squeal.sql import predicate_index_columns
+        num_rows = self.conn.execute('SELECT max(rowid) FROM cached.lines').fetchone()[0]
+        if not self.want_indexes(num_rows or 0, True):
+            return
+        index_columns = predicate_index_columns(row_filter.predicates)
+        try:
+            self.create_indexes(index_columns[:1], 'cached')
+        except self.conn.OperationalError:
+            pass # e.g. the cache is read-only to us
+
+    def load(self, input, row_filter=None):
+        """
+        Load all of the rows from a DictSource (which must have been told
+        which columns we want), skipping any failing row_filter.
+        """
+        parts = input.get_parts()
+        # The rows come as tuples of the input's wanted columns, which may
+        # need rearranging into ours:
+        names = input.get_wanted_names()
+        projection = get_projection(names, self.col_names)
+        tuple_filter = None
+        if row_filter:
+            tuple_filter = row_filter.for_tuples(names)
+        cache_files = [source.get_cache_file() for (source, extra_values) in parts]
+
+        parser = None
+        if input.is_parallel():
+            # Parse whatever isn't cached in worker processes (split into
+            # chunks where possible), whilst loading any cached parts:
+            from squeal.parallel import ParallelParser, split_parts
+            uncached = [part for (part, path) in zip(parts, cache_files)
+                        if not path]
+            chunks, chunk_indices = split_parts(uncached, self.options)
+            if len(chunks) > 1:
+                parser = ParallelParser(chunks, tuple_filter, self.options,
+                                        input.ordered)
+
+        num_rows = 0
+        try:
+            num_parsed = 0
+            for (source, extra_values), path in zip(parts, cache_files):
+                if path:
+                    num_rows += self.load_cache_file(path, extra_values,
+                                                     row_filter)
+                    continue
+                if parser:
+                    if parser.ordered:
+                        for index in chunk_indices[num_parsed]:
+                            num_rows += self._load_parsed(parser.iter_part(index),
+                                                          projection)
+                    num_parsed += 1
+                    continue
+                tuples = add_extra_values(source.iter_tuples(), extra_values)
+                if tuple_filter:
+                    tuples = filter(tuple_filter, tuples)
+                num_rows += self._load_parsed(tuples, projection)
+            if parser and not parser.ordered:
+                num_rows += self._load_parsed(parser.iter_all(), projection)
+        finally:
+            if parser:
+                parser.close()
+        return num_rows
+
+    def _load_parsed(self, tuples, projection):
+        if projection:
+            tuples = map(projection, tuples)
+        return self.load_tuples(tuples)
+
+    def create_indexes(self, index_columns, schema='main'):
+        """
+        Create indexes on the "lines" table of the given attached database,
+        one for each tuple of column names, reusing any already there
+        """
+        with stats.stage('index'):
+            self._create_indexes(index_columns, schema)
+
+    def _create_indexes(self, index_columns, schema):
+        c = self.conn.cursor()
+        for names in index_columns:
+            sql = 'CREATE INDEX IF NOT EXISTS %s."lines_by_%s" ON lines (%s)' \
+                  % (schema, '_'.join(names),
+                     ', '.join(['"%s"' % name for name in names]))
+            if self.options.debug_level >= 5:
+                print('creating index: %s' % sql)
+            c.execute(sql)
+        if index_columns and self.options.analyze:
+            c.execute('ANALYZE %s' % schema)
+        self.conn.commit()
+        c.close()
+
+    def want_indexes(self, num_rows, reused):
+        """
+        Is it worth indexing a table of num_rows rows?  In "auto" mode, only
+        if it will be queried again ("reused"), since a one-off query can
+        scan or sort the table at least as quickly as it can be indexed.
+        """
+        if self.options.indexes == 'never':
+            return False
+        if self.options.indexes == 'always':
+            return True
+        return reused and num_rows >= self.options.index_min_rows
+
+    def query(self, distinct, cols, stuff):
+        if self.want_indexes(self.num_rows, self.num_queries > 0):
+            from squeal.sql import index_columns
+            # sqlite will only use one index to scan the table:
+            self.create_indexes(index_columns(stuff, self.columns)[:1])
+        self.num_queries += 1
+        return self._execute(self._get_sql(distinct, cols, stuff))
+
+    def refine(self, distinct, cols, stuff, filters=[], order_by=None,
+               descending=False):
+        """
+        Run a query as query() would, but only keeping the rows of its result
+        where each (column index, value, keep) triple in filters holds (that
+        the result column's value is, or if not keep, isn't, the given
+        value), sorted by the result column with index order_by, if not None
+        """
+        name = self._get_refine_index(distinct, cols, stuff, filters, order_by)
+        if name and self.want_indexes(self.num_rows, True):
+            self.create_indexes([(name, )])
+        self.num_queries += 1
+        # (naming the result columns, so as to refer to them whatever they
+        # are)
+        sql = 'SELECT * FROM (%s)' \
+              % self._get_sql(distinct, ['%s AS _result%i' % (col, i)
+                                         for (i, col) in enumerate(cols)],
+                              stuff)
+        params = []
+        if filters:
+            sql += ' WHERE ' + ' AND '.join(['_result%i %s ?'
+                                             % (i, ['IS NOT', 'IS'][keep])
+                                             for (i, value, keep) in filters])
+            params = [value for (i, value, keep) in filters]
+        if order_by is not None:
+            sql += ' ORDER BY _result%i%s' % (order_by,
+                                              ['', ' DESC'][descending])
+        return self._execute(sql, params)
+
+    def _get_refine_index(self, distinct, cols, stuff, filters, order_by):
+        """
+        Get the name of the column worth indexing to refine a query (see
+        refine()), or None.  That's the first column being filtered on (or
+        failing that, the one being sorted by), provided it's one of the
+        table's own, and that the query's rows are the table's rows (so that
+        sqlite can look them up in the table's indexes)
+        """
+        from squeal.sql import parse_clauses
+        from squeal.engine import has_aggregates
+        clauses = parse_clauses(stuff)
+        if distinct or clauses is None or clauses.group_by is not None \
+                or clauses.limit is not None or has_aggregates(cols):
+            return None
+        indexes = [i for (i, value, keep) in filters if keep] + [order_by]
+        if indexes[0] is None:
+            return None
+        names = dict([(name.lower(), name) for name in self.col_names])
+        return names.get(cols[indexes[0]].lower())
+
+    def _get_sql(self, distinct, cols, stuff):
         sql = 'SELECT '
         if distinct:
             sql += 'DISTINCT '
         sql += ','.join(cols) # FIXME: need a real parser/sqlgenerator here; sqlalchemy?
         sql += ' FROM lines '
         sql += ' '.join(stuff) # FIXME: ditto; sqlalchemy?
+        return sql
+
+    def _execute(self, sql, params=()):
+        cursor = self.conn.cursor()
         if self.options.debug_level >= 5:
             print('sqlite generated query: %s' % sql)
         try:
-            cursor.execute(sql)
+            cursor.execute(sql, params)
         except:
             print('Exception executing: %s' % sql)
             raise
@@ -258,6 +1135,10 @@ class Query(object):
         self.expr_names = expr_names
         self.input = input
         self.stuff = stuff
+        # The Database being loaded or queried, if any, and whether all of
+        # the rows the query needs are in it:
+        self.db = None
+        self.loaded = False
 
     def __repr__(self):
         return 'Query(%s, %s, %s)' \
@@ -265,20 +1146,126 @@ class Query(object):
 
     def create_db(self, columns):
         return Database(self.options, columns)
+
+    def get_filter(self):
+        """
+        Get a squeal.sql.Filter for those parts of the WHERE clause simple
+        enough to be tested on each row before it reaches sqlite, or None.
+
+        sqlite still evaluates the full WHERE clause afterwards.
+        """
+        if not self.options.pushdown:
+            return None
+        from squeal.sql import make_filter
+        return make_filter(self.stuff, self.input.get_columns())
+
+    def get_needed_columns(self):
+        """
+        Get the list of the input's columns that the query refers to (all of
+        them, if we can't tell)
+        """
+        columns = self.input.get_columns()
+        if not self.options.pushdown:
+            return columns
+        from squeal.sql import referenced_columns
+        needed = referenced_columns(self.expr_names, self.stuff, columns)
+        if needed is None:
+            return columns
+        if not needed:
+            # e.g. "count(*)"; we still need a table with rows in it:
+            return columns[:1]
+        return needed
     
+    def prepare_input(self):
+        """
+        Tell the input which of its columns the query needs, returning them
+        """
+        columns = self.get_needed_columns()
+        if len(columns) < len(self.input.get_columns()):
+            self.input.set_wanted_columns(set([c.name for c in columns]))
+            if self.options.debug_level >= 5:
+                print('only loading columns: %s'
+                      % ', '.join([c.name for c in columns]))
+        else:
+            self.input.set_wanted_columns(None)
+        self.input.set_prefilter(self.get_filter())
+        return columns
+
     def execute(self):
         # Generate an iterator over result
-        columns = self.input.get_columns()
-
-        db = self.create_db(columns)
+        columns = self.prepare_input()
+
+        if self.options.engine != 'sqlite':
+            from squeal.engine import plan_query
+            plan = plan_query(self)
+            if plan:
+                if self.options.debug_level >= 5:
+                    print('executing without sqlite: %r' % plan)
+                self.input.set_ordered(plan.ordered_input)
+                # (parsing as it goes, though some plans do all of their
+                # work up front)
+                with stats.stage('scan'):
+                    rows = plan.execute()
+                return stats.iter_stage('scan', rows, 'result rows')
+        db = self._load_db(columns)
+        return stats.iter_stage('query',
+                                db.query(self.distinct, self.expr_names,
+                                         self.stuff),
+                                'result rows')
+
+    def _load_db(self, columns):
+        self.input.set_ordered(True)
+        self.loaded = False
+        db = self.db = self.create_db(columns)
+        if self.input.cancelled:
+            db.cancel()
+        f = self.get_filter()
+        if f and self.options.debug_level >= 5:
+            print('filtering rows before loading with: %r' % f)
+        with stats.stage('parse'):
+            db.load(self.input, f)
+        self.loaded = True
+        return db
+
+    def load_db(self):
+        """
+        Get the Database holding the rows the query needs, loading them into
+        one if execute() hasn't (because it ran without sqlite, or was
+        cancelled part-way)
+        """
+        if not self.loaded:
+            if self.input.cancelled:
+                raise RuntimeError("can't load input that was cancelled")
+            if not self.input.rereadable:
+                raise RuntimeError("can't read the input again to load it")
+            self._load_db(self.prepare_input())
+        return self.db
+
+    def can_refine(self):
+        """
+        Can the query's result be refined (see RefinedQuery)?  Only if the
+        rows it needs have been loaded into sqlite, or the input can be read
+        again to load them
+        """
+        return self.loaded or self.input.rereadable
 
-        cursor = db.conn.cursor()
-        for d in self.input.iter_dicts():
-            db.insert_row(cursor, d)
-        db.conn.commit()
-        cursor.close()
+    def cancel(self):
+        """
+        Stop the query (from another thread) as soon as possible, making
+        execute(), or iterating over its result, raise QueryCancelled (or
+        sqlite3.OperationalError, if sqlite was interrupted)
+        """
+        self.input.cancel()
+        db = self.db
+        if db is not None:
+            db.cancel()
 
-        return db.query(self.distinct, self.expr_names, self.stuff)
+    def get_progress(self):
+        """
+        Get a (bytes read so far, total bytes to read) pair saying how far
+        through its input the query has got, or None if it can't tell
+        """
+        return self.input.get_progress()
 
     def make_table(self):
         """
@@ -291,6 +1278,65 @@ class Query(object):
             t.add_row(row)
         return t
 
+class RefinedQuery(object):
+    """
+    A query's result, filtered and/or sorted afresh, got by querying the
+    table that the query loaded into sqlite, rather than by reading its
+    input again (see Database.refine for filters, order_by and descending).
+
+    Should the query have been executed without sqlite, its input is loaded
+    the first time it's refined, and kept loaded from then on.
+    """
+    def __init__(self, query, filters=[], order_by=None, descending=False):
+        self.query = query
+        self.expr_names = query.expr_names
+        self.filters = filters
+        self.order_by = order_by
+        self.descending = descending
+
+    def __repr__(self):
+        return 'RefinedQuery(%r, %r, %r, %r)' % (self.query, self.filters,
+                                                 self.order_by, self.descending)
+
+    def describe(self):
+        """
+        Get a line describing the filters and sort order, e.g.
+           "host is '127.0.0.1', sorted by size desc"
+        """
+        parts = []
+        for i, value, keep in self.filters:
+            if value is None:
+                value = 'NULL'
+            else:
+                value = repr(value)
+            parts.append('%s %s %s' % (self.expr_names[i],
+                                       ['is not', 'is'][keep], value))
+        if self.order_by is not None:
+            parts.append('sorted by %s%s' % (self.expr_names[self.order_by],
+                                             ['', ' desc'][self.descending]))
+        return ', '.join(parts)
+
+    def execute(self):
+        q = self.query
+        db = q.load_db()
+        return stats.iter_stage('query',
+                                db.refine(q.distinct, q.expr_names, q.stuff,
+                                          self.filters, self.order_by,
+                                          self.descending),
+                                'result rows')
+
+    def cancel(self):
+        if self.query.loaded:
+            # (leaving the table loaded, for next time)
+            self.query.db.conn.interrupt()
+        else:
+            self.query.cancel()
+
+    def get_progress(self):
+        if self.query.loaded:
+            return None
+        return self.query.get_progress()
+
 class QueryParser(object):
     def _split_args(self, options, args):
         '''
@@ -300,6 +1346,10 @@ class QueryParser(object):
            "order by total(size) desc"
         where some of the arguments are split by the shell, and some by this
         parser.
+
+        Commas are kept as tokens of their own, so that clauses such as
+        "group by a, b" and "where x in (1, 2)" survive the round-trip to
+        sqlite.
         '''
         result = []
         for arg in args:
@@ -322,6 +1372,8 @@ class QueryParser(object):
                 if token != '':
                     result.append(token)
                     token = ''
+                if ch==',':
+                    result.append(ch)
             else:
                 token += ch
         if token != '':
@@ -350,8 +1402,8 @@ class QueryParser(object):
                     from_idx = i
                     break
             
-                if arg[-1] == ',':
-                    arg = arg[:-1]
+                if arg == ',':
+                    continue
                 expr_names.append(arg)
 
             if from_idx is None:
@@ -367,6 +1419,9 @@ class QueryParser(object):
             while j<len(args):
                 # look for input sources:
                 arg = args[j]
+                if arg == ',':
+                    j += 1
+                    continue
 
                 input = get_input(arg, options)
                 if input:
@@ -383,9 +1438,12 @@ class QueryParser(object):
 
         #print 'inputs:',inputs
         if len(inputs)>1:
-            input = MergedFileInputs(inputs)
+            input = MergedFileInputs(inputs, options)
         else: 
             input = inputs[0]
+            if options.jobs != 1:
+                from squeal.parallel import ParallelInput
+                input = ParallelInput(input, options)
 
         # Expand "*" in the column names, and support not supplying them:
         if expr_names == ['*'] or expr_names == []:
@@ -420,7 +1478,7 @@ dummy = FromMemory([IntColumn('size'),
 class ParserTests(unittest.TestCase):
     def parse(self, *args):
         p = QueryParser()
-        return p.parse_args({}, args)
+        return p.parse_args(Options(), args)
 
     def test_star(self):
         # Ensure that "squeal *" is handled
@@ -489,7 +1547,254 @@ class ParserTests(unittest.TestCase):
         result = list(q.execute())
         self.assertEquals(len(result), 5)
 
-        
+    def test_in_list(self):
+        q = self.parse('size from', dummy, 'where size in (1,8) order by size')
+        self.assertEquals(list(q.execute()), [(1, ), (8, )])
+
+    def test_where_not_pushed_down(self):
+        q = self.parse('size from', dummy,
+                       'where type="dog" or size=1 order by size')
+        self.assertEquals(q.get_filter(), None)
+        self.assertEquals(list(q.execute()), [(1, ), (4, ), (8, )])
+
+    def test_partial_pushdown(self):
+        q = self.parse('size from', dummy,
+                       'where type="cat" and size*2 > 3')
+        self.assertEquals(q.get_filter().complete, False)
+        self.assertEquals(list(q.execute()), [(2, ), (3, )])
+
+    def test_projection(self):
+        q = self.parse('type, count(*) from', dummy, 'group by type')
+        self.assertEquals([c.name for c in q.get_needed_columns()], ['type'])
+        self.assertEquals(list(q.execute()), [('cat', 3), ('dog', 2)])
+
+class DatabaseTests(unittest.TestCase):
+    def test_batched_load(self):
+        # Loading must give the same rows whether or not the final batch is
+        # a partial one:
+        for batch_size in [1, 2, 5, 1000]:
+            db = Database(Options(batch_size=batch_size), dummy.get_columns())
+            self.assertEquals(db.load_dicts(dummy.iter_dicts()), 5)
+            result = list(db.query(False, ['type', 'size'],
+                                   ['order', 'by', 'size']))
+            self.assertEquals(result, [('cat', 1), ('cat', 2), ('cat', 3),
+                                       ('dog', 4), ('dog', 8)])
+
+    def test_missing_keys_become_null(self):
+        db = Database(Options(), dummy.get_columns())
+        db.load_dicts([dict(size=1), dict(type='dog')])
+        result = list(db.query(False, ['size', 'type'], []))
+        self.assertEquals(result, [(1, None), (None, 'dog')])
+
+    def get_index_names(self, db):
+        return [row[0] for row in db.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index' ORDER BY name")]
+
+    def test_indexes(self):
+        stuff = ['where', 'type = "cat"', 'order', 'by', 'size']
+        # (the index for the WHERE clause is preferred to one for ORDER BY)
+        for indexes, min_rows, expected in [('never', 0, []),
+                                            ('auto', 0, ['lines_by_type']),
+                                            ('auto', 6, []),
+                                            ('always', 6, ['lines_by_type'])]:
+            db = Database(Options(indexes=indexes, index_min_rows=min_rows),
+                          dummy.get_columns())
+            db.load_dicts(dummy.iter_dicts())
+            # A one-off query is never worth indexing for in "auto" mode:
+            result = list(db.query(False, ['size'], stuff))
+            if indexes != 'always':
+                self.assertEquals(self.get_index_names(db), [])
+            self.assertEquals(list(db.query(False, ['size'], stuff)), result)
+            self.assertEquals(result, [(1, ), (2, ), (3, )])
+            self.assertEquals(self.get_index_names(db), expected)
+
+    def test_load_reordered(self):
+        # The input's tuples are rearranged to match the table:
+        db = Database(Options(), list(reversed(dummy.get_columns())))
+        dummy.set_wanted_columns(None)
+        try:
+            self.assertEquals(db.load(dummy), 5)
+        finally:
+            dummy.set_wanted_columns(None)
+        result = list(db.query(False, ['type', 'size'], ['limit', '2']))
+        self.assertEquals(result, [('cat', 1), ('cat', 2)])
+
+    def test_refine(self):
+        db = Database(Options(index_min_rows=0), dummy.get_columns())
+        db.load_dicts(dummy.iter_dicts())
+        stuff = ['where', 'size > 1']
+        for filters, order_by, descending, expected, indexes in [
+            ([], None, False, [(2, 'cat'), (3, 'cat'), (4, 'dog'), (8, 'dog')],
+             []),
+            ([], 0, True, [(8, 'dog'), (4, 'dog'), (3, 'cat'), (2, 'cat')],
+             ['lines_by_size']),
+            ([(1, 'cat', False)], None, False, [(4, 'dog'), (8, 'dog')],
+             ['lines_by_size']),
+            ([(1, 'cat', True), (0, 2, False)], 0, False, [(3, 'cat')],
+             ['lines_by_size', 'lines_by_type'])]:
+            result = list(db.refine(False, ['size', 'type'], stuff, filters,
+                                    order_by, descending))
+            self.assertEquals(result, expected)
+            self.assertEquals(self.get_index_names(db), indexes)
+        # The result of an aggregate query is refined as it is:
+        result = list(db.refine(False, ['type', 'count(*)', 'type'],
+                                ['group', 'by', 'type'], [(1, 3, True)]))
+        self.assertEquals(result, [('cat', 3, 'cat')])
+        result = list(db.refine(True, ['type'], [], [], 0, True))
+        self.assertEquals(result, [('dog', ), ('cat', )])
+        self.assertEquals(self.get_index_names(db),
+                          ['lines_by_size', 'lines_by_type'])
+
+class RefinedQueryTests(unittest.TestCase):
+    def test_refine(self):
+        for engine in ['auto', 'sqlite']:
+            dummy.set_wanted_columns(None)
+            q = QueryParser().parse_args(Options(engine=engine),
+                                         ['size, type from', dummy,
+                                          'where size < 8'])
+            self.assertEquals(len(list(q.execute())), 4)
+            self.assertEquals(q.loaded, engine == 'sqlite')
+            r = RefinedQuery(q, [(1, 'cat', True)], 0, True)
+            self.assertEquals(r.describe(), "type is 'cat', sorted by size desc")
+            self.assertEquals(list(r.execute()), [(3, 'cat'), (2, 'cat'),
+                                                  (1, 'cat')])
+            self.assert_(q.loaded)
+            db = q.db
+            r = RefinedQuery(q, [(1, None, False)])
+            self.assertEquals(r.describe(), 'type is not NULL')
+            self.assertEquals(len(list(r.execute())), 4)
+            # (without loading the input again)
+            self.assert_(q.db is db)
+        dummy.set_wanted_columns(None)
+
+    def test_stream(self):
+        # A stream can't be read again, so only a query that loaded it
+        # into sqlite can be refined:
+        from io import StringIO
+        text = ''.join(['a%i x\n' % i for i in range(10)])
+        for engine in ['auto', 'sqlite']:
+            src = StreamDictSource(StringIO(text), Options())
+            self.assert_(not src.rereadable)
+            q = QueryParser().parse_args(Options(engine=engine),
+                                         ['col0 from', src])
+            rows = q.execute()
+            self.assertEquals(list(islice(rows, 3)), [('a0',), ('a1',), ('a2',)])
+            r = RefinedQuery(q, [], 0, True)
+            if engine == 'sqlite':
+                self.assert_(q.can_refine())
+                self.assertEquals(list(r.execute()),
+                                  [('a%i' % i,) for i in range(9, -1, -1)])
+            else:
+                self.assert_(not q.can_refine())
+                self.assertRaises(RuntimeError, r.execute)
+
+    def test_rereadable(self):
+        import tempfile
+        f = tempfile.NamedTemporaryFile()
+        src = FileDictSource(f.name)
+        self.assert_(src.rereadable)
+        self.assert_(MergedFileInputs([src, FileDictSource(f.name)]).rereadable)
+        self.assert_(not FileDictSource(os.path.dirname(f.name)).rereadable)
+        stream = StreamDictSource(f, Options())
+        self.assert_(not MergedFileInputs([src, stream]).rereadable)
+        f.close()
+
+class LineTests(unittest.TestCase):
+    def setUp(self):
+        import tempfile
+        f = tempfile.NamedTemporaryFile(delete=False)
+        self.addCleanup(os.unlink, f.name)
+        f.write(b'one\ntwo\r\n\nthree')
+        f.close()
+        self.filename = f.name
+
+    def get_lines(self, src, use_mmap):
+        src.use_mmap = use_mmap
+        return list(src.get_lines()), src.end_offset, src.in_partial_line
+
+    def test_lines(self):
+        for use_mmap in [False, True]:
+            src = FileDictSource(self.filename)
+            self.assertEquals(self.get_lines(src, use_mmap),
+                              (['one\n', 'two\n', '\n', 'three'], 10, True))
+            src.start_offset = 4
+            src.stop_offset = 10
+            self.assertEquals(self.get_lines(src, use_mmap),
+                              (['two\n', '\n'], 10, False))
+            src.start_offset = 15
+            src.stop_offset = None
+            self.assertEquals(self.get_lines(src, use_mmap), ([], 15, False))
+
+    def test_empty_file(self):
+        # (which can't be mapped)
+        open(self.filename, 'w').close()
+        src = FileDictSource(self.filename)
+        self.assertEquals(self.get_lines(src, True), ([], 0, False))
+
+    def test_progress(self):
+        src = FileDictSource(self.filename)
+        self.assertEquals(src.get_progress(), (0, 15))
+        lines = src.get_lines()
+        next(lines)
+        self.assertEquals(src.get_progress(), (4, 15))
+        list(lines)
+        self.assertEquals(src.get_progress(), (10, 15))
+        src.stop_offset = 4
+        self.assertEquals(src.get_progress(), (4, 4))
+
+    def test_cancel(self):
+        src = FileDictSource(self.filename)
+        lines = src.get_lines()
+        next(lines)
+        src.cancel()
+        self.assertRaises(QueryCancelled, list, lines)
+
+class TupleTests(unittest.TestCase):
+    def assertSameAsDicts(self, src, wanted):
+        src.set_wanted_columns(wanted)
+        names = src.get_wanted_names()
+        expected = [tuple(map(d.get, names)) for d in src.iter_dicts()]
+        self.assert_(expected)
+        self.assertEquals(list(src.iter_tuples()), expected)
+        self.assertEquals(list(DictSource.iter_tuples(src)), expected)
+
+    def test_from_memory(self):
+        for wanted in [None, set(['type']), set()]:
+            self.assertSameAsDicts(dummy, wanted)
+        dummy.set_wanted_columns(None)
+
+    def test_regex_file(self):
+        import tempfile
+        from squeal.httpdlog import HttpdLog
+        f = tempfile.NamedTemporaryFile(mode='w', suffix='.log')
+        f.write('127.0.0.1 - - [16/Feb/2009:15:08:29 -0500] "GET /foo.css HTTP/1.1" 200 2261\n'
+                'garbage\n'
+                '127.0.0.2 - - [16/Feb/2009:15:08:30 -0500] "GET / HTTP/1.1" 404 -\n')
+        f.flush()
+        for wanted in [None, set(['size', 'host']), set(['filename'])]:
+            self.assertSameAsDicts(HttpdLog(f.name), wanted)
+            self.assertSameAsDicts(MergedFileInputs([HttpdLog(f.name)]),
+                                   wanted)
+        f.close()
+
+    def test_stream(self):
+        from io import StringIO
+        text = 'a b c\nd e\n\nf g h i\n'
+        # (short lines are padded with None, long ones truncated)
+        for wanted, expected in [(None, [('a', 'b', 'c'), ('d', 'e', None),
+                                         ('f', 'g', 'h')]),
+                                 (set(['col2', 'col0']), [('a', 'c'),
+                                                          ('d', None),
+                                                          ('f', 'h')])]:
+            src = StreamDictSource(StringIO(text), Options())
+            src.set_wanted_columns(wanted)
+            self.assertEquals(list(src.iter_tuples()), expected)
+            src = StreamDictSource(StringIO(text), Options())
+            src.set_wanted_columns(wanted)
+            self.assertEquals(list(src.iter_dicts()),
+                              [dict(zip(src.get_wanted_names(), t))
+                               for t in expected])
+
 
 if __name__=='__main__':
     unittest.main()
@@ -39,14 +39,11 @@ class RpmDb(DictSource):
         import rpm
         ts = rpm.TransactionSet()
         ts.setVSFlags(-1) # disable all verifications
+        tags = [(name, getattr(rpm, 'RPMTAG_%s' % name.upper()))
+                for name in self.get_wanted_names()]
         mi = ts.dbMatch()
         for h in mi: 
-            yield dict(name=self.get_field(h, rpm.RPMTAG_NAME),
-                       epoch=self.get_field(h, rpm.RPMTAG_EPOCH),
-                       version=self.get_field(h, rpm.RPMTAG_VERSION),
-                       release=self.get_field(h, rpm.RPMTAG_RELEASE),
-                       arch=self.get_field(h, rpm.RPMTAG_ARCH),
-                       vendor=self.get_field(h, rpm.RPMTAG_VENDOR),
-                       )
+            yield dict([(name, self.get_field(h, tag))
+                        for (name, tag) in tags])
 
 
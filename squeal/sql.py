@@ -0,0 +1,945 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Just enough understanding of the SQL fragments given on the command line
+(the "stuff" following the inputs) for squeal to do some of the work itself,
+before (or instead of) handing the rows to sqlite.
+
+Anything not understood here is simply left for sqlite to deal with, so
+everything in this module errs on the side of saying "don't know".
+
+The comparison functions mimic sqlite's type affinity and ordering rules, so
+that a predicate evaluated here gives the same answer that sqlite would give
+for the value as stored in the "lines" table.
+"""
+
+import re
+
+class Token(object):
+    """
+    A lexical token: kind is one of 'name', 'string' (single-quoted),
+    'quoted' (double-quoted: an identifier if it names a column, otherwise a
+    string literal), 'number', 'op', or 'other'
+    """
+    def __init__(self, kind, value):
+        self.kind = kind
+        self.value = value
+
+    def is_keyword(self, word):
+        return self.kind == 'name' and self.value.lower() == word
+
+    def as_sql(self):
+        if self.kind == 'string':
+            return "'%s'" % self.value.replace("'", "''")
+        if self.kind == 'quoted':
+            return '"%s"' % self.value.replace('"', '""')
+        return self.value
+
+    def __repr__(self):
+        return 'Token(%r, %r)' % (self.kind, self.value)
+
+_token_pat = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<number>(?:[0-9]+(?:\.[0-9]*)?|\.[0-9]+)(?:[eE][+-]?[0-9]+)?(?![A-Za-z_]))
+  | (?P<name>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<op>==|!=|<>|<=|>=|\|\||<<|>>|[=<>+\-*/%&|~(),.;])
+''', re.VERBOSE)
+
+def tokenize(text):
+    """
+    Split SQL text into a list of Tokens.  Raises ValueError on unterminated
+    quotes.
+    """
+    result = []
+    pos = 0
+    while pos < len(text):
+        ch = text[pos]
+        if ch in '\'"':
+            # Quoted; a doubled quote character is an escaped quote:
+            value = ''
+            end = pos + 1
+            while True:
+                close = text.find(ch, end)
+                if close == -1:
+                    raise ValueError('unterminated quote in %r' % text)
+                value += text[end:close]
+                if text[close+1:close+2] == ch:
+                    value += ch
+                    end = close + 2
+                else:
+                    break
+            if ch == '"':
+                result.append(Token('quoted', value))
+            else:
+                result.append(Token('string', value))
+            pos = close + 1
+            continue
+        m = _token_pat.match(text, pos)
+        if m:
+            if m.lastgroup != 'space':
+                result.append(Token(m.lastgroup, m.group()))
+            pos = m.end()
+        else:
+            result.append(Token('other', ch))
+            pos += 1
+    return result
+
+class Clauses(object):
+    """
+    The trailing clauses of a query, each as a list of Tokens (or None if
+    absent)
+    """
+    def __init__(self):
+        self.where = None
+        self.group_by = None
+        self.having = None
+        self.order_by = None
+        self.limit = None
+
+# Keywords that begin the clauses we know about, with the attribute of
+# Clauses that holds their contents:
+_clause_keywords = [(('where',), 'where'),
+                    (('group', 'by'), 'group_by'),
+                    (('having',), 'having'),
+                    (('order', 'by'), 'order_by'),
+                    (('limit',), 'limit')]
+
+# Top-level keywords that mean that the query isn't one of the shapes we
+# understand:
+_unknown_keywords = set(['union', 'intersect', 'except', 'window'])
+
+def parse_clauses(stuff):
+    """
+    Split the trailing arguments of a query into Clauses; returns None if
+    they don't look like a simple sequence of WHERE/GROUP BY/HAVING/ORDER
+    BY/LIMIT clauses.
+    """
+    try:
+        tokens = tokenize(' '.join(stuff))
+    except ValueError:
+        return None
+    clauses = Clauses()
+    current = None
+    depth = 0
+    i = 0
+    while i < len(tokens):
+        tok = tokens[i]
+        if depth == 0 and tok.kind == 'name':
+            for words, attr in _clause_keywords:
+                if all(i + k < len(tokens) and tokens[i + k].is_keyword(word)
+                       for k, word in enumerate(words)):
+                    if getattr(clauses, attr) is not None:
+                        return None # repeated clause
+                    current = []
+                    setattr(clauses, attr, current)
+                    i += len(words)
+                    break
+            else:
+                if tok.value.lower() in _unknown_keywords:
+                    return None
+                if current is None:
+                    return None
+                current.append(tok)
+                i += 1
+            continue
+        if current is None:
+            return None
+        if tok.value == '(' and tok.kind == 'op':
+            depth += 1
+        elif tok.value == ')' and tok.kind == 'op':
+            depth -= 1
+        elif tok.value == ';' and tok.kind == 'op' and depth == 0:
+            i += 1
+            continue
+        current.append(tok)
+        i += 1
+    return clauses
+
+def split_conjuncts(tokens):
+    """
+    Split the tokens of a WHERE clause on its top-level ANDs.
+
+    Returns None if the expression has a top-level OR (or other constructs
+    that would make the pieces not be true conjuncts), since AND binds more
+    tightly than OR.
+    """
+    result = [[]]
+    depth = 0
+    for tok in tokens:
+        if tok.kind == 'op' and tok.value == '(':
+            depth += 1
+        elif tok.kind == 'op' and tok.value == ')':
+            depth -= 1
+        elif depth == 0 and tok.kind == 'name':
+            word = tok.value.lower()
+            if word in ('or', 'case', 'when', 'then', 'else', 'end'):
+                return None
+            if word == 'and':
+                result.append([])
+                continue
+        result[-1].append(tok)
+    return result
+
+def split_list(tokens):
+    """
+    Split tokens on their top-level commas
+    """
+    result = [[]]
+    depth = 0
+    for tok in tokens:
+        if tok.kind == 'op':
+            if tok.value == '(':
+                depth += 1
+            elif tok.value == ')':
+                depth -= 1
+            elif tok.value == ',' and depth == 0:
+                result.append([])
+                continue
+        result[-1].append(tok)
+    return result
+
+#
+# Type affinity and comparisons, following http://www.sqlite.org/datatype3.html
+#
+_numeric_text_pat = re.compile(r'\s*[+-]?(?:[0-9]+(\.[0-9]*)?|(\.)[0-9]+)([eE][+-]?[0-9]+)?\s*$')
+
+def real_as_text(value):
+    """
+    Render a float the way sqlite does when converting a REAL to TEXT
+    """
+    text = '%.15g' % value
+    if 'n' in text: # "inf", "nan"
+        return text
+    mantissa, sep, exponent = text.partition('e')
+    if '.' not in mantissa:
+        mantissa += '.0'
+    return mantissa + sep + exponent
+
+def apply_affinity(affinity, value):
+    """
+    Convert a python value to what sqlite would store for it in a column
+    with the given affinity (the column's declared SQL type)
+    """
+    if value is None:
+        return None
+    if affinity == 'TEXT':
+        if isinstance(value, bool):
+            return str(int(value))
+        if isinstance(value, int):
+            return str(value)
+        if isinstance(value, float):
+            return real_as_text(value)
+        return value
+    if affinity in ('INTEGER', 'NUMERIC', 'REAL'):
+        if isinstance(value, str):
+            m = _numeric_text_pat.match(value)
+            if not m:
+                return value
+            if m.group(1) is None and m.group(2) is None and m.group(3) is None:
+                value = int(value)
+                if -2**63 <= value < 2**63:
+                    return value
+                value = float(value)
+            else:
+                value = float(value)
+        if isinstance(value, float) and affinity != 'REAL':
+            if value.is_integer() and -2**63 <= value < 2**63:
+                return int(value)
+        if isinstance(value, bool):
+            return int(value)
+        return value
+    return value
+
+def _storage_class(value):
+    # The ordering of storage classes: NULL < INTEGER/REAL < TEXT < BLOB
+    if isinstance(value, (int, float)):
+        return 1
+    if isinstance(value, str):
+        return 2
+    return 3
+
+def compare(a, b):
+    """
+    Compare two non-NULL stored values as sqlite would (with the BINARY
+    collation), returning -1, 0 or 1
+    """
+    ca = _storage_class(a)
+    cb = _storage_class(b)
+    if ca != cb:
+        return -1 if ca < cb else 1
+    if a == b:
+        return 0
+    return -1 if a < b else 1
+
+def sort_key(value):
+    """
+    A key function for sorting stored values into sqlite's order (NULLs
+    first)
+    """
+    if value is None:
+        return (0, 0)
+    return (_storage_class(value), value)
+
+def like_to_regex(pattern):
+    """
+    Compile a LIKE pattern (without an ESCAPE clause) into a regular
+    expression.  sqlite's LIKE is case-insensitive only for ASCII characters.
+    """
+    regex = ''
+    for ch in pattern:
+        if ch == '%':
+            regex += '.*'
+        elif ch == '_':
+            regex += '.'
+        else:
+            regex += re.escape(ch)
+    return re.compile(regex + r'\Z', re.DOTALL | re.IGNORECASE | re.ASCII)
+
+class Predicate(object):
+    """
+    A simple condition on the value of a single column, of which a WHERE
+    clause can be a conjunction; "text" is its SQL
+    """
+    def __init__(self, column, text):
+        self.column = column
+        self.text = text
+        self.affinity = column.sql_type()
+
+    def as_stored(self, value):
+        return apply_affinity(self.affinity, value)
+
+    def matches(self, value):
+        raise NotImplementedError
+
+    def get_literals(self, kind):
+        """
+        Get a list of (text, ignore_case) pairs, at least one of which must
+        appear in a raw line of input for a value taken from it to match,
+        given how the column's values appear in the lines (see
+        squeal.query.FileDictSource.get_literal_columns), or None if we
+        can't tell
+        """
+        return None
+
+    def _get_literal(self, kind, literal):
+        # The text that must appear for a value equal to a stored literal:
+        if kind == 'text' and self.affinity == 'TEXT' \
+                and isinstance(literal, str):
+            return (literal, False)
+        if kind == 'int' and self.affinity == 'INTEGER' \
+                and isinstance(literal, int):
+            return (str(abs(literal)), False)
+        return None
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.text)
+
+class Comparison(Predicate):
+    _results = {'=': (0,), '!=': (-1, 1), '<': (-1,), '<=': (-1, 0),
+                '>': (1,), '>=': (0, 1)}
+
+    def __init__(self, column, text, op, literal):
+        Predicate.__init__(self, column, text)
+        self.op = op
+        self.literal = self.as_stored(literal)
+        self.accept = self._results[op]
+
+    def matches(self, value):
+        value = self.as_stored(value)
+        if value is None or self.literal is None:
+            return False
+        return compare(value, self.literal) in self.accept
+
+    def get_literals(self, kind):
+        if self.op != '=':
+            return None
+        literal = self._get_literal(kind, self.literal)
+        if literal is None:
+            return None
+        return [literal]
+
+class In(Predicate):
+    def __init__(self, column, text, literals):
+        Predicate.__init__(self, column, text)
+        self.literals = [self.as_stored(lit) for lit in literals]
+
+    def matches(self, value):
+        value = self.as_stored(value)
+        if value is None:
+            return False
+        for lit in self.literals:
+            if lit is not None and compare(value, lit) == 0:
+                return True
+        return False
+
+    def get_literals(self, kind):
+        result = []
+        for lit in self.literals:
+            if lit is None:
+                continue # (matches nothing)
+            literal = self._get_literal(kind, lit)
+            if literal is None:
+                return None
+            result.append(literal)
+        return result
+
+class Like(Predicate):
+    def __init__(self, column, text, pattern):
+        Predicate.__init__(self, column, text)
+        self.pattern = pattern
+        self.regex = like_to_regex(pattern)
+
+    def matches(self, value):
+        value = self.as_stored(value)
+        if value is None:
+            return False
+        # LIKE works on the textual form of its operand:
+        value = apply_affinity('TEXT', value)
+        if not isinstance(value, str):
+            return False
+        return self.regex.match(value) is not None
+
+    def get_literals(self, kind):
+        if kind != 'text' or self.affinity != 'TEXT':
+            return None
+        # The longest run of characters between the wildcards (which, like
+        # LIKE itself, ignores the case of ASCII letters):
+        runs = re.split('[%_]', self.pattern)
+        longest = max(runs, key=len)
+        if not longest:
+            return None
+        return [(longest, True)]
+
+_swapped_ops = {'=': '=', '!=': '!=', '<': '>', '<=': '>=', '>': '<', '>=': '<='}
+_canonical_ops = {'=': '=', '==': '=', '!=': '!=', '<>': '!=',
+                  '<': '<', '<=': '<=', '>': '>', '>=': '>='}
+
+class _Unsupported(Exception):
+    pass
+
+def _parse_literal(tokens, columns_by_name):
+    """
+    Parse a complete list of tokens as a literal value, raising _Unsupported
+    if it isn't one
+    """
+    sign = 1
+    if len(tokens) == 2 and tokens[0].kind == 'op' \
+            and tokens[0].value in ('+', '-'):
+        if tokens[0].value == '-':
+            sign = -1
+        tokens = tokens[1:]
+        if tokens[0].kind != 'number':
+            raise _Unsupported()
+    if len(tokens) != 1:
+        raise _Unsupported()
+    tok = tokens[0]
+    if tok.kind == 'string':
+        return tok.value
+    if tok.kind == 'quoted' and tok.value.lower() not in columns_by_name:
+        # sqlite treats a double-quoted string that doesn't name a column as
+        # a string literal:
+        return tok.value
+    if tok.kind == 'number':
+        if re.match('[0-9]+$', tok.value):
+            value = sign * int(tok.value)
+            if -2**63 <= value < 2**63:
+                return value
+        return sign * float(tok.value)
+    raise _Unsupported()
+
+def _parse_column(tokens, columns_by_name):
+    if len(tokens) == 1 and tokens[0].kind in ('name', 'quoted'):
+        return columns_by_name.get(tokens[0].value.lower())
+    return None
+
+def _split_on(tokens, kind, values):
+    # Find the index of the (sole) top-level token of the given kind/values
+    depth = 0
+    found = None
+    for i, tok in enumerate(tokens):
+        if tok.kind == 'op' and tok.value == '(':
+            depth += 1
+        elif tok.kind == 'op' and tok.value == ')':
+            depth -= 1
+        elif depth == 0 and tok.kind == kind and tok.value.lower() in values:
+            if found is not None:
+                raise _Unsupported()
+            found = i
+    if found is None:
+        raise _Unsupported()
+    return found
+
+def parse_predicate(tokens, columns_by_name):
+    """
+    Try to parse a conjunct of a WHERE clause as a Predicate, returning None
+    if it isn't one of the forms we handle:
+       COLUMN (=|==|!=|<>|<|<=|>|>=) LITERAL  (or with the operands swapped)
+       COLUMN LIKE 'PATTERN'
+       COLUMN IN (LITERAL, ...)
+    """
+    text = ' '.join(tok.as_sql() for tok in tokens)
+    try:
+        if any(tok.is_keyword('like') for tok in tokens):
+            idx = _split_on(tokens, 'name', ('like',))
+            column = _parse_column(tokens[:idx], columns_by_name)
+            pattern = _parse_literal(tokens[idx+1:], columns_by_name)
+            if column is None or not isinstance(pattern, str):
+                return None
+            return Like(column, text, pattern)
+
+        if any(tok.is_keyword('in') for tok in tokens):
+            idx = _split_on(tokens, 'name', ('in',))
+            column = _parse_column(tokens[:idx], columns_by_name)
+            rest = tokens[idx+1:]
+            if column is None or len(rest) < 2 \
+                    or rest[0].value != '(' or rest[-1].value != ')':
+                return None
+            literals = []
+            current = []
+            for tok in rest[1:-1] + [Token('op', ',')]:
+                if tok.kind == 'op' and tok.value == ',':
+                    literals.append(_parse_literal(current, columns_by_name))
+                    current = []
+                elif tok.kind == 'op' and tok.value in '()':
+                    return None
+                else:
+                    current.append(tok)
+            return In(column, text, literals)
+
+        idx = _split_on(tokens, 'op', _canonical_ops)
+        op = _canonical_ops[tokens[idx].value]
+        lhs = tokens[:idx]
+        rhs = tokens[idx+1:]
+        column = _parse_column(lhs, columns_by_name)
+        if column is not None:
+            return Comparison(column, text, op,
+                              _parse_literal(rhs, columns_by_name))
+        column = _parse_column(rhs, columns_by_name)
+        if column is not None:
+            return Comparison(column, text, _swapped_ops[op],
+                              _parse_literal(lhs, columns_by_name))
+        return None
+    except _Unsupported:
+        return None
+
+class Filter(object):
+    """
+    A callable testing a row dict against the predicates that could be
+    extracted from a query's WHERE clause.
+
+    "complete" is True if the predicates are the whole of the WHERE clause
+    (so that sqlite need not reevaluate it)
+    """
+    def __init__(self, predicates, complete):
+        self.predicates = predicates
+        self.complete = complete
+        self.tests = [(p.column.name, p.matches) for p in predicates]
+
+    def __call__(self, d):
+        for name, matches in self.tests:
+            if not matches(d.get(name)):
+                return False
+        return True
+
+    def __repr__(self):
+        return 'Filter(%r, complete=%r)' % (self.predicates, self.complete)
+
+    def for_tuples(self, names):
+        """
+        Get a TupleFilter applying the same tests to tuples of the values of
+        the named columns (which must include all of those tested)
+        """
+        return TupleFilter([(names.index(name), matches)
+                            for (name, matches) in self.tests])
+
+    def get_line_filter(self, literal_columns, encoding=None):
+        """
+        Get a LineFilter rejecting raw lines of input that can't give a row
+        passing this filter, given a dict saying how the values of some
+        columns appear in the lines (see
+        squeal.query.FileDictSource.get_literal_columns), or None if there's
+        nothing to test.  With an encoding, the lines are tested as bytes,
+        before being decoded.
+        """
+        tests = []
+        for p in self.predicates:
+            kind = literal_columns.get(p.column.name)
+            if kind:
+                literals = p.get_literals(kind)
+                if literals is not None:
+                    tests.append(literals)
+        if not tests:
+            return None
+        return LineFilter(tests, encoding)
+
+class LineFilter(object):
+    """
+    A callable testing that a raw line of input contains at least one of
+    each of a list of lists of (text, ignore_case) pairs
+    """
+    def __init__(self, tests, encoding=None):
+        self.encoding = encoding
+        # (literal, regex) pairs, with the literal None if we need a regex:
+        self.tests = []
+        for literals in tests:
+            if encoding:
+                literals = [(text.encode(encoding), ignore_case)
+                            for (text, ignore_case) in literals]
+            if len(literals) == 1 and not (literals[0][1]
+                                           and _has_letters(literals[0][0])):
+                self.tests.append((literals[0][0], None))
+            else:
+                self.tests.append((None, _compile_alternatives(literals)))
+
+    def __call__(self, line):
+        for literal, regex in self.tests:
+            if literal is not None:
+                if literal not in line:
+                    return False
+            elif not regex.search(line):
+                return False
+        return True
+
+    def __repr__(self):
+        return 'LineFilter(%r)' % self.tests
+
+def _has_letters(text):
+    if isinstance(text, bytes):
+        return re.search(b'[A-Za-z]', text) is not None
+    return re.search('[A-Za-z]', text) is not None
+
+def _compile_alternatives(literals):
+    # A regex searching for any of the (text, ignore_case) pairs, ignoring
+    # the case of ASCII letters only, as LIKE does:
+    parts = []
+    for text, ignore_case in literals:
+        part = re.escape(text)
+        if ignore_case:
+            if isinstance(text, bytes):
+                part = b'(?i:' + part + b')'
+            else:
+                part = '(?ai:' + part + ')'
+        parts.append(part)
+    if literals and isinstance(literals[0][0], bytes):
+        return re.compile(b'|'.join(parts))
+    return re.compile('|'.join(parts))
+
+class TupleFilter(object):
+    """
+    A callable testing a row tuple, given (index, test) pairs
+    """
+    def __init__(self, tests):
+        self.tests = tests
+
+    def __call__(self, t):
+        for index, matches in self.tests:
+            if not matches(t[index]):
+                return False
+        return True
+
+def make_filter(stuff, columns):
+    """
+    Build a Filter for the simple conjuncts of the WHERE clause within the
+    trailing arguments of a query, given the input's columns.
+
+    Returns None if there's no WHERE clause, or it isn't something we can
+    take apart.
+    """
+    clauses = parse_clauses(stuff)
+    if clauses is None or not clauses.where:
+        return None
+    conjuncts = split_conjuncts(clauses.where)
+    if conjuncts is None:
+        return None
+    columns_by_name = dict((col.name.lower(), col) for col in columns)
+    predicates = []
+    for tokens in conjuncts:
+        p = parse_predicate(tokens, columns_by_name)
+        if p is not None:
+            predicates.append(p)
+    if not predicates:
+        return None
+    return Filter(predicates, len(predicates) == len(conjuncts))
+
+def _column_list(tokens, columns_by_name):
+    """
+    Get the column names from the tokens of a GROUP BY or ORDER BY clause, if
+    it's a simple comma-separated list of columns (each optionally followed
+    by ASC/DESC), otherwise None
+    """
+    names = []
+    for term in split_list(tokens):
+        if term and term[-1].kind == 'name' \
+                and term[-1].value.lower() in ('asc', 'desc'):
+            term = term[:-1]
+        if len(term) != 1 or term[0].kind not in ('name', 'quoted') \
+                or term[0].value.lower() not in columns_by_name:
+            return None
+        names.append(columns_by_name[term[0].value.lower()].name)
+    return names
+
+def predicate_index_columns(predicates):
+    """
+    Suggest single-column indexes that sqlite could use to find the rows
+    matching some Predicates, most selective-looking first: equality tests
+    (and membership of a list of values), then ranges
+    """
+    result = []
+    for p in predicates:
+        if isinstance(p, In) or (isinstance(p, Comparison) and p.op == '='):
+            result.append((p.column.name, ))
+    for p in predicates:
+        if isinstance(p, Comparison) and p.op in ('<', '<=', '>', '>='):
+            result.append((p.column.name, ))
+    return result
+
+def index_columns(stuff, columns):
+    """
+    Suggest indexes that sqlite could use for a query, as a list of tuples
+    of column names, in decreasing order of usefulness: first the columns
+    that the WHERE clause tests for equality (or membership of a list of
+    values), then those it tests for ranges, then the GROUP BY and ORDER BY
+    columns (which an index saves sorting).
+    """
+    clauses = parse_clauses(stuff)
+    if clauses is None:
+        return []
+    columns_by_name = dict((col.name.lower(), col) for col in columns)
+    result = []
+    def add(names):
+        if names and tuple(names) not in result:
+            result.append(tuple(names))
+    f = make_filter(stuff, columns)
+    if f:
+        for names in predicate_index_columns(f.predicates):
+            add(names)
+    for tokens in (clauses.group_by, clauses.order_by):
+        if tokens:
+            add(_column_list(tokens, columns_by_name))
+    return result
+
+def referenced_columns(expr_names, stuff, columns):
+    """
+    Work out which of the input's columns a query could refer to, returning
+    a list of them (in their original order), or None if it might need all
+    of them.
+
+    This is deliberately crude: any word anywhere in the query that names a
+    column counts as a reference to it, even inside string literals.
+    """
+    referenced = set()
+    for text in list(expr_names) + [' '.join(stuff)]:
+        try:
+            tokens = tokenize(text)
+        except ValueError:
+            return None
+        prev = None
+        for i, tok in enumerate(tokens):
+            if tok.kind == 'op' and tok.value == '*':
+                # Either "*", "lines.*" or an infix multiplication; only
+                # "count(*)" is known to be harmless:
+                following = tokens[i+1:i+2]
+                if prev is None or prev.value != '(' \
+                        or not following or following[0].value != ')':
+                    if prev is None or prev.kind == 'op':
+                        return None
+            elif tok.kind in ('name', 'quoted', 'string'):
+                referenced.add(tok.value.lower())
+                if tok.kind != 'name':
+                    # Double-quoted names such as "total(size)" and string
+                    # literals can contain column names:
+                    for word in re.findall('[A-Za-z_][A-Za-z0-9_$]*', tok.value):
+                        referenced.add(word.lower())
+            prev = tok
+    return [col for col in columns if col.name.lower() in referenced]
+
+import unittest
+class TokenizerTests(unittest.TestCase):
+    def test_tokenize(self):
+        tokens = tokenize('''type!="dog food" and name like 'it''s%' and size>=-1.5''')
+        self.assertEquals([(t.kind, t.value) for t in tokens],
+                          [('name', 'type'), ('op', '!='), ('quoted', 'dog food'),
+                           ('name', 'and'),
+                           ('name', 'name'), ('name', 'like'), ('string', "it's%"),
+                           ('name', 'and'),
+                           ('name', 'size'), ('op', '>='), ('op', '-'),
+                           ('number', '1.5')])
+
+    def test_unterminated(self):
+        self.assertRaises(ValueError, tokenize, "name = 'foo")
+
+    def test_clauses(self):
+        c = parse_clauses(['where', 'status', '=', '404', 'group', 'by', 'host',
+                           'order', 'by', 'count(*)', 'desc', 'limit', '5'])
+        self.assertEquals([t.value for t in c.where], ['status', '=', '404'])
+        self.assertEquals([t.value for t in c.group_by], ['host'])
+        self.assertEquals(c.having, None)
+        self.assertEquals([t.value for t in c.order_by],
+                          ['count', '(', '*', ')', 'desc'])
+        self.assertEquals([t.value for t in c.limit], ['5'])
+
+    def test_unknown_clauses(self):
+        self.assertEquals(parse_clauses(['size', '>', '3']), None)
+        self.assertEquals(parse_clauses(['where', 'size', '>', '3',
+                                         'union', 'select', '1']), None)
+
+class FilterTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.query import StringColumn, IntColumn
+        self.columns = [IntColumn('size'), StringColumn('type'),
+                        StringColumn('pid')]
+        self.rows = [dict(size=1, type='cat', pid=12),
+                     dict(size=2, type='Cat', pid='7'),
+                     dict(size=3, type='catfish', pid=None),
+                     dict(size=4, type='dog', pid=100),
+                     dict(size=None, type='dog food', pid='100'),
+                     dict(size='big', type=None, pid='x')]
+
+    def assertMatchesSqlite(self, where, complete=True):
+        # The rows passing the filter must be exactly those sqlite picks:
+        from squeal.query import Options, Database
+        f = make_filter(['where', where], self.columns)
+        self.assert_(f is not None)
+        self.assertEquals(f.complete, complete)
+        db = Database(Options(), self.columns)
+        db.load_dicts(self.rows)
+        expected = [r[0] for r in db.query(False, ['rowid'], ['where', where])]
+        if complete:
+            actual = [i + 1 for i, d in enumerate(self.rows) if f(d)]
+            self.assertEquals(actual, expected)
+            names = [col.name for col in reversed(self.columns)]
+            t = f.for_tuples(names)
+            actual = [i + 1 for i, d in enumerate(self.rows)
+                      if t(tuple(map(d.get, names)))]
+            self.assertEquals(actual, expected)
+        else:
+            # Must not lose any rows that sqlite would keep:
+            for rowid in expected:
+                self.assert_(f(self.rows[rowid - 1]))
+
+    def test_comparisons(self):
+        for where in ['size = 3', 'size == 3', '3 = size', 'size != 3',
+                      'size <> 3', 'size < 3', 'size > 3', '2 < size',
+                      'size <= 2', 'size >= 2', "size = '3'", 'size > -1',
+                      'type = "dog"', "type = 'dog'", "type > 'cat'",
+                      "type < 'd'", 'pid = 100', "pid = '100'", 'pid > 50',
+                      'size < 2.5', "size = 'big'", 'size > 100']:
+            self.assertMatchesSqlite(where)
+
+    def test_like(self):
+        for where in ["type like 'cat%'", "type like 'CAT%'", "type like 'cat'",
+                      "type like '%fish'", "type like 'd_g%'",
+                      "size like '1%'", "pid like '10%'"]:
+            self.assertMatchesSqlite(where)
+
+    def test_in(self):
+        for where in ['size in (1, 3)', "type in ('dog', 'cat')",
+                      "pid in (7, 100)", "size in ('2', 4)"]:
+            self.assertMatchesSqlite(where)
+
+    def test_conjunction(self):
+        self.assertMatchesSqlite("type like 'cat%' and size > 1")
+        self.assertMatchesSqlite("type like 'cat%' and length(type) > 3",
+                                 complete=False)
+
+    def test_not_pushed_down(self):
+        for where in ['size = 1 or size = 3', 'size + 1 = 3', 'size = type',
+                      'size is null', "type not like 'cat%'", 'nosuchcol = 3']:
+            self.assertEquals(make_filter(['where', where], self.columns), None)
+
+    def test_line_filter(self):
+        literal_columns = dict(size='int', type='text')
+        def line_filter(where, encoding=None):
+            f = make_filter(['where', where], self.columns)
+            return f.get_line_filter(literal_columns, encoding)
+        f = line_filter("type like 'c_t%fish' and size = -3")
+        self.assert_(f('3 CatFISH'))
+        self.assertFalse(f('3 cat'))
+        self.assertFalse(f('2 catfish'))
+        f = line_filter("type in ('cat', 'dog')", 'utf-8')
+        self.assert_(f(b'dog food'))
+        self.assertFalse(f(b'Cat'))
+        # Nothing that must appear in the line:
+        for where in ["type like '%'", "size > 3", "pid = 100",
+                      "size = 'big'", "size in (1, 'big')", "type != 'cat'"]:
+            self.assertEquals(line_filter(where), None)
+
+class IndexColumnsTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.query import StringColumn, IntColumn
+        self.columns = [StringColumn('host'), StringColumn('request'),
+                        IntColumn('status'), IntColumn('size')]
+
+    def test_where(self):
+        self.assertEquals(index_columns(['where', 'size > 100 and host = "foo"'],
+                                        self.columns),
+                          [('host', ), ('size', )])
+        self.assertEquals(index_columns(["where status in (404, 500)"],
+                                        self.columns),
+                          [('status', )])
+        self.assertEquals(index_columns(["where host like 'f%' or size = 1"],
+                                        self.columns),
+                          [])
+
+    def test_group_and_order(self):
+        self.assertEquals(index_columns(['group', 'by', 'host, status',
+                                         'order', 'by', 'host'],
+                                        self.columns),
+                          [('host', 'status'), ('host', )])
+        self.assertEquals(index_columns(['order', 'by', 'size', 'desc'],
+                                        self.columns),
+                          [('size', )])
+        self.assertEquals(index_columns(['order', 'by', '"total(size)"'],
+                                        self.columns),
+                          [])
+        self.assertEquals(index_columns(['where', 'status = 404', 'group', 'by',
+                                         'host'],
+                                        self.columns),
+                          [('status', ), ('host', )])
+
+class ReferencedColumnsTests(unittest.TestCase):
+    def setUp(self):
+        from squeal.query import StringColumn, IntColumn
+        self.columns = [StringColumn('host'), StringColumn('request'),
+                        IntColumn('status'), IntColumn('size')]
+
+    def names(self, expr_names, stuff):
+        cols = referenced_columns(expr_names, stuff, self.columns)
+        if cols is None:
+            return None
+        return [col.name for col in cols]
+
+    def test_simple(self):
+        self.assertEquals(self.names(['HOST', 'count(*)', 'total(size)'],
+                                     ['group', 'by', 'host']),
+                          ['host', 'size'])
+        self.assertEquals(self.names(['count(*)'], []), [])
+
+    def test_clauses(self):
+        self.assertEquals(self.names(['host'],
+                                     ['where', 'status=404', 'order', 'by',
+                                      '"total(size)"']),
+                          ['host', 'status', 'size'])
+
+    def test_star(self):
+        self.assertEquals(self.names(['lines.*'], []), None)
+        self.assertEquals(self.names(['*'], []), None)
+        self.assertEquals(self.names(['size*2'], []), ['size'])
+
+if __name__=='__main__':
+    unittest.main()
@@ -0,0 +1,269 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Where a query's time went (enabled with --stats).
+
+The code is instrumented with stages ("detect", "parse", "insert", ...),
+which nest: time spent in a stage entered from within another is charged
+only to the inner one, so that e.g. the time a table takes to render doesn't
+include the time spent fetching its rows.  Whilst stats are off (the
+default), stage() and friends do next to nothing, and are only used around
+whole files, batches of rows or result sets, rather than single rows.
+
+Work done in worker processes (with --jobs) is only seen as time spent
+waiting for it in the main process.
+"""
+
+import time
+from contextlib import contextmanager
+
+# The Stats being collected, or None whilst they're off:
+current = None
+
+def get_times():
+    """
+    Get the (wall, cpu) seconds that stages are timed with
+    """
+    return time.time(), time.process_time()
+
+def enable(clock=get_times):
+    """
+    Start collecting stats, returning the Stats they're collected in
+    (timed with the given clock, like get_times)
+    """
+    global current
+    current = Stats(clock)
+    return current
+
+def disable():
+    global current
+    current = None
+
+@contextmanager
+def _null_stage():
+    yield
+
+def stage(name):
+    """
+    Get a context manager charging the time spent within it to a stage
+    """
+    if current is None:
+        return _null_stage()
+    return current.stage(name)
+
+def iter_stage(name, iterable, counter=None):
+    """
+    Wrap an iterable so that the time spent getting each item is charged to
+    a stage, counting the items under counter, if given
+    """
+    if current is None:
+        return iterable
+    return current.iter_stage(name, iterable, counter)
+
+def count(name, n=1):
+    if current is not None:
+        current.count(name, n)
+
+def count_input(filename, **counts):
+    if current is not None:
+        current.count_input(filename, **counts)
+
+def get_peak_rss():
+    """
+    Get the peak resident set sizes of this process and of the largest of
+    its children so far, in MB
+    """
+    import resource
+    # (ru_maxrss is in kB on Linux)
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024.0)
+
+class Stats(object):
+    def __init__(self, clock=get_times):
+        self.clock = clock
+        # (wall, cpu) seconds by stage, in the order first entered:
+        self.stages = {}
+        self.counts = {}
+        # dicts of counts by input filename:
+        self.inputs = {}
+        # [stage, wall, cpu] for the stages entered, with the times from
+        # which the innermost is being charged:
+        self.stack = []
+        self.start, self.start_cpu = clock()
+
+    def enter(self, name):
+        now, cpu = self.clock()
+        if self.stack:
+            self._charge(self.stack[-1], now, cpu)
+        self.stack.append([name, now, cpu])
+
+    def leave(self):
+        now, cpu = self.clock()
+        self._charge(self.stack.pop(), now, cpu)
+        if self.stack:
+            # (resume charging the outer stage)
+            self.stack[-1][1:] = [now, cpu]
+
+    def _charge(self, frame, now, cpu):
+        name, since, since_cpu = frame
+        wall_total, cpu_total = self.stages.get(name, (0.0, 0.0))
+        self.stages[name] = (wall_total + now - since,
+                             cpu_total + cpu - since_cpu)
+        frame[1:] = [now, cpu]
+
+    @contextmanager
+    def stage(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.leave()
+
+    def iter_stage(self, name, iterable, counter=None):
+        it = iter(iterable)
+        n = 0
+        try:
+            while True:
+                self.enter(name)
+                try:
+                    item = next(it)
+                except StopIteration:
+                    return
+                finally:
+                    self.leave()
+                n += 1
+                yield item
+        finally:
+            if counter:
+                self.count(counter, n)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+    def count_input(self, filename, **counts):
+        totals = self.inputs.setdefault(filename, {})
+        for name, n in counts.items():
+            totals[name] = totals.get(name, 0) + n
+
+    def as_dict(self):
+        rss, children_rss = get_peak_rss()
+        now, cpu = self.clock()
+        return dict(stages=dict([(name, dict(wall=wall, cpu=cpu))
+                                 for (name, (wall, cpu)) in self.stages.items()]),
+                    wall=now - self.start,
+                    cpu=cpu - self.start_cpu,
+                    counts=self.counts,
+                    inputs=self.inputs,
+                    peak_rss_mb=rss,
+                    children_peak_rss_mb=children_rss)
+
+    def write_json(self, out):
+        import json
+        json.dump(self.as_dict(), out, indent=2, sort_keys=True)
+        out.write('\n')
+
+    def write_text(self, out):
+        d = self.as_dict()
+        out.write('%-12s %9s %9s\n' % ('stage', 'wall (s)', 'cpu (s)'))
+        for name, times in d['stages'].items():
+            out.write('%-12s %9.3f %9.3f\n' % (name, times['wall'],
+                                               times['cpu']))
+        out.write('%-12s %9.3f %9.3f\n' % ('total', d['wall'], d['cpu']))
+        for filename, counts in sorted(d['inputs'].items()):
+            out.write('%s: %s\n'
+                      % (filename,
+                         ', '.join(['%i %s' % (n, name)
+                                    for (name, n) in sorted(counts.items())])))
+        for name, n in sorted(d['counts'].items()):
+            out.write('%s: %i\n' % (name, n))
+        out.write('peak RSS: %.1f MB' % d['peak_rss_mb'])
+        if d['children_peak_rss_mb']:
+            out.write(' (largest child process: %.1f MB)'
+                      % d['children_peak_rss_mb'])
+        out.write('\n')
+
+import unittest
+class StatsTests(unittest.TestCase):
+    def tearDown(self):
+        disable()
+
+    def test_off(self):
+        rows = [1, 2]
+        self.assert_(iter_stage('query', rows) is rows)
+        with stage('parse'):
+            count('rows inserted', 2)
+        self.assertEquals(current, None)
+
+    def test_nesting(self):
+        # (a clock that only moves when told to)
+        now = [100.0, 10.0]
+        def spend(wall, cpu):
+            now[0] += wall
+            now[1] += cpu
+        s = enable(lambda: tuple(now))
+        spend(1.0, 1.0)
+        with stage('render'):
+            spend(2.0, 1.0)
+            rows = list(iter_stage('query',
+                                   (spend(1.0, 0.5) for i in range(3)),
+                                   'result rows'))
+            spend(4.0, 0.5)
+        self.assertEquals(len(rows), 3)
+        self.assertEquals(list(s.stages.keys()), ['render', 'query'])
+        # (the time spent getting the rows isn't charged to render)
+        self.assertEquals(s.stages, {'render': (6.0, 1.5),
+                                     'query': (3.0, 1.5)})
+        self.assertEquals(s.counts, {'result rows': 3})
+        d = s.as_dict()
+        self.assertEquals((d['wall'], d['cpu']), (10.0, 4.0))
+
+    def test_queries(self):
+        import json, os
+        from io import StringIO
+        from squeal.query import QueryParser, Options
+        from squeal.httpdlog import HttpdLog
+        from squeal.testing import make_tmpdir, write_httpd_log
+        path = os.path.join(make_tmpdir(self), 'access_log')
+        write_httpd_log(path, range(50), host=lambda i: i % 3,
+                        status=lambda i: 200 + (i % 2) * 204)
+        f = open(path, 'a')
+        f.write('garbage 404\n')
+        f.close()
+        for engine in ['auto', 'sqlite']:
+            s = enable()
+            q = QueryParser().parse_args(Options(engine=engine),
+                                         ['host, count(*) from', HttpdLog(path),
+                                          'where status = 404 group by host'])
+            self.assertEquals(len(list(q.execute())), 3)
+            self.assertEquals(s.inputs[path], dict(lines=51, rows=25,
+                                                   unmatched=1, skipped=25,
+                                                   bytes=os.path.getsize(path)))
+            self.assertEquals(s.counts['result rows'], 3)
+            if engine == 'sqlite':
+                self.assertEquals(s.counts['rows inserted'], 25)
+                self.assert_('insert' in s.stages)
+            out = StringIO()
+            s.write_text(out)
+            self.assert_('result rows: 3' in out.getvalue())
+            out = StringIO()
+            s.write_json(out)
+            self.assertEquals(json.loads(out.getvalue())['inputs'][path]['rows'],
+                              25)
+
+if __name__=='__main__':
+    unittest.main()
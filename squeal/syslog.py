@@ -25,27 +25,68 @@ class SysLog(FileDictSource):
                 StringColumn('pid'),
                 StringColumn('message')]
 
+    def get_literal_columns(self):
+        # (pid is stored as an integer, in spite of its type)
+        return dict(time='text', hostname='text', source='text',
+                    message='text')
+
+    patterns = Alternatives('(\S\S\S [ 0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9]) (\S+) ',
+                            ['time', 'hostname'],
+                            # With a PID:
+                            [('(\S+)\[([0-9]+)\]: (.+)',
+                              ['source', 'pid', 'message']),
+                             # Otherwise without:
+                             ('(\S+): (.+)',
+                              ['source', 'message'])])
+
+    def __init__(self, filename):
+        FileDictSource.__init__(self, filename)
+        # (lines matched by each of the patterns)
+        self.pattern_hits = [0, 0]
+        self.set_wanted_columns(None)
+
+    def set_wanted_columns(self, names):
+        FileDictSource.set_wanted_columns(self, names)
+        wanted = self.get_wanted_names()
+        self.tuple_indexes = self.patterns.get_tuple_indexes(wanted)
+        # (where pid is in the tuples, as it needs converting)
+        if 'pid' in wanted:
+            self.pid_index = wanted.index('pid')
+        else:
+            self.pid_index = None
+
     def parse_as_dict(self, line):
-        timestamp_re = '(\S\S\S [ 0-9][0-9] [0-9][0-9]:[0-9][0-9]:[0-9][0-9])'
-        # Try to match with a PID:
-        m = re.match(timestamp_re + ' (\S+) (\S+)\[([0-9]+)\]: (.+)', line)
-        if m:
-            return dict(time=m.group(1),
-                        hostname=m.group(2),
-                        source=m.group(3),
-                        pid=int(m.group(4)),
-                        message=m.group(5))
-
-        # Otherwise try without:
-        m = re.match(timestamp_re + ' (\S+) (\S+): (.+)', line)
-        if m:
-            return dict(time=m.group(1),
-                        hostname=m.group(2),
-                        source=m.group(3),
-                        pid=None,
-                        message=m.group(4))
-        # unmatched
-        return None
+        i, d = self.patterns.match(line)
+        if d is None:
+            # unmatched
+            return None
+        self.pattern_hits[i] += 1
+        if i == 0:
+            d['pid'] = int(d['pid'])
+        else:
+            d['pid'] = None
+        return d
+
+    def iter_tuples(self):
+        return self._iter_parsed(self.parse_as_tuple)
+
+    def get_tuple_parser(self):
+        return self.parse_as_tuple
+
+    def parse_as_tuple(self, line):
+        i, t = self.patterns.match_tuple(line, self.tuple_indexes)
+        if t is None:
+            # unmatched
+            return None
+        self.pattern_hits[i] += 1
+        # (the pid is already None when the line has none)
+        if i == 0 and self.pid_index is not None:
+            j = self.pid_index
+            t = t[:j] + (int(t[j]),) + t[j + 1:]
+        return t
+
+    def get_pattern_stats(self):
+        return list(zip(self.patterns.regexps, self.pattern_hits))
 
 import unittest
 class Tests(unittest.TestCase):
@@ -76,6 +117,23 @@ class Tests(unittest.TestCase):
         self.assertEquals(d['pid'], 3322)
         self.assertEquals(d['message'], 'Invalid legacy unicast query packet.')
 
+    def test_tuples(self):
+        p = SysLog('')
+        lines = ["Mar 23 19:54:16 brick kernel: virbr0: starting userspace STP failed, starting kernel STP",
+                 "Mar 23 19:54:16 brick avahi-daemon[2599]: Joining mDNS multicast group on interface virbr0.IPv4 with address 192.168.122.1.",
+                 "not a syslog line"]
+        for wanted in [None, set(['pid']), set(['message', 'pid', 'time']),
+                       set()]:
+            p.set_wanted_columns(wanted)
+            names = p.get_wanted_names()
+            for line in lines:
+                d = p.parse_as_dict(line)
+                if d is None:
+                    self.assertEquals(p.parse_as_tuple(line), None)
+                else:
+                    self.assertEquals(p.parse_as_tuple(line),
+                                      tuple(map(d.get, names)))
+
 if __name__=='__main__':
     unittest.main()
 
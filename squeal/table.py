@@ -21,6 +21,7 @@ representations e.g.
 
 """
 from unittest import main, TestCase
+from itertools import islice
 import re
 
 class TableRenderer:
@@ -30,7 +31,9 @@ class TextTableRenderer(TableRenderer):
     def __init__(self, colWidths):
         self.colWidths = colWidths
         self.leftBorder = False
-        
+        # Format strings for whole lines, by separator:
+        self.lineFormats = {}
+
     def render_table(self, table, out):
         if table.caption:
             out.write("%s\n" % table.caption)
@@ -46,13 +49,22 @@ class TextTableRenderer(TableRenderer):
             out.write(self._make_line(row, "|"))
 
     def _make_line(self, columnValues, separatorChar):
+        try:
+            lineFormat = self.lineFormats[separatorChar]
+        except KeyError:
+            lineFormat = self._make_line_format(separatorChar)
+            self.lineFormats[separatorChar] = lineFormat
+        return lineFormat % tuple(columnValues)
+
+    def _make_line_format(self, separatorChar):
+        # e.g. "%20s|%8s|\n", with any "%" in the separator escaped:
+        sep = separatorChar.replace("%", "%%")
         if self.leftBorder:
-            result = separatorChar
+            result = sep
         else:
             result = ""
-        for (columnValue, columnWidth) in zip(columnValues, self.colWidths):
-            formatString = "%%%ds%%s" % columnWidth # to generate e.g. "%20s%s"
-            result += formatString % (columnValue, separatorChar)
+        for colWidth in self.colWidths:
+            result += "%%%ds%s" % (colWidth, sep)
         return result + "\n"
 
     def _make_sep(self, lineChar, separatorChar):
@@ -90,6 +102,26 @@ class HtmlTableRenderer(TableRenderer):
             out.write("<%s>%s</%s> " % (tag, columnValue, tag))
         out.write("\n")
 
+class HtmlTableWriter:
+    """
+    Writes rows out as an HTML table as they arrive, rather than holding
+    them all in a Table first
+    """
+    def __init__(self, columnHeadings):
+        self.columnHeadings = columnHeadings
+
+    def write(self, rows, out):
+        r = HtmlTableRenderer()
+        out.write("<table border='1'>\n")
+        out.write("<tr>\n")
+        r._render_row(self.columnHeadings, 'th', out)
+        out.write("</tr>\n")
+        for row in rows:
+            out.write("<tr>\n")
+            r._render_row(row, 'td', out)
+            out.write("</tr>\n")
+        out.write("</table>\n")
+
 class RowGroup:
     def __init__(self, numColumns, rows=[]):
         self.numColumns = numColumns
@@ -137,8 +169,8 @@ class Table:
         
     def __str__(self):
         colWidths = self._calc_col_widths()
-        import cStringIO
-        output = cStringIO.StringIO()
+        from io import StringIO
+        output = StringIO()
         r = TextTableRenderer(colWidths)
         r.render_table(self, output)
         contents = output.getvalue()
@@ -174,6 +206,54 @@ class Table:
             result.append(self._calc_col_width(colIndex))
         return result
 
+class TextTableWriter:
+    """
+    Writes rows out as a text table as they arrive, rather than holding them
+    all in a Table first, so that huge results take bounded memory.
+
+    The column widths are those of the widest of the headings and the first
+    sampleSize rows (or of all of the rows, if sampleSize is 0); should a
+    wider value turn up after those, its column is widened from that row on.
+    Each value is converted to a string once (unless it's that wider one).
+    """
+    def __init__(self, columnHeadings, sampleSize=1000):
+        self.columnHeadings = columnHeadings
+        self.sampleSize = sampleSize
+
+    def write(self, rows, out):
+        rows = iter(rows)
+        if self.sampleSize:
+            sample = [tuple(map(str, row))
+                      for row in islice(rows, self.sampleSize)]
+        else:
+            sample = [tuple(map(str, row)) for row in rows]
+        colWidths = [len(str(heading)) for heading in self.columnHeadings]
+        for row in sample:
+            for i, value in enumerate(row):
+                if len(value) > colWidths[i]:
+                    colWidths[i] = len(value)
+
+        r = TextTableRenderer(colWidths)
+        out.write(r._make_line(self.columnHeadings, "|"))
+        out.write(r._make_sep("-", "+"))
+        lineFormat = r._make_line_format("|")
+        lineLength = sum(colWidths) + len(colWidths) + 1
+        for row in sample:
+            out.write(lineFormat % row)
+        del sample
+
+        for row in rows:
+            # (formatting converts each value to a string)
+            line = lineFormat % tuple(row)
+            if len(line) != lineLength:
+                # (a value wider than its column)
+                colWidths = [max(colWidth, len(str(value)))
+                             for (colWidth, value) in zip(colWidths, row)]
+                lineFormat = TextTableRenderer(colWidths)._make_line_format("|")
+                lineLength = sum(colWidths) + len(colWidths) + 1
+                line = lineFormat % tuple(row)
+            out.write(line)
+
 class TableParser:
     # FIXME: this is hardcoded for 2-column tables at the moment
     def __init__(self):
@@ -248,6 +328,42 @@ class TestTables(TestCase):
         print(str(t))
         self.assertEquals(str(t), expectedStr_4x3)
 
+    def test_writer(self):
+        from io import StringIO
+        rows = [['Foo', 3, -3, True], ['Bar', 42, 42, 'Sid'],
+                ['Baz', 17, 42, 'Nancy']]
+        for sampleSize in [0, 3, 1000]:
+            out = StringIO()
+            TextTableWriter(['What', 'How much', 'When', 'Who'],
+                            sampleSize).write(iter(rows), out)
+            self.assertEquals(out.getvalue(), expectedStr_4x3)
+        out = StringIO()
+        TextTableWriter(['What', 'How much']).write([], out)
+        self.assertEquals(out.getvalue(), expectedStr_2x0)
+
+        # Values wider than those sampled widen their column from then on:
+        out = StringIO()
+        TextTableWriter(['What', 'How much', 'When', 'Who'],
+                        1).write(iter(rows), out)
+        self.assertEquals(out.getvalue(),
+                          "What|How much|When| Who|\n"
+                          "----+--------+----+----+\n"
+                          " Foo|       3|  -3|True|\n"
+                          " Bar|      42|  42| Sid|\n"
+                          " Baz|      17|  42|Nancy|\n")
+
+    def test_html_writer(self):
+        from io import StringIO
+        t = Table(columnHeadings=['What', 'How much'])
+        t.add_row(['Foo', 3])
+        t.add_row(['Bar', None])
+        expected = StringIO()
+        t.write_as_html(expected)
+        out = StringIO()
+        HtmlTableWriter(['What', 'How much']).write([('Foo', 3), ('Bar', None)],
+                                                    out)
+        self.assertEquals(out.getvalue(), expected.getvalue())
+
     def test_parse_2x2(self):
         t = parse_table(expectedStr_2x2.split('\n'))
         print(str(t))
@@ -26,6 +26,8 @@ class TcpDump(DictSource):
     e.g.
     $ squeal "count(*)", "total(length)", src_mac, dst_mac from test.pcap group by src_mac, dst_mac
     '''
+    cacheable = True
+
     def __init__(self, filename):
         self.filename = filename
 
@@ -49,15 +51,24 @@ class TcpDump(DictSource):
             if d:
                 yield d
             else:
-                print >> sys.stderr, "Unmatched line :", line
+                sys.stderr.write("Unmatched line :%s\n" % line)
             
     def _run_tcpdump(self, filename):
         from subprocess import Popen, PIPE
-        for line in Popen(["tcpdump",
-                           '-tt', # we want raw timestamps
-                           '-e', # we want link-level info
-                           '-r', filename], stdout=PIPE).communicate()[0].splitlines():
-            yield line
+        p = Popen(["tcpdump",
+                   '-tt', # we want raw timestamps
+                   '-e', # we want link-level info
+                   '-r', filename], stdout=PIPE, universal_newlines=True)
+        try:
+            for line in p.stdout:
+                yield line.rstrip('\n')
+        finally:
+            p.stdout.close()
+            if p.poll() is None:
+                # We're being closed early (e.g. by a LIMIT); no need to let
+                # it finish:
+                p.terminate()
+            p.wait()
 
     def parse_as_dict(self, line):
         timestamp_group = r'([0-9]+\.[0-9]+)'
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright © 2009 Red Hat, Inc.
+#
+# This software is licensed to you under the GNU Lesser General Public
+# License, version 2.1 (LGPLv2.1). There is NO WARRANTY for this software,
+# express or implied, including the implied warranties of MERCHANTABILITY or
+# FITNESS FOR A PARTICULAR PURPOSE. You should have received a copy of
+# LGPLv2.1 along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/lgpl-2.1.txt
+#
+# Red Hat trademarks are not licensed under LGPLv2.1. No permission is
+# granted to use or replicate Red Hat trademarks that are incorporated in
+# this software or its documentation.
+#
+# Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
+
+"""
+Fixtures shared by the modules' unittests
+"""
+
+import os
+
+def make_tmpdir(test):
+    """
+    Make a temporary directory, removed when the unittest.TestCase test is
+    done with it
+    """
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    test.addCleanup(shutil.rmtree, tmpdir)
+    return tmpdir
+
+def write_httpd_log(path, numbers, host=lambda i: i % 7,
+                    url=lambda i: '/%i' % i, status=lambda i: 200,
+                    size=lambda i: i, mode='w'):
+    """
+    Write a line of an httpd access log to path for each of the numbers: by
+    default, line i is a request for /i from 127.0.0.(i % 7), with status
+    200 and size i, but host, url, status and size can each be given as
+    another function of i (a size may be '-')
+    """
+    f = open(path, mode)
+    for i in numbers:
+        f.write('127.0.0.%i - - [16/Feb/2009:15:08:29 -0500] "GET %s HTTP/1.1" %i %s\n'
+                % (host(i), url(i), status(i), size(i)))
+    f.close()
+
+import unittest
+class TestingTests(unittest.TestCase):
+    def test_write_httpd_log(self):
+        from squeal.httpdlog import HttpdLog
+        path = os.path.join(make_tmpdir(self), 'access_log')
+        write_httpd_log(path, range(3))
+        write_httpd_log(path, range(3, 5), host=lambda i: 1,
+                        status=lambda i: 404, size=lambda i: '-', mode='a')
+        src = HttpdLog(path)
+        src.set_wanted_columns(set(['host', 'request', 'status', 'size']))
+        self.assertEquals(list(src.iter_tuples()),
+                          [('127.0.0.0', 'GET /0 HTTP/1.1', 200, 0),
+                           ('127.0.0.1', 'GET /1 HTTP/1.1', 200, 1),
+                           ('127.0.0.2', 'GET /2 HTTP/1.1', 200, 2),
+                           ('127.0.0.1', 'GET /3 HTTP/1.1', 404, None),
+                           ('127.0.0.1', 'GET /4 HTTP/1.1', 404, None)])
+
+if __name__=='__main__':
+    unittest.main()
@@ -16,8 +16,232 @@
 # Red Hat Author(s): David Hugh Malcolm <dmalcolm@redhat.com>
 
 import curses
+import time
+from collections import OrderedDict, deque
+from itertools import islice
+from threading import Thread
 
-from squeal import table
+# Rows are fetched from the result a page at a time, as they're scrolled to:
+PAGE_SIZE = 500
+# How many pages of rows to keep in memory at once:
+MAX_PAGES = 4
+
+# How often to show the progress of a query being run, in seconds:
+PROGRESS_INTERVAL = 0.1
+# How many rows a query may get ahead of those shown:
+MAX_PENDING_ROWS = 50000
+
+class ResultPages(object):
+    """
+    The rows of a query's result, fetched from its iterator a page at a
+    time as they're needed, rather than all up front.
+
+    Only the most recently used few pages are kept in memory; the others are
+    written out to a temporary file, and read back from there should they be
+    scrolled back to, so that memory use doesn't grow with the size of the
+    result.
+    """
+    def __init__(self, rows, page_size=PAGE_SIZE, max_pages=MAX_PAGES):
+        self.iter = iter(rows)
+        self.page_size = page_size
+        self.max_pages = max_pages
+        # Has the iterator run out?
+        self.finished = False
+        self.num_rows = 0
+        # The rows since the last full page:
+        self.tail = []
+        # Full pages in memory by index, least recently used first:
+        self.pages = OrderedDict()
+        # Where in the spool file each page that's been written out starts:
+        self.offsets = {}
+        self.spool = None
+
+    def __repr__(self):
+        return 'ResultPages(%i rows%s)' % (self.num_rows,
+                                          ['...', ''][self.finished])
+
+    def append(self, rows):
+        """
+        Add more rows to the end of the result (after any still to be
+        fetched), to be fetched as they're needed
+        """
+        self.fetch_all()
+        self.iter = iter(rows)
+        self.finished = False
+
+    def fetch(self, num_rows):
+        """
+        Fetch rows until there are at least num_rows, or no more
+        """
+        while self.num_rows < num_rows and not self.finished:
+            wanted = min(num_rows - self.num_rows,
+                         self.page_size - len(self.tail))
+            got = len(self.tail)
+            self.tail.extend(islice(self.iter, wanted))
+            got = len(self.tail) - got
+            self.num_rows += got
+            if got < wanted:
+                self.finished = True
+            if len(self.tail) == self.page_size:
+                self._cache(self.num_rows // self.page_size - 1, self.tail)
+                self.tail = []
+
+    def fetch_all(self):
+        self.fetch(float('inf'))
+
+    def _cache(self, index, page):
+        import pickle
+        self.pages[index] = page
+        while len(self.pages) > self.max_pages:
+            old_index, old_page = self.pages.popitem(last=False)
+            if old_index not in self.offsets:
+                # (pages don't change once full, so need writing out once)
+                if self.spool is None:
+                    import tempfile
+                    self.spool = tempfile.TemporaryFile()
+                self.spool.seek(0, 2)
+                self.offsets[old_index] = self.spool.tell()
+                pickle.dump(old_page, self.spool, pickle.HIGHEST_PROTOCOL)
+
+    def _get_page(self, index):
+        import pickle
+        if index == self.num_rows // self.page_size:
+            return self.tail
+        try:
+            page = self.pages.pop(index)
+        except KeyError:
+            self.spool.seek(self.offsets[index])
+            page = pickle.load(self.spool)
+        self._cache(index, page)
+        return page
+
+    def get_rows(self, start, stop):
+        """
+        Get the rows from start up to (but not including) stop, fetching
+        them if need be
+        """
+        self.fetch(stop)
+        stop = min(stop, self.num_rows)
+        rows = []
+        while start < stop:
+            offset = start % self.page_size
+            page = self._get_page(start // self.page_size)
+            rows.extend(page[offset:offset + stop - start])
+            start = start - offset + self.page_size
+        return rows
+
+    def close(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+class QueryWorker(object):
+    """
+    Runs a query on a thread of its own, so that the Tui can show its rows
+    as they come, along with how far through the input it's got, whilst
+    staying responsive to keypresses.
+
+    The rows are handed over through a deque, which the Tui only takes rows
+    from (with iter_rows()) as they're scrolled to; the query waits whilst
+    there are more than MAX_PENDING_ROWS in it.
+    """
+    def __init__(self, query):
+        self.query = query
+        self.pending = deque()
+        # How many rows the query has given so far:
+        self.num_rows = 0
+        # Has the query finished (with all of its rows in pending)?
+        self.finished = False
+        self.cancelled = False
+        # Is the query waiting for its rows to be taken?
+        self.paused = False
+        self.error = None
+        self.start_time = time.time()
+        self.elapsed = None
+        self.thread = Thread(target=self._run, name='query')
+        # (so that quitting doesn't wait for it)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        from squeal.query import QueryCancelled
+        rows = None
+        try:
+            rows = iter(self.query.execute())
+            pending = self.pending
+            for row in rows:
+                if self.cancelled:
+                    break
+                pending.append(row)
+                self.num_rows += 1
+                if len(pending) > MAX_PENDING_ROWS:
+                    self.paused = True
+                    while len(pending) > MAX_PENDING_ROWS // 2 \
+                            and not self.cancelled:
+                        time.sleep(0.01)
+                    self.paused = False
+        except QueryCancelled:
+            pass
+        except Exception as e:
+            # (including sqlite being interrupted by cancel())
+            if not self.cancelled:
+                self.error = e
+        finally:
+            if hasattr(rows, 'close'):
+                # (letting any worker processes go)
+                rows.close()
+            self.elapsed = time.time() - self.start_time
+            self.finished = True
+
+    def iter_rows(self):
+        """
+        Generate the rows that have come since last time, until there are no
+        more waiting
+        """
+        pending = self.pending
+        while pending:
+            yield pending.popleft()
+
+    def take_rows(self):
+        """
+        Get a list of the rows that have come since last time
+        """
+        return list(self.iter_rows())
+
+    def cancel(self):
+        self.stop()
+        self.query.cancel()
+
+    def stop(self):
+        """
+        Stop taking rows from the query, without cancelling it (so that its
+        input can still be read again)
+        """
+        self.cancelled = True
+
+    def get_status(self):
+        """
+        Get a line describing how the query is getting on
+        """
+        if self.error is not None:
+            return 'Error: %s' % self.error
+        if self.cancelled:
+            return 'Cancelled'
+        if self.finished:
+            return 'Finished in %.1fs' % self.elapsed
+        if self.paused:
+            status = 'Paused until more rows are scrolled to'
+        else:
+            status = 'Running for %.0fs' % (time.time() - self.start_time)
+        progress = self.query.get_progress()
+        if progress:
+            done, total = progress
+            fraction = float(done) / max(total, 1)
+            bar_width = 20
+            bar = '#' * int(fraction * bar_width)
+            status += ' [%s%s] %3i%%' % (bar, '-' * (bar_width - len(bar)),
+                                        fraction * 100)
+        return status + ' (c: cancel)'
 
 class Tui(object):
     def __init__(self, query, options):
@@ -25,10 +249,19 @@ class Tui(object):
         self.options = options        
 
         self.cols = []
-        self.rows = []
-        self.table = None
+        # The rows of the result, as they're fetched:
+        self.pages = None
         self.col_widths = []
         self.column_x = []
+        self.heading = None
+        self.scrollview = None
+        self.status = None
+        # The QueryWorker running the query, if it's not being followed:
+        self.worker = None
+        # How the result has been refined (see squeal.query.RefinedQuery):
+        self.filters = []
+        self.order_by = None
+        self.descending = False
 
         self.col = 0
         self.row = 0
@@ -51,88 +284,262 @@ class Tui(object):
             self.heading.addstr(1, x, '-'*self.col_widths[col_idx], curses.A_DIM)
             self.heading.addstr(1, x + self.col_widths[col_idx], '+', curses.A_DIM)
 
-    def _repaint_row(self, row_idx, row):
-        for col_idx, col_name in enumerate(row):
-            self._repaint_cell(row_idx, col_idx)
-            self.scrollview.addstr(row_idx, self.column_x[col_idx] + self.col_widths[col_idx], '|', curses.A_DIM)
-    
-    def get_value(self, row_idx, col_idx):
-        #return '(%s,%s)' % (row_idx, col_idx)
-        col_name = self.query.expr_names[col_idx]
-        row = self.rows[row_idx]
-        return str(row[col_idx])
-
-    def _repaint_cell(self, row_idx, col_idx):
+    def _repaint_row(self, y, row_idx, values):
+        for col_idx, value in enumerate(values):
+            self._repaint_cell(y, row_idx, col_idx, value)
+            self.scrollview.addstr(y, self.column_x[col_idx] + self.col_widths[col_idx], '|', curses.A_DIM)
+
+    def _repaint_cell(self, y, row_idx, col_idx, value):
         x = self.column_x[col_idx]
         if col_idx==self.col and row_idx==self.row:
             attr = curses.A_STANDOUT
         else:
             attr = curses.A_NORMAL
-        val = self.get_value(row_idx, col_idx)
-        self.scrollview.addstr(row_idx, x, val, attr)
-        
+        self.scrollview.addstr(y, x, value, attr)
 
     def refresh(self):
+        self.heading.noutrefresh(0, self.scroll_x,  
+                                 0, 0,  
+                                 self.stdscr.getmaxyx()[0]-1, self.stdscr.getmaxyx()[1]-1)
+        self.scrollview.noutrefresh(0, self.scroll_x,
+                                    2, 0,
+                                    self.stdscr.getmaxyx()[0]-2, self.stdscr.getmaxyx()[1]-1)
+        if self.status:
+            self.status.noutrefresh()
+        curses.doupdate()
+
+    def _repaint_status(self):
+        """
+        Show how the query being run is getting on, on the bottom line
+        """
+        height, width = self.stdscr.getmaxyx()
+        if self.status is None or self.status.getbegyx()[0] != height-1 \
+                or self.status.getmaxyx()[1] != width:
+            self.status = curses.newwin(1, width, height-1, 0)
+        parts = ['%i rows' % self.worker.num_rows]
+        if self.filters or self.order_by is not None:
+            parts.append(self.worker.query.describe())
+        status = self.worker.get_status()
+        if self.worker.finished or self.worker.paused:
+            if self.query.can_refine():
+                status += ' (s/S: sort, f/e: filter, r: reset)'
+            else:
+                status += " (can't sort or filter: the input can't be read again)"
+        text = ' | '.join(parts + [status])
+        self.status.erase()
+        # (the last cell of the screen can't be written to)
+        self.status.addnstr(0, 0, text.ljust(width), width-1, curses.A_REVERSE)
+
+    def set_rows(self, rows):
+        """
+        Show a new set of result rows (which are only fetched as they're
+        scrolled to)
+        """
+        if self.pages is not None:
+            self.pages.close()
+        self.pages = ResultPages(rows)
+        self.col_widths = [len(col_name) for col_name in self.query.expr_names]
+        self.row = 0
+        self.scroll_y = 0
+
+        self.stdscr.clear()
+        self.stdscr.refresh()
+        self.paint()
+
+    def refine(self, filters, order_by, descending):
+        """
+        Show the query's result with the given filters and sort order,
+        querying the table it loaded rather than reading its input again
+        (see squeal.query.RefinedQuery)
+        """
+        from squeal.query import RefinedQuery
+        if not self.query.can_refine():
+            # (the rows aren't loaded, and reading them again from a stream
+            # would miss those already read)
+            return
+        if not self.worker.finished:
+            if self.query.loaded:
+                # (the connection to the table can only run one query at a
+                # time)
+                self.worker.cancel()
+            elif self.worker.paused:
+                # (a query run without sqlite, waiting for its rows to be
+                # scrolled to; its input will be loaded afresh)
+                self.worker.stop()
+            else:
+                # (the input is still being read)
+                return
+            self.worker.thread.join()
+        self.filters = filters
+        self.order_by = order_by
+        self.descending = descending
+        self.worker = QueryWorker(RefinedQuery(self.query, filters, order_by,
+                                               descending))
+        self.set_rows([])
+        self.stdscr.timeout(int(PROGRESS_INTERVAL * 1000))
+
+    def _widen_columns(self, rows):
+        """
+        Widen the columns as need be to fit the given rows' values (as
+        strings), returning whether any were
+        """
+        widened = False
+        for values in rows:
+            for col_idx, value in enumerate(values):
+                if len(value) > self.col_widths[col_idx]:
+                    self.col_widths[col_idx] = len(value)
+                    widened = True
+        return widened
+
+    def paint(self):
+        """
+        Draw the rows scrolled to (fetching those, and a screenful beyond,
+        if need be)
+        """
+        visible = self.get_visible_rows()
+        self.pages.fetch(self.scroll_y + 2 * visible)
+        rows = [[str(value) for value in row]
+                for row in self.pages.get_rows(self.scroll_y,
+                                               self.scroll_y + visible)]
+
+        # Only the rows on screen are laid out, so columns widen as wider
+        # values are scrolled to:
+        if self._widen_columns(rows) or not self.column_x:
+            x = 0
+            self.column_x = []
+            for i in range(len(self.col_widths)):
+                self.column_x.append(x)
+                x += self.col_widths[i] + 1
+            self.maxx = x
+            self.heading = None
+
+        # The pads are only as tall as the screen:
+        if self.heading is None \
+                or self.scrollview.getmaxyx()[0] != max(1, visible):
+            self.heading = curses.newpad(2, self.maxx+1)
+            self.scrollview = curses.newpad(max(1, visible), self.maxx+1)
+        else:
+            self.heading.erase()
+            self.scrollview.erase()
         self._repaint_heading()
-        self.heading.refresh(0, self.scroll_x,  
-                             0, 0,  
-                             self.stdscr.getmaxyx()[0]-1, self.stdscr.getmaxyx()[1]-1)
-        self.scrollview.refresh(self.scroll_y, self.scroll_x,
-                                2, 0,
-                                self.stdscr.getmaxyx()[0]-1, self.stdscr.getmaxyx()[1]-1)
+        for y, values in enumerate(rows):
+            self._repaint_row(y, self.scroll_y + y, values)
+        if self.worker:
+            self._repaint_status()
+        self.refresh()
+
+    def poll_worker(self):
+        """
+        Let any rows that have come from the query being run be fetched
+        (which only takes them from the worker as they're scrolled to, so
+        that the query waits whilst they aren't)
+        """
+        # (checking whether it's finished first, so as not to miss any rows)
+        finished = self.worker.finished
+        if self.pages.finished and self.worker.pending:
+            self.pages.append(self.worker.iter_rows())
+        if finished:
+            # (nothing more to wait for)
+            self.stdscr.timeout(-1)
+
+    def poll_follower(self, follower):
+        """
+        Show any update to the result of a query being followed
+        """
+        from squeal.follow import POLL_INTERVAL
+        update = follower.poll()
+        if update:
+            replace, rows = update
+            if replace:
+                self.set_rows(rows)
+            else:
+                self.pages.append(rows)
+                self.paint()
+        # Don't wait for keypresses whilst there's more input to read:
+        if follower.finished:
+            self.stdscr.timeout(-1)
+        elif follower.idle:
+            self.stdscr.timeout(int(POLL_INTERVAL * 1000))
+        else:
+            self.stdscr.timeout(0)
 
     def wrapped_main(self, stdscr):
         self.stdscr = stdscr
         stdscr.addstr(0,0, 'Running query')
         stdscr.refresh()
 
-        iter = self.query.execute()
-        self.table = table.Table(columnHeadings=self.query.expr_names)
-        for row in iter:
-            self.table.add_row(row)
-            self.rows.append(row)
-        self.col_widths = self.table._calc_col_widths()
-        x = 0
-        self.column_x = []
-        for i in range(len(self.col_widths)):
-            self.column_x.append(x)
-            x += self.col_widths[i] + 1
-        self.maxx = x
+        follower = None
+        if self.options.follow:
+            # Keep showing the latest result as the input grows:
+            from squeal.follow import QueryFollower
+            follower = QueryFollower(self.query)
+            self.set_rows([])
+            self.poll_follower(follower)
+        else:
+            # Run the query in the background, showing the rows as they
+            # come:
+            self.worker = QueryWorker(self.query)
+            self.set_rows([])
+            self.stdscr.timeout(int(PROGRESS_INTERVAL * 1000))
 
-        # Render the table:
-        stdscr.clear()
-        stdscr.refresh()
-
-        self.heading = curses.newpad(2, self.maxx+1)
-        self._repaint_heading()
-        self.scrollview = curses.newpad(self.get_num_rows(), self.maxx+1)
-        # populate scrollable area:
-        for i, row in enumerate(self.rows):
-            self._repaint_row(i, row)
-        self.refresh()
+        try:
+            self.run(follower)
+        finally:
+            if self.worker and not self.worker.finished:
+                self.worker.cancel()
+            self.pages.close()
 
+    def run(self, follower):
+        stdscr = self.stdscr
         while True:
             c = stdscr.getch()
-            old_row = self.row
-            old_col = self.col
+            if self.worker:
+                self.poll_worker()
+            if c == -1:
+                # (no keypress before the timeout)
+                if follower:
+                    self.poll_follower(follower)
+                else:
+                    self.paint()
+                continue
+            visible = self.get_visible_rows()
             if c == ord('q'): 
                 break  # quit
+            elif c == ord('c'):
+                if self.worker and not self.worker.finished:
+                    self.worker.cancel()
+            elif c in (ord('s'), ord('S')) and self.worker:
+                # Sort by the current column (descending, with "S"):
+                self.refine(self.filters, self.col, c == ord('S'))
+                continue
+            elif c in (ord('f'), ord('e')) and self.worker:
+                # Filter to the rows with (or, with "e", without) the current
+                # cell's value in the current column:
+                rows = self.pages.get_rows(self.row, self.row + 1)
+                if rows:
+                    self.refine(self.filters + [(self.col, rows[0][self.col],
+                                                 c == ord('f'))],
+                                self.order_by, self.descending)
+                continue
+            elif c == ord('r') and self.worker:
+                # Back to the query's own result:
+                if self.filters or self.order_by is not None:
+                    self.refine([], None, False)
+                continue
             elif c == curses.KEY_HOME:
                 self.row = 0
                 self.scroll_y = 0
             elif c == curses.KEY_END:
+                self.pages.fetch_all()
                 self.row = self.get_num_rows()-1
                 self.scroll_y = self.get_max_scroll_y()
             elif c == curses.KEY_UP:
                 if self.row > 0:
                     self.row -= 1
-                    if self.row < self.scroll_y:
-                        self.scroll_y -= (self.get_visible_rows()-1)
             elif c == curses.KEY_DOWN:
+                self.pages.fetch(self.row + 2)
                 if self.row < self.get_num_rows()-1:
                     self.row += 1
-                    if self.row > self.scroll_y+self.get_visible_rows():
-                        self.scroll_y += (self.get_visible_rows()-1)
             elif c == curses.KEY_LEFT:
                 if self.col > 0:
                     self.col -= 1
@@ -145,40 +552,39 @@ class Tui(object):
                     self.col += 1
                     if self.column_x[self.col]+self.col_widths[self.col] > self.scroll_x+self.stdscr.getmaxyx()[1]:
                         self.scroll_x += self.stdscr.getmaxyx()[1]
-                        if self.scroll_x >= self.get_max_scroll_x():
-                            self.scroll_x = self.get_max_scroll_x()-1
             elif c == curses.KEY_PPAGE:
-                self.row -= (stdscr.getmaxyx()[0]-3)
-                if self.row < 0:
-                    self.row = 0
-                if self.row < self.scroll_y:
-                    self.scroll_y -= self.get_visible_rows()
+                self.row = max(0, self.row - visible)
+                self.scroll_y -= visible
             elif c == curses.KEY_NPAGE:
-                self.row += (stdscr.getmaxyx()[0]-3)
-                if self.row >= self.get_num_rows()-1:
-                    self.row = self.get_num_rows()-1
-                if self.row > self.scroll_y+self.get_visible_rows():
-                    self.scroll_y += self.get_visible_rows()
+                self.pages.fetch(self.row + visible + 1)
+                self.row = max(0, min(self.row + visible,
+                                      self.get_num_rows()-1))
+                self.scroll_y += visible
 
+            # Scroll a page at a time to keep the current row on screen:
+            if self.row < self.scroll_y:
+                self.scroll_y = self.row - (visible-1)
+            elif self.row >= self.scroll_y + visible:
+                self.scroll_y = self.row
+            self.pages.fetch(self.scroll_y + visible)
+            if self.scroll_y>self.get_max_scroll_y():
+                self.scroll_y = self.get_max_scroll_y()
             if self.scroll_y<0:
                 self.scroll_y = 0
-            if self.scroll_x<0:
-                self.scroll_x = 0
-            if self.scroll_y>=self.get_max_scroll_y():
-                self.scroll_y = self.get_max_scroll_y()-1
             if self.scroll_x>self.get_max_scroll_x():
                 self.scroll_x = self.get_max_scroll_x()
+            if self.scroll_x<0:
+                self.scroll_x = 0
 
-            if old_row!=self.row or old_col!=self.col:
-                self._repaint_cell(old_row, old_col)
-                self._repaint_cell(self.row, self.col)
-                
-            self.refresh()
+            self.paint()
             #stdscr.addstr(0,0, "(%i, %i, %i, %i)" %(self.row, self.col, self.scroll_y, self.scroll_x))
             stdscr.refresh()
 
     def get_num_rows(self):
-        return len(self.rows)
+        """
+        Get the number of rows fetched so far
+        """
+        return self.pages.num_rows
 
     def get_num_cols(self):
         return len(self.query.expr_names)
@@ -191,3 +597,155 @@ class Tui(object):
 
     def get_max_scroll_x(self):
         return self.maxx - self.stdscr.getmaxyx()[1]
+
+import unittest
+class ResultPagesTests(unittest.TestCase):
+    def test_paging(self):
+        rows = [(i, 'row %i' % i) for i in range(1050)]
+        pages = ResultPages(iter(rows), page_size=100, max_pages=2)
+        self.assertEquals(pages.get_rows(0, 10), rows[:10])
+        # (fetching no more than asked for)
+        self.assertEquals((pages.num_rows, pages.finished), (10, False))
+        self.assertEquals(pages.get_rows(95, 310), rows[95:310])
+        self.assertEquals(len(pages.pages), 2)
+        # Scrolling back reads evicted pages back in:
+        self.assertEquals(pages.get_rows(5, 150), rows[5:150])
+        self.assertEquals(pages.get_rows(990, 2000), rows[990:])
+        self.assertEquals((pages.num_rows, pages.finished), (1050, True))
+        self.assert_(len(pages.pages) <= 2)
+        for start in [0, 99, 100, 555, 1000, 1049]:
+            self.assertEquals(pages.get_rows(start, start + 60),
+                              rows[start:start + 60])
+        pages.close()
+
+    def test_worker(self):
+        import os
+        from squeal.query import QueryParser, Options
+        from squeal.httpdlog import HttpdLog
+        from squeal.testing import make_tmpdir, write_httpd_log
+        path = os.path.join(make_tmpdir(self), 'access_log')
+        write_httpd_log(path, range(1000), host=lambda i: 1)
+        for engine, cancel in [('auto', False), ('sqlite', False),
+                               ('sqlite', True)]:
+            q = QueryParser().parse_args(Options(engine=engine),
+                                         ['size from', HttpdLog(path),
+                                          'order by size'])
+            if cancel:
+                # (before it gets anywhere)
+                q.cancel()
+            worker = QueryWorker(q)
+            if cancel:
+                worker.cancel()
+            worker.thread.join()
+            self.assert_(worker.finished)
+            self.assertEquals(worker.error, None)
+            rows = worker.take_rows()
+            if cancel:
+                self.assertEquals(worker.get_status(), 'Cancelled')
+                self.assertEquals(rows, [])
+            else:
+                self.assertEquals(rows, [(i,) for i in range(1000)])
+                self.assertEquals(q.get_progress(),
+                                  (os.path.getsize(path), os.path.getsize(path)))
+                self.assert_(worker.get_status().startswith('Finished'))
+                # Re-sorting queries the loaded table:
+                from squeal.query import RefinedQuery
+                worker = QueryWorker(RefinedQuery(q, [], 0, True))
+                worker.thread.join()
+                self.assertEquals(worker.error, None)
+                self.assertEquals(worker.take_rows(),
+                                  [(i,) for i in reversed(range(1000))])
+                self.assert_(q.loaded)
+
+    def test_parallel_progress(self):
+        # Input read in worker processes can't say how far it's got:
+        import os
+        from squeal.query import QueryParser, Options
+        from squeal.testing import make_tmpdir, write_httpd_log
+        tmpdir = make_tmpdir(self)
+        paths = []
+        for name in ['access_log', 'access_log.1']:
+            path = os.path.join(tmpdir, name)
+            write_httpd_log(path, range(1000), host=lambda i: 1)
+            paths.append(path)
+        for jobs, progress in [(1, 2 * os.path.getsize(paths[0])), (2, None)]:
+            q = QueryParser().parse_args(Options(jobs=jobs, chunk_size=0.01),
+                                         ['size from'] + paths)
+            worker = QueryWorker(q)
+            worker.thread.join()
+            self.assertEquals(worker.error, None)
+            self.assertEquals(len(worker.take_rows()), 2000)
+            if progress is None:
+                self.assertEquals(q.get_progress(), None)
+            else:
+                self.assertEquals(q.get_progress(), (progress, progress))
+
+    def test_backpressure(self):
+        class Numbers(object):
+            def execute(self):
+                return ((i,) for i in range(MAX_PENDING_ROWS * 2))
+            def cancel(self):
+                pass
+            def get_progress(self):
+                return None
+        worker = QueryWorker(Numbers())
+        # The query waits whilst its rows aren't being taken:
+        deadline = time.time() + 10
+        while len(worker.pending) <= MAX_PENDING_ROWS \
+                and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        self.assertEquals(worker.num_rows, MAX_PENDING_ROWS + 1)
+        self.assert_(not worker.finished)
+        self.assert_(worker.get_status().startswith('Paused'))
+        pages = ResultPages(worker.iter_rows())
+        self.assertEquals(pages.get_rows(0, 10), [(i,) for i in range(10)])
+        self.assertEquals(len(worker.pending), MAX_PENDING_ROWS - 9)
+        # ...and carries on as they are:
+        deadline = time.time() + 10
+        while not worker.finished and time.time() < deadline:
+            pages.append(worker.iter_rows())
+            time.sleep(0.01)
+        self.assert_(worker.finished)
+        pages.append(worker.iter_rows())
+        pages.fetch_all()
+        self.assertEquals(pages.num_rows, MAX_PENDING_ROWS * 2)
+        self.assertEquals(worker.num_rows, MAX_PENDING_ROWS * 2)
+        self.assertEquals(pages.get_rows(MAX_PENDING_ROWS * 2 - 1,
+                                         MAX_PENDING_ROWS * 2),
+                          [(MAX_PENDING_ROWS * 2 - 1,)])
+        pages.close()
+
+    def test_refine_paused(self):
+        from squeal.query import QueryParser, Options, RefinedQuery, \
+             FromMemory, IntColumn
+        src = FromMemory([IntColumn('size')],
+                         [dict(size=i) for i in range(MAX_PENDING_ROWS * 2)])
+        q = QueryParser().parse_args(Options(), ['size from', src])
+        worker = QueryWorker(q)
+        deadline = time.time() + 10
+        while not worker.paused and time.time() < deadline:
+            time.sleep(0.01)
+        self.assert_(worker.paused)
+        self.assert_(not q.loaded)
+        # Stopping the query leaves its input to be loaded afresh:
+        worker.stop()
+        worker.thread.join()
+        worker = QueryWorker(RefinedQuery(q, [], 0, True))
+        rows = []
+        while not worker.finished or worker.pending:
+            rows.extend(worker.iter_rows())
+            time.sleep(0.01)
+        self.assertEquals(worker.error, None)
+        self.assertEquals(len(rows), MAX_PENDING_ROWS * 2)
+        self.assertEquals(rows[0], (MAX_PENDING_ROWS * 2 - 1,))
+        self.assert_(q.loaded)
+
+    def test_append(self):
+        pages = ResultPages([], page_size=3)
+        pages.fetch_all()
+        self.assertEquals((pages.num_rows, pages.finished), (0, True))
+        pages.append([(1,), (2,)])
+        pages.append([(3,), (4,)])
+        self.assertEquals(pages.get_rows(0, 10), [(1,), (2,), (3,), (4,)])
+        self.assertEquals(pages.num_rows, 4)
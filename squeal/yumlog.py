@@ -28,6 +28,45 @@ class YumLog(FileDictSource):
                 StringColumn('release')]
                 
 
+    # The formats that lines come in, in order of priority (as some lines
+    # match more than one of them):
+    patterns = Alternatives('(\S\S\S \d\d \d\d:\d\d:\d\d) (\S+): ', ['time', 'event'],
+        # e.g. "Apr 04 16:04:34 Updated: eclipse-cdt.i386 1:3.0.2-1jpp_3fc"
+        [('(\S+)\.(\S+) (\S+):(\S+)-(\S+)',
+          ['name', 'arch', 'epoch', 'version', 'release']),
+
+         # e.g. "Apr 04 16:08:07 Installed: kernel-devel.i686 2.6.16-1.2118_FC6"
+         # or "Apr 04 16:04:36 Updated: glx-utils.i386 6.5-1"
+         ('(\S+)\.(\S+) (\S+)-(\S+)',
+          ['name', 'arch', 'version', 'release']),
+
+         # e.g. "Feb 14 19:04:59 Updated: 1:net-snmp-libs-5.4.2.1-2.fc10.i386"
+         ('(\S+):(\S+)-(\S+)-(\S+)\.(\S+)',
+          ['epoch', 'name', 'version', 'release', 'arch']),
+
+         # e.g. "Mar 18 21:29:17 Installed: ipython-0.8.4-1.fc10.noarch"
+         ('(\S+)-(\S+)-(\S+)\.(\S+)',
+          ['name', 'version', 'release', 'arch']),
+
+         # e.g. "Nov 19 21:59:43 Updated: SDL_mixer - 1.2.8-4.fc8.i386"
+         ('(\S+) - (\S+)-(\S+)\.(\S+)',
+          ['name', 'version', 'release', 'arch']),
+
+         # e.g. "Dec 18 14:21:26 Erased: Django-docs"
+         ('(\S+)',
+          ['name'])])
+
+    def __init__(self, filename):
+        FileDictSource.__init__(self, filename)
+        # (lines matched by each of the patterns)
+        self.pattern_hits = [0] * len(self.patterns.regexps)
+        self.set_wanted_columns(None)
+
+    def set_wanted_columns(self, names):
+        FileDictSource.set_wanted_columns(self, names)
+        self.tuple_indexes = self.patterns.get_tuple_indexes(
+            self.get_wanted_names())
+
     def parse_as_dict(self, line):
         '''
          Examples:
@@ -46,48 +85,30 @@ class YumLog(FileDictSource):
           "Feb 14 19:04:59 Updated: 1:net-snmp-libs-5.4.2.1-2.fc10.i386"
           "Feb 14 19:05:00 Updated: rpm-build-4.6.0-0.rc3.1.fc10.i386"
         '''
-        date_group = '(\S\S\S \d\d \d\d:\d\d:\d\d)'
-        # e.g. "Apr 04 16:04:34 Updated: eclipse-cdt.i386 1:3.0.2-1jpp_3fc"          
-        m = re.match(date_group +' (\S+): (\S+)\.(\S+) (\S+):(\S+)-(\S+)', line)
-        if m:
-            return dict(zip(['time', 'event', 'name', 'arch', 'epoch', 'version', 'release'], 
-                            m.groups()))                        
-
-        # e.g. "Apr 04 16:08:07 Installed: kernel-devel.i686 2.6.16-1.2118_FC6"
-        m = re.match(date_group +' (\S+): (\S+)\.(\S+) (\S+)-(\S+)', line)
-        if m:
-            return dict(zip(['time', 'event', 'name', 'arch', 'version', 'release'], 
-                            m.groups()))                        
-
-        # e.g. "Apr 04 16:04:36 Updated: glx-utils.i386 6.5-1"
-
-        # e.g. "Feb 14 19:04:59 Updated: 1:net-snmp-libs-5.4.2.1-2.fc10.i386"
-        m = re.match(date_group +' (\S+): (\S+):(\S+)-(\S+)-(\S+)\.(\S+)', line)
-        if m:
-            return dict(zip(['time', 'event', 'epoch', 'name', 'version', 'release', 'arch'], 
-                            m.groups()))                        
-
-
-        # e.g. "Mar 18 21:29:17 Installed: ipython-0.8.4-1.fc10.noarch"
-        m = re.match(date_group +' (\S+): (\S+)-(\S+)-(\S+)\.(\S+)', line)
-        if m:
-            return dict(zip(['time', 'event', 'name', 'version', 'release', 'arch'], 
-                            m.groups()))                        
-
-        # e.g. "Nov 19 21:59:43 Updated: SDL_mixer - 1.2.8-4.fc8.i386"
-        m = re.match(date_group +' (\S+): (\S+) - (\S+)-(\S+)\.(\S+)', line)
-        if m:
-            return dict(zip(['time', 'event', 'name', 'version', 'release', 'arch'], 
-                            m.groups()))                        
-
-        # e.g. "Dec 18 14:21:26 Erased: Django-docs"
-        m = re.match(date_group +' (\S+): (\S+)', line)
-        if m:
-            return dict(zip(['time', 'event', 'name'], 
-                            m.groups()))
-        
-        # unmatched
-        return None
+        i, d = self.patterns.match(line)
+        if d is None:
+            # unmatched
+            return None
+        self.pattern_hits[i] += 1
+        return d
+
+    def iter_tuples(self):
+        return self._iter_parsed(self.parse_as_tuple)
+
+    def get_tuple_parser(self):
+        return self.parse_as_tuple
+
+    def parse_as_tuple(self, line):
+        # (the values that the matching format lacks are None)
+        i, t = self.patterns.match_tuple(line, self.tuple_indexes)
+        if t is None:
+            # unmatched
+            return None
+        self.pattern_hits[i] += 1
+        return t
+
+    def get_pattern_stats(self):
+        return list(zip(self.patterns.regexps, self.pattern_hits))
 
 import unittest
 class Tests(unittest.TestCase):
@@ -118,6 +139,43 @@ class Tests(unittest.TestCase):
         self.assertEquals(d['time'], 'Dec 18 14:21:26')
         self.assertEquals(d['event'], 'Erased')
         self.assertEquals(d['name'], 'Django-docs')
+
+    def test_pattern_stats(self):
+        p = YumLog('')
+        for line in ["Apr 04 16:04:34 Updated: eclipse-cdt.i386 1:3.0.2-1jpp_3fc",
+                     "Apr 04 16:04:36 Updated: glx-utils.i386 6.5-1",
+                     "Mar 18 21:29:17 Installed: ipython-0.8.4-1.fc10.noarch",
+                     "Feb 14 19:05:00 Updated: rpm-build-4.6.0-0.rc3.1.fc10.i386",
+                     "Dec 18 14:21:26 Erased: Django-docs",
+                     "not a yum log line"]:
+            p.parse_as_dict(line)
+        self.assertEquals([hits for (regexp, hits) in p.get_pattern_stats()],
+                          [1, 1, 0, 2, 0, 1])
+        # Nothing is left over from a previous line's format:
+        d = p.parse_as_dict("Nov 19 21:59:43 Updated: SDL_mixer - 1.2.8-4.fc8.i386")
+        self.assertEquals(d, dict(time='Nov 19 21:59:43', event='Updated',
+                                  name='SDL_mixer', version='1.2.8',
+                                  release='4.fc8', arch='i386'))
+
+    def test_tuples(self):
+        p = YumLog('')
+        lines = ["Apr 04 16:04:34 Updated: eclipse-cdt.i386 1:3.0.2-1jpp_3fc",
+                 "Apr 04 16:04:36 Updated: glx-utils.i386 6.5-1",
+                 "Feb 14 19:04:59 Updated: 1:net-snmp-libs-5.4.2.1-2.fc10.i386",
+                 "Nov 19 21:59:43 Updated: SDL_mixer - 1.2.8-4.fc8.i386",
+                 "Dec 18 14:21:26 Erased: Django-docs",
+                 "not a yum log line"]
+        for wanted in [None, set(['epoch']), set(['release', 'name']), set()]:
+            p.set_wanted_columns(wanted)
+            names = p.get_wanted_names()
+            for line in lines:
+                d = p.parse_as_dict(line)
+                if d is None:
+                    self.assertEquals(p.parse_as_tuple(line), None)
+                else:
+                    # (the values that the line's format lacks are None)
+                    self.assertEquals(p.parse_as_tuple(line),
+                                      tuple(map(d.get, names)))
         
 
 if __name__=='__main__':